@@ -0,0 +1,415 @@
+#!/usr/bin/env python
+"""OAuth 2.0 server benchmarks - end-to-end load test of the bearer token
+example run in-process
+
+The Paste pipeline of examples/bearer_tok - Beaker sessions, repoze.who, the
+authentication form, client authorisation, the OAuth 2.0 server and the
+resource server - is loaded from a copy of the example configuration with the
+access token and authorisation grant registers switched to each backend in
+turn.  Simulated users, each with their own session cookies, are run
+concurrently through the authorisation code flow:
+
+    authorize_redirect  GET /oauth/authorize, redirected to the login form
+    login               POST /authentication/login
+    authorize           GET /oauth/authorize, redirected with a grant code
+    access_token        POST /oauth/access_token
+    resource            GET /resource1.html with the bearer token
+
+Requests are made by calling the WSGI application directly so no network is
+needed.  Throughput and latency percentiles for each step and backend are
+written as JSON.
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "(C) 2026 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+__revision__ = "$Id$"
+
+from ConfigParser import RawConfigParser
+import json
+import logging
+import optparse
+from os import path
+import Queue
+import shutil
+import sys
+import tempfile
+import threading
+from timeit import default_timer
+import urllib
+import urlparse
+
+from paste.deploy import loadapp
+from webob import Request
+
+from stats import environment, format_table, summarise, write_results
+
+import ndg.oauth.server.examples.bearer_tok
+
+EXAMPLE_DIR = path.dirname(ndg.oauth.server.examples.bearer_tok.__file__)
+CONFIG_FILENAME = 'bearer_tok_server_app.ini'
+SERVER_SECTION = 'filter:OAuth2ServerFilter'
+SESSION_SECTION = 'filter:BeakerSessionFilter'
+WHO_SECTION = 'filter:repoze_who'
+
+BASE_URL = 'https://localhost:5000'
+USERNAME = 'rwilkinson_local'
+PASSWORD = 'changeme'
+CLIENT_ID = '22'
+CLIENT_SECRET = '1992301zAj2n3nn42cjNnMqpwO'
+REDIRECT_URI = 'http://localhost:5002/oauth2/oauth_redirect'
+SCOPE = 'https://localhost:5000/resource1.html'
+RESOURCE_PATH = '/resource1.html'
+
+REGISTERS = ('accesstokenregister', 'authorizationgrantregister')
+
+# Register options for each backend, in addition to the expiry time and data
+# directory
+BACKENDS = (
+    ('memory', {'type': 'memory'}),
+    ('file', {'type': 'file'}),
+    ('sqlite', {'type': 'sqlite'}),
+    ('sqlite_lru', {'type': 'sqlite', 'memory_cache_size': '100000'}),
+)
+
+STEPS = ('authorize_redirect', 'login', 'authorize', 'access_token',
+         'resource')
+
+DEFAULT_USERS = 2000
+DEFAULT_CONCURRENCY = 200
+DEFAULT_RESOURCE_REQUESTS = 5
+DEFAULT_WARMUP_USERS = 20
+
+
+class StepFailed(Exception):
+    """Raised when a step of the flow gets an unexpected response"""
+
+
+def write_config(work_dir, backend_options, session_type):
+    """Copies the example and writes its configuration with the registers
+    and sessions using the given backends.
+    @type work_dir: str
+    @param work_dir: directory to copy the example to
+    @type backend_options: dict
+    @param backend_options: register cache options
+    @type session_type: str
+    @param session_type: Beaker session type
+    @rtype: str
+    @return: configuration file path
+    """
+    shutil.copytree(EXAMPLE_DIR, work_dir,
+                    ignore=shutil.ignore_patterns('authn', '*.pyc'))
+    config_filepath = path.join(work_dir, CONFIG_FILENAME)
+
+    config = RawConfigParser()
+    config.optionxform = str
+    config.read(config_filepath)
+
+    for register in REGISTERS:
+        prefix = 'oauth2server.cache.%s.' % register
+        for option in config.options(SERVER_SECTION):
+            if option.startswith(prefix):
+                config.remove_option(SERVER_SECTION, option)
+
+        config.set(SERVER_SECTION, prefix + 'expire', '86400')
+        config.set(SERVER_SECTION, prefix + 'data_dir',
+                   '%(here)s/authn/' + register)
+        for name, value in backend_options.items():
+            config.set(SERVER_SECTION, prefix + name, value)
+
+    config.set(SESSION_SECTION, 'beaker.session.type', session_type)
+
+    # repoze.who logs each request to stdout at debug level in the example.
+    config.set(WHO_SECTION, 'log_level', 'error')
+
+    with open(config_filepath, 'w') as config_file:
+        config.write(config_file)
+    return config_filepath
+
+
+class SimulatedUser(object):
+    """A user agent with its own session cookies, which logs in, authorises
+    the client and then uses the resource with the token the client gets.
+    """
+    AUTHZ_PATH = '/oauth/authorize?' + urllib.urlencode({
+        'response_type': 'code',
+        'client_id': CLIENT_ID,
+        'redirect_uri': REDIRECT_URI,
+        'scope': SCOPE})
+
+    def __init__(self, app, record):
+        """
+        @type app: callable
+        @param app: WSGI application
+        @type record: callable
+        @param record: called with the step name and duration, or None if the
+        step failed
+        """
+        self.app = app
+        self.record = record
+        self.cookies = {}
+
+    def request(self, step, path_info, status, method='GET', post=None,
+                headers=None, location_prefix=None):
+        """Makes a request, recording how long it takes or that it failed.
+        @type status: int
+        @param status: expected HTTP status
+        @type location_prefix: str
+        @param location_prefix: expected start of the redirect location
+        @rtype: webob.Response
+        @return: response
+        """
+        req = Request.blank(path_info, base_url=BASE_URL, method=method,
+                            POST=post, headers=headers or {})
+        req.environ['HTTPS'] = '1'
+        if self.cookies:
+            req.headers['Cookie'] = '; '.join('%s=%s' % item
+                                              for item in self.cookies.items())
+        start = default_timer()
+        try:
+            response = req.get_response(self.app)
+        except Exception:
+            self.record(step, None)
+            raise
+        duration = default_timer() - start
+
+        if response.status_int != status or (
+                location_prefix and
+                not (response.location or '').startswith(location_prefix)):
+            self.record(step, None)
+            raise StepFailed('%s: %s %s' % (step, response.status,
+                                            response.location or ''))
+        self.record(step, duration)
+
+        for name, value in response.headerlist:
+            if name.lower() == 'set-cookie':
+                cookie_name, cookie_value = value.split(';')[0].split('=', 1)
+                if cookie_value.strip('"'):
+                    self.cookies[cookie_name] = cookie_value
+        return response
+
+    def run(self, resource_requests):
+        """Runs the flow.
+        @type resource_requests: int
+        @param resource_requests: number of requests for the resource with
+        the token
+        """
+        self.request('authorize_redirect', self.AUTHZ_PATH, 302,
+                     location_prefix=BASE_URL + '/authentication/')
+
+        self.request('login', '/authentication/login', 302, method='POST',
+                     post={'username': USERNAME,
+                           'password': PASSWORD,
+                           'submit': 'Login',
+                           'returnurl': BASE_URL + self.AUTHZ_PATH,
+                           'client_id': CLIENT_ID,
+                           'scope': SCOPE},
+                     location_prefix=BASE_URL + '/oauth/authorize')
+
+        response = self.request('authorize', self.AUTHZ_PATH, 302,
+                                location_prefix=REDIRECT_URI + '?code=')
+        query = urlparse.parse_qs(urlparse.urlparse(response.location).query)
+
+        # The client redeems the code, without the user's cookies.
+        self.cookies = {}
+        response = self.request('access_token', '/oauth/access_token', 200,
+                                method='POST',
+                                post={'grant_type': 'authorization_code',
+                                      'code': query['code'][0],
+                                      'redirect_uri': REDIRECT_URI,
+                                      'client_id': CLIENT_ID,
+                                      'client_secret': CLIENT_SECRET})
+        access_token = json.loads(response.body)['access_token']
+
+        headers = {'Authorization': 'Bearer ' + access_token}
+        for _ in range(resource_requests):
+            self.request('resource', RESOURCE_PATH, 200, headers=headers)
+
+
+class StepRecorder(object):
+    """Collects step durations from the user threads"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.durations = dict((step, []) for step in STEPS)
+        self.errors = dict((step, 0) for step in STEPS)
+
+    def __call__(self, step, duration):
+        with self.lock:
+            if duration is None:
+                self.errors[step] += 1
+            else:
+                self.durations[step].append(duration)
+
+
+def run_users(app, n_users, concurrency, resource_requests, record):
+    """Runs simulated users, concurrency at a time.
+    @rtype: tuple
+    @return: elapsed time in seconds, number of users who completed the flow
+    and the first failure messages
+    """
+    users = Queue.Queue()
+    for i in range(n_users):
+        users.put(i)
+
+    completed = [0]
+    failures = []
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            try:
+                users.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                SimulatedUser(app, record).run(resource_requests)
+            except Exception, e:
+                with lock:
+                    if len(failures) < 10:
+                        failures.append('%s: %s' % (type(e).__name__, e))
+            else:
+                with lock:
+                    completed[0] += 1
+
+    threads = [threading.Thread(target=worker)
+               for _ in range(min(concurrency, n_users))]
+    start = default_timer()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return default_timer() - start, completed[0], failures
+
+
+def run_backend(name, backend_options, opt):
+    """Loads the pipeline with a register backend and runs the users.
+    @rtype: dict
+    @return: results for the backend
+    """
+    tmp_dir = tempfile.mkdtemp(prefix='ndg_oauth_bench_')
+    try:
+        work_dir = path.join(tmp_dir, 'bearer_tok')
+        config_filepath = write_config(work_dir, backend_options,
+                                       opt.session_type)
+        app = loadapp('config:' + config_filepath)
+
+        run_users(app, opt.warmup_users, opt.concurrency,
+                  opt.resource_requests, StepRecorder())
+
+        recorder = StepRecorder()
+        elapsed, completed, failures = run_users(app, opt.users,
+                                                 opt.concurrency,
+                                                 opt.resource_requests,
+                                                 recorder)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    steps = dict((step, summarise(recorder.durations[step], elapsed,
+                                  recorder.errors[step]))
+                 for step in STEPS)
+    return {
+        'register_options': backend_options,
+        'elapsed_seconds': round(elapsed, 4),
+        'users_completed': completed,
+        'users_per_second': round(completed / elapsed, 2),
+        'failures': failures,
+        'steps': steps,
+    }
+
+
+def main():
+    backend_names = [name for name, _ in BACKENDS]
+    parser = optparse.OptionParser(
+        usage='%prog [options]',
+        description='Run simulated users through the authorisation code flow '
+                    'of the bearer token example in-process and report '
+                    'throughput and latency for each step.')
+    parser.add_option("-u",
+                      "--users",
+                      dest="users",
+                      default=DEFAULT_USERS,
+                      type='int',
+                      help="Number of simulated users [%default]")
+    parser.add_option("-c",
+                      "--concurrency",
+                      dest="concurrency",
+                      default=DEFAULT_CONCURRENCY,
+                      type='int',
+                      help="Number of users running at once [%default]")
+    parser.add_option("-r",
+                      "--resource-requests",
+                      dest="resource_requests",
+                      default=DEFAULT_RESOURCE_REQUESTS,
+                      type='int',
+                      help="Resource requests made by each user with their "
+                           "token [%default]")
+    parser.add_option("-b",
+                      "--backend",
+                      dest="backends",
+                      action="append",
+                      choices=backend_names,
+                      help="Register backend to run, may be repeated: %s "
+                           "[all]" % ', '.join(backend_names))
+    parser.add_option("-s",
+                      "--session-type",
+                      dest="session_type",
+                      default='file',
+                      help="Beaker session type [%default]")
+    parser.add_option("-w",
+                      "--warmup-users",
+                      dest="warmup_users",
+                      default=DEFAULT_WARMUP_USERS,
+                      type='int',
+                      help="Users run before measuring [%default]")
+    parser.add_option("-o",
+                      "--output",
+                      dest="output",
+                      default=None,
+                      help="JSON results file [stdout]")
+
+    opt, args = parser.parse_args()
+    if args:
+        parser.error('Unexpected arguments: %s' % ' '.join(args))
+
+    # Failed requests are counted so the application's messages are not
+    # needed.
+    logging.basicConfig(level=logging.ERROR)
+
+    results = {
+        'benchmark': 'bearer_tok_flow',
+        'environment': environment(),
+        'parameters': {
+            'users': opt.users,
+            'concurrency': opt.concurrency,
+            'resource_requests': opt.resource_requests,
+            'session_type': opt.session_type,
+            'warmup_users': opt.warmup_users,
+        },
+        'backends': {},
+    }
+    rows = []
+    for name, backend_options in BACKENDS:
+        if opt.backends and name not in opt.backends:
+            continue
+
+        result = run_backend(name, backend_options, opt)
+        results['backends'][name] = result
+        for step in STEPS:
+            summary = result['steps'][step]
+            rows.append((name, step, summary['count'], summary['errors'],
+                         summary.get('per_second'), summary['p50_ms'],
+                         summary['p95_ms'], summary['p99_ms']))
+        sys.stderr.write('%s: %d/%d users in %.2fs\n' % (
+            name, result['users_completed'], opt.users,
+            result['elapsed_seconds']))
+
+    sys.stderr.write(format_table(rows, ('backend', 'step', 'count', 'errors',
+                                         'req/s', 'p50 ms', 'p95 ms',
+                                         'p99 ms')) + '\n')
+    write_results(results, opt.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,717 @@
+#!/usr/bin/env python
+"""OAuth 2.0 server benchmarks - microbenchmarks of registers, scope utilities
+and authenticators
+
+Each benchmark times one operation called repeatedly: it is warmed up, the
+number of calls per repeat is set from the warm-up rate so that a repeat
+takes at least the minimum time and the time per call is measured over a
+number of repeats with garbage collection disabled.  Inputs are drawn from a
+fixed random seed so that runs are repeatable.
+
+Results are written as JSON.  Given a baseline, i.e., the results of an
+earlier run, benchmarks whose median and minimum times have both increased by
+more than the threshold are reported as regressions and the exit status is
+1.
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "(C) 2026 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+__revision__ = "$Id$"
+
+import base64
+import fnmatch
+import gc
+import itertools
+import json
+import logging
+import math
+import optparse
+from os import path
+import random
+import shutil
+import sys
+import tempfile
+from timeit import default_timer
+import uuid
+
+from webob import Request
+
+from stats import environment, format_table, percentile, write_results
+
+from ndg.oauth.server.lib.authenticate.certificate_authenticator import \
+    CertificateAuthenticator
+from ndg.oauth.server.lib.authenticate.password_authenticator import \
+    PasswordAuthenticator
+from ndg.oauth.server.lib.register.access_token import (AccessToken,
+                                                        AccessTokenRegister)
+from ndg.oauth.server.lib.register.authorization_grant import (
+                                                AuthorizationGrant,
+                                                AuthorizationGrantRegister)
+from ndg.oauth.server.lib.register.client import ClientRegister
+from ndg.oauth.server.lib.register.client_authorization import (
+                                                ClientAuthorization,
+                                                ClientAuthorizationRegister)
+import ndg.oauth.server.lib.register.scopeutil as scopeutil
+from ndg.oauth.server.lib.utils.secret_hash import hash_secret
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+DEFAULT_BACKENDS = ('memory', 'sqlite', 'sqlite_lru')
+DEFAULT_REPEATS = 7
+DEFAULT_MIN_TIME = .1
+DEFAULT_WARMUP_TIME = .1
+DEFAULT_THRESHOLD = .1
+
+# Register cache options for each backend.  The in-memory LRU cache is
+# disabled except for sqlite_lru so that the storage itself is measured.
+BACKENDS = {
+    'memory': {'type': 'memory', 'memory_cache_size': '0'},
+    'file': {'type': 'file', 'memory_cache_size': '0'},
+    'sqlite': {'type': 'sqlite', 'memory_cache_size': '0'},
+    'sqlite_lru': {'type': 'sqlite', 'memory_cache_size': '10000'},
+}
+
+# Numbers of scopes held by a token or requested by a client
+SCOPE_COUNTS = (1, 5, 20)
+SCOPE_VOCABULARY_SIZE = 512
+SCOPE_TEMPLATE = 'https://data.example.org/dataset/%d/read'
+
+N_CLIENTS = 1000
+TOKEN_LIFETIME = 86400
+LOOKUP_KEYS = 10000
+SEED = 0
+CLIENT_SECRET = 'benchmark-secret'
+HASH_ITERATIONS = 1000
+CACHED_CLIENTS = 100
+
+
+class Benchmark(object):
+    """
+    An operation to time with the parameters it is set up with.  setup is
+    called just before timing and returns the operation, a callable taking no
+    arguments.
+    """
+
+    def __init__(self, name, params, setup, teardown=None, max_ops=None):
+        """
+        @type name: str
+        @param name: name of the function or method benchmarked
+        @type params: dict
+        @param params: parameters, included in the benchmark key
+        @type setup: callable
+        @param setup: function returning the operation
+        @type teardown: callable
+        @param teardown: function called after timing
+        @type max_ops: int
+        @param max_ops: bound on the number of calls, e.g., to keep a register
+        which is written to near its initial size
+        """
+        self.name = name
+        self.params = params
+        self.setup = setup
+        self.teardown = teardown
+        self.max_ops = max_ops
+
+    @property
+    def key(self):
+        """Name and parameters identifying the benchmark in results"""
+        return '%s[%s]' % (self.name, ','.join(['%s=%s' % item for item in
+                                                sorted(self.params.items())]))
+
+
+def _time_loops(op, loops):
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        start = default_timer()
+        for _ in itertools.repeat(None, loops):
+            op()
+        return default_timer() - start
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+
+def time_benchmark(benchmark, repeats, min_time, warmup_time):
+    """Sets up and times a benchmark.
+    @rtype: dict
+    @return: times per call in microseconds over the repeats
+    """
+    op = benchmark.setup()
+    try:
+        # Warm up, in batches so that the timer isn't read on every call.
+        warmup_ops = 0
+        warmup_limit = benchmark.max_ops and max(1, benchmark.max_ops // 10)
+        batch = 1
+        start = default_timer()
+        while True:
+            _time_loops(op, batch)
+            warmup_ops += batch
+            elapsed = default_timer() - start
+            if elapsed >= warmup_time or (warmup_limit and
+                                          warmup_ops >= warmup_limit):
+                break
+            batch = min(batch * 2, 1000)
+
+        loops = max(1, int(math.ceil(min_time * warmup_ops / elapsed)))
+        if benchmark.max_ops:
+            loops = max(1, min(loops, benchmark.max_ops // repeats))
+
+        times = sorted([_time_loops(op, loops) / loops * 1e6
+                        for _ in range(repeats)])
+    finally:
+        if benchmark.teardown is not None:
+            benchmark.teardown()
+
+    mean = sum(times) / len(times)
+    stdev = math.sqrt(sum([(t - mean) ** 2 for t in times]) / len(times))
+    median = percentile(times, .5)
+    return {
+        'name': benchmark.name,
+        'params': benchmark.params,
+        'loops': loops,
+        'repeats': repeats,
+        'min_us': round(times[0], 4),
+        'median_us': round(median, 4),
+        'mean_us': round(mean, 4),
+        'stdev_us': round(stdev, 4),
+        'max_us': round(times[-1], 4),
+        'ops_per_second': round(1e6 / median, 1),
+    }
+
+
+def compare(baseline, results, threshold):
+    """Compares results with a baseline.  A benchmark has regressed if both
+    its median and minimum times have increased by more than the threshold,
+    so that a single noisy repeat isn't reported.
+    @type baseline: dict
+    @param baseline: results of the earlier run
+    @type results: dict
+    @param results: results of this run
+    @type threshold: float
+    @param threshold: fractional change reported, e.g., 0.1 for 10%
+    @rtype: dict
+    @return: comparison for each benchmark in both runs and the keys of
+    those which have regressed
+    """
+    comparison = {}
+    regressions = []
+    for key, new in sorted(results['benchmarks'].items()):
+        old = baseline['benchmarks'].get(key)
+        if old is None:
+            comparison[key] = {'status': 'new'}
+            continue
+
+        ratio = new['median_us'] / old['median_us']
+        min_ratio = new['min_us'] / old['min_us']
+        if ratio > 1 + threshold and min_ratio > 1 + threshold:
+            status = 'regression'
+            regressions.append(key)
+        elif ratio < 1 - threshold and min_ratio < 1 - threshold:
+            status = 'improvement'
+        else:
+            status = 'unchanged'
+
+        comparison[key] = {
+            'status': status,
+            'ratio': round(ratio, 4),
+            'baseline_median_us': old['median_us'],
+            'median_us': new['median_us'],
+        }
+    return {'threshold': threshold,
+            'regressions': regressions,
+            'benchmarks': comparison}
+
+
+def _make_scope_string(rand, n_scopes):
+    return ' '.join([SCOPE_TEMPLATE % i for i in
+                     rand.sample(xrange(SCOPE_VOCABULARY_SIZE), n_scopes)])
+
+
+class _GrantRequest(object):
+    """Attributes of an authorisation request used to make a grant"""
+    def __init__(self, client_id, redirect_uri, scope):
+        self.client_id = client_id
+        self.redirect_uri = redirect_uri
+        self.scope = scope
+
+
+class RegisterFixture(object):
+    """
+    A register in one backend which is filled to the size needed by each
+    benchmark.  Benchmarks are run in order of increasing size so that the
+    register is only added to.
+    """
+
+    def __init__(self, register_class, backend, work_dir):
+        self.register_class = register_class
+        name = register_class.CACHE_NAME
+        config = {'cache.%s.expire' % name: str(TOKEN_LIFETIME),
+                  'cache.%s.data_dir' % name: path.join(work_dir, backend,
+                                                        name)}
+        for option, value in BACKENDS[backend].items():
+            config['cache.%s.%s' % (name, option)] = value
+        self.register = register_class(config)
+        self.keys = []
+        self.rand = random.Random(SEED)
+        self.scope_str = _make_scope_string(self.rand, 5)
+
+    def new_entry(self):
+        """Makes an entry for the register.
+        @return: access token or authorisation grant
+        """
+        i = len(self.keys)
+        if self.register_class is AccessTokenRegister:
+            token = AccessToken('bearer', TOKEN_LIFETIME)
+            token.scope = scopeutil.scopeStringToList(self.scope_str)
+            token.client_id = 'client%d' % (i % N_CLIENTS)
+            token.user_identifier = 'user%d' % (i // 2)
+            token.grant_code = uuid.uuid4().hex
+            return token
+        else:
+            request = _GrantRequest('client%d' % (i % N_CLIENTS),
+                                    'https://client.example.org/redirect',
+                                    self.scope_str)
+            return AuthorizationGrant(uuid.uuid4().hex, request,
+                                      TOKEN_LIFETIME,
+                                      additional_data={
+                                        'user_identifier': 'user%d' % i})
+
+    def add(self):
+        """Adds a new entry to the register."""
+        entry = self.new_entry()
+        if self.register_class is AccessTokenRegister:
+            self.register.add_token(entry)
+            self.keys.append(entry.token_id)
+        else:
+            self.register.add_grant(entry)
+            self.keys.append(entry.code)
+
+    def fill(self, size):
+        while len(self.keys) < size:
+            self.add()
+
+    def lookup_keys(self):
+        """
+        @rtype: itertools.cycle
+        @return: existing keys in random order
+        """
+        return itertools.cycle([self.rand.choice(self.keys)
+                                for _ in xrange(LOOKUP_KEYS)])
+
+
+class Fixtures(object):
+    """Registers and register files shared by the benchmarks, created as
+    they are needed in a temporary directory"""
+
+    def __init__(self):
+        self.work_dir = tempfile.mkdtemp(prefix='ndg_oauth_micro_')
+        self.registers = {}
+        self.client_registers = {}
+
+    def get_register(self, register_class, backend):
+        key = (register_class, backend)
+        if key not in self.registers:
+            self.registers[key] = RegisterFixture(register_class, backend,
+                                                  self.work_dir)
+        return self.registers[key]
+
+    def get_client_register(self, size, hashed):
+        """Gets a client register read from a file of clients with
+        certificate DNs and secrets.
+        @rtype: ndg.oauth.server.lib.register.client.ClientRegister
+        """
+        key = (size, hashed)
+        if key not in self.client_registers:
+            secret = CLIENT_SECRET
+            if hashed:
+                # The same hash is used for all of the clients to save
+                # setup time.  Only verification from the cache is timed so
+                # the number of iterations doesn't matter.
+                secret = hash_secret(CLIENT_SECRET,
+                                     iterations=HASH_ITERATIONS)
+            filename = path.join(self.work_dir, 'client_register_%d_%s.ini' %
+                                 key)
+            with open(filename, 'w') as register_file:
+                register_file.write('[client_register]\nclients=%s\n' %
+                                    ','.join(['c%d' % i
+                                              for i in xrange(size)]))
+                for i in xrange(size):
+                    register_file.write(
+                        '\n[client:c%d]\n'
+                        'name=client %d\n'
+                        'id=client%d\n'
+                        'type=confidential\n'
+                        'redirect_uris=https://client%d.example.org/redirect\n'
+                        'authentication_data=/O=NDG/OU=Security/CN=client%d\n'
+                        'secret=%s\n' % (i, i, i, i, i, secret))
+            self.client_registers[key] = ClientRegister(filename)
+        return self.client_registers[key]
+
+    def close(self):
+        self.registers.clear()
+        self.client_registers.clear()
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+
+def _register_benchmarks(fixtures, sizes, backends):
+    benchmarks = []
+    for size in sizes:
+        for backend in backends:
+            params = {'backend': backend, 'size': size}
+
+            def setup_get_token(backend=backend, size=size):
+                fixture = fixtures.get_register(AccessTokenRegister, backend)
+                fixture.fill(size)
+                keys = fixture.lookup_keys()
+                get_token = fixture.register.get_token
+                scope_str = fixture.scope_str
+                return lambda: get_token(next(keys), scope_str)
+
+            def setup_add_token(backend=backend, size=size):
+                fixture = fixtures.get_register(AccessTokenRegister, backend)
+                fixture.fill(size)
+                return fixture.add
+
+            def setup_add_grant(backend=backend, size=size):
+                fixture = fixtures.get_register(AuthorizationGrantRegister,
+                                                backend)
+                fixture.fill(size)
+                return fixture.add
+
+            # Lookups are run first as adding grows the register.
+            benchmarks.extend([
+                Benchmark('AccessTokenRegister.get_token', params,
+                          setup_get_token),
+                Benchmark('AccessTokenRegister.add_token', params,
+                          setup_add_token, max_ops=size),
+                Benchmark('AuthorizationGrantRegister.add_grant', params,
+                          setup_add_grant, max_ops=size),
+            ])
+    return benchmarks
+
+
+def _scope_benchmarks():
+    benchmarks = []
+    for n_scopes in SCOPE_COUNTS:
+        def setup_parse_cached(n_scopes=n_scopes):
+            scope_str = _make_scope_string(random.Random(SEED), n_scopes)
+            return lambda: scopeutil.scopeStringToList(scope_str)
+
+        def setup_parse_uncached(n_scopes=n_scopes):
+            # More distinct strings than the parse cache holds
+            rand = random.Random(SEED)
+            scope_strs = itertools.cycle([
+                _make_scope_string(rand, n_scopes)
+                for _ in xrange(scopeutil.PARSE_CACHE_SIZE * 4)])
+            return lambda: scopeutil.scopeStringToList(next(scope_strs))
+
+        def setup_granted(n_scopes=n_scopes, as_list=False):
+            scope_str = _make_scope_string(random.Random(SEED), n_scopes)
+            granted = scopeutil.scopeStringToList(scope_str)
+            # Resources typically require one scope.
+            requested = scopeutil.scopeStringToList(granted[-1])
+            if as_list:
+                granted, requested = list(granted), list(requested)
+            return lambda: scopeutil.isScopeGranted(granted, requested)
+
+        def setup_granted_list(n_scopes=n_scopes):
+            return setup_granted(n_scopes, as_list=True)
+
+        def setup_granted_wildcard(n_scopes=n_scopes):
+            scopeutil.setWildcardScopes(True)
+            rand = random.Random(SEED)
+            granted = scopeutil.scopeStringToList(' '.join(
+                ['dataset:project%d:*' % i
+                 for i in rand.sample(xrange(SCOPE_VOCABULARY_SIZE),
+                                      n_scopes)]))
+            requested = scopeutil.scopeStringToList(
+                granted[-1].replace('*', 'tas:read'))
+            return lambda: scopeutil.isScopeGranted(granted, requested)
+
+        params = {'scopes': n_scopes}
+        benchmarks.extend([
+            Benchmark('scopeutil.scopeStringToList',
+                      dict(params, cached=True), setup_parse_cached),
+            Benchmark('scopeutil.scopeStringToList',
+                      dict(params, cached=False), setup_parse_uncached),
+            Benchmark('scopeutil.isScopeGranted',
+                      dict(params, granted='scope_list'), setup_granted),
+            Benchmark('scopeutil.isScopeGranted',
+                      dict(params, granted='list'), setup_granted_list),
+            Benchmark('scopeutil.isScopeGranted',
+                      dict(params, granted='wildcard'),
+                      setup_granted_wildcard,
+                      teardown=lambda: scopeutil.setWildcardScopes(False)),
+        ])
+    return benchmarks
+
+
+def _authorization_benchmarks(fixtures, sizes):
+    benchmarks = []
+    for size in sizes:
+        def setup_client_authorized(size=size):
+            rand = random.Random(SEED)
+            register = ClientAuthorizationRegister()
+            scope_str = _make_scope_string(rand, 2)
+            for i in xrange(size):
+                register.add_client_authorization(ClientAuthorization(
+                    'user%d' % i, 'client%d' % (i % N_CLIENTS), scope_str,
+                    True))
+            users = itertools.cycle([(user, 'client%d' % (user % N_CLIENTS))
+                                     for user in [rand.randrange(size)
+                                                  for _ in xrange(LOOKUP_KEYS)]
+                                     ])
+            def op():
+                user, client_id = next(users)
+                register.is_client_authorized_by_user('user%d' % user,
+                                                      client_id, scope_str)
+            return op
+
+        def setup_certificate(size=size):
+            register = fixtures.get_client_register(size, False)
+            authenticator = CertificateAuthenticator('client', register)
+            rand = random.Random(SEED)
+            # Servers give DNs in RFC 2253 order while the register has
+            # them in slash separated form.
+            requests = itertools.cycle([
+                Request.blank('/', environ={
+                    CertificateAuthenticator.CERT_DN_ENVIRON_KEY:
+                        'CN=client%d,OU=Security,O=NDG' % rand.randrange(size)
+                })
+                for _ in xrange(LOOKUP_KEYS)])
+            return lambda: authenticator.authenticate(next(requests))
+
+        def setup_password(size=size, hashed=False):
+            register = fixtures.get_client_register(size, hashed)
+            authenticator = PasswordAuthenticator('client', register)
+            rand = random.Random(SEED)
+            if hashed:
+                # Clients which authenticate often enough to stay in the
+                # cache of verified secrets
+                n_clients = min(size, CACHED_CLIENTS)
+            else:
+                n_clients = size
+            requests = [Request.blank('/', headers={
+                            'Authorization': 'Basic ' + base64.b64encode(
+                                'client%d:%s' % (rand.randrange(n_clients),
+                                                 CLIENT_SECRET))})
+                        for _ in xrange(LOOKUP_KEYS)]
+            if hashed:
+                for request in requests:
+                    authenticator.authenticate(request)
+
+            requests = itertools.cycle(requests)
+            return lambda: authenticator.authenticate(next(requests))
+
+        def setup_password_hashed(size=size):
+            return setup_password(size, hashed=True)
+
+        params = {'size': size}
+        benchmarks.extend([
+            Benchmark('ClientAuthorizationRegister.'
+                      'is_client_authorized_by_user', params,
+                      setup_client_authorized),
+            Benchmark('CertificateAuthenticator.authenticate', params,
+                      setup_certificate),
+            Benchmark('PasswordAuthenticator.authenticate',
+                      dict(params, secrets='plain'), setup_password),
+            Benchmark('PasswordAuthenticator.authenticate',
+                      dict(params, secrets='hashed_cached'),
+                      setup_password_hashed),
+        ])
+    return benchmarks
+
+
+def get_benchmarks(fixtures, sizes, backends):
+    """
+    @rtype: list
+    @return: benchmarks for the sizes and register backends, in the order
+    they are to be run
+    """
+    return (_register_benchmarks(fixtures, sizes, backends) +
+            _scope_benchmarks() +
+            _authorization_benchmarks(fixtures, sizes))
+
+
+def _parse_list(option, opt_str, value, parser, convert=str):
+    setattr(parser.values, option.dest,
+            tuple([convert(v.strip()) for v in value.split(',')]))
+
+
+def main():
+    parser = optparse.OptionParser(
+        usage='%prog [options]',
+        description='Run microbenchmarks of registers, scope utilities and '
+                    'authenticators and optionally compare them with an '
+                    'earlier run.')
+    parser.add_option("-k",
+                      "--filter",
+                      dest="patterns",
+                      action="append",
+                      help="Run benchmarks whose key matches a shell-style "
+                           "pattern, e.g., 'scopeutil.*', may be repeated")
+    parser.add_option("-l",
+                      "--list",
+                      dest="list",
+                      action="store_true",
+                      default=False,
+                      help="List the benchmarks and exit")
+    parser.add_option("-s",
+                      "--sizes",
+                      dest="sizes",
+                      type='string',
+                      action="callback",
+                      callback=_parse_list,
+                      callback_kwargs={'convert': int},
+                      default=DEFAULT_SIZES,
+                      help="Comma separated register sizes [%s]" %
+                           ','.join(map(str, DEFAULT_SIZES)))
+    parser.add_option("-B",
+                      "--backends",
+                      dest="backends",
+                      type='string',
+                      action="callback",
+                      callback=_parse_list,
+                      default=DEFAULT_BACKENDS,
+                      help="Comma separated register backends from %s [%s]" %
+                           (', '.join(sorted(BACKENDS)),
+                            ','.join(DEFAULT_BACKENDS)))
+    parser.add_option("-r",
+                      "--repeats",
+                      dest="repeats",
+                      default=DEFAULT_REPEATS,
+                      type='int',
+                      help="Number of timed repeats [%default]")
+    parser.add_option("-t",
+                      "--min-time",
+                      dest="min_time",
+                      default=DEFAULT_MIN_TIME,
+                      type='float',
+                      help="Minimum time in seconds for a repeat [%default]")
+    parser.add_option("-w",
+                      "--warmup-time",
+                      dest="warmup_time",
+                      default=DEFAULT_WARMUP_TIME,
+                      type='float',
+                      help="Warm-up time in seconds [%default]")
+    parser.add_option("-o",
+                      "--output",
+                      dest="output",
+                      default=None,
+                      help="JSON results file [stdout]")
+    parser.add_option("-b",
+                      "--baseline",
+                      dest="baseline",
+                      default=None,
+                      help="JSON results of an earlier run to compare with")
+    parser.add_option("-i",
+                      "--input",
+                      dest="input",
+                      default=None,
+                      help="Compare the JSON results in this file with the "
+                           "baseline instead of running the benchmarks")
+    parser.add_option("-T",
+                      "--threshold",
+                      dest="threshold",
+                      default=DEFAULT_THRESHOLD,
+                      type='float',
+                      help="Fractional slow down reported as a regression "
+                           "[%default]")
+
+    opt, args = parser.parse_args()
+    if args:
+        parser.error('Unexpected arguments: %s' % ' '.join(args))
+    unknown = [b for b in opt.backends if b not in BACKENDS]
+    if unknown:
+        parser.error('Unknown backends: %s' % ', '.join(unknown))
+    if opt.input and not opt.baseline:
+        parser.error('A baseline must be given to compare with the input')
+
+    logging.basicConfig(level=logging.ERROR)
+
+    if opt.input:
+        with open(opt.input) as results_file:
+            results = json.load(results_file)
+    else:
+        results = run(opt)
+        if results is None:
+            return
+
+    status = 0
+    if opt.baseline:
+        with open(opt.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        comparison = compare(baseline, results, opt.threshold)
+        comparison['baseline'] = opt.baseline
+        results['comparison'] = comparison
+
+        rows = [(key, c.get('baseline_median_us'), c.get('median_us'),
+                 c.get('ratio'), c['status'])
+                for key, c in sorted(comparison['benchmarks'].items())]
+        sys.stderr.write('\n' + format_table(rows, ('benchmark',
+                                                    'baseline us', 'us',
+                                                    'ratio', 'status')) +
+                         '\n')
+        if comparison['regressions']:
+            sys.stderr.write('%d regressions of more than %g%%\n' % (
+                             len(comparison['regressions']),
+                             opt.threshold * 100))
+            status = 1
+
+    write_results(results, opt.output)
+    sys.exit(status)
+
+
+def run(opt):
+    """Runs the benchmarks selected by the options.
+    @rtype: dict
+    @return: results or None if the benchmarks were only listed
+    """
+    fixtures = Fixtures()
+    try:
+        benchmarks = [b for b in get_benchmarks(fixtures, sorted(opt.sizes),
+                                                opt.backends)
+                      if not opt.patterns or
+                      [p for p in opt.patterns if fnmatch.fnmatch(b.key, p)]]
+        if opt.list:
+            for benchmark in benchmarks:
+                print(benchmark.key)
+            return None
+
+        results = {
+            'benchmark': 'micro',
+            'environment': environment(),
+            'parameters': {
+                'sizes': list(opt.sizes),
+                'backends': list(opt.backends),
+                'repeats': opt.repeats,
+                'min_time': opt.min_time,
+                'warmup_time': opt.warmup_time,
+                'seed': SEED,
+            },
+            'benchmarks': {},
+        }
+        rows = []
+        for benchmark in benchmarks:
+            result = time_benchmark(benchmark, opt.repeats, opt.min_time,
+                                    opt.warmup_time)
+            results['benchmarks'][benchmark.key] = result
+            row = (benchmark.key, result['loops'], result['median_us'],
+                   result['min_us'], result['stdev_us'],
+                   result['ops_per_second'])
+            rows.append(row)
+            sys.stderr.write('%s: %s us\n' % (benchmark.key,
+                                              result['median_us']))
+    finally:
+        fixtures.close()
+
+    sys.stderr.write('\n' + format_table(rows, ('benchmark', 'loops',
+                                                'median us', 'min us',
+                                                'stdev us', 'ops/s')) + '\n')
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""OAuth 2.0 server benchmarks - latency summaries and result output shared by
+the benchmark scripts
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "(C) 2026 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+__revision__ = "$Id$"
+
+import json
+import platform
+import sys
+import time
+
+
+def percentile(sorted_values, fraction):
+    """Gets a percentile of a sorted list by the nearest rank method.
+    @type sorted_values: list
+    @param sorted_values: values in increasing order
+    @type fraction: float
+    @param fraction: percentile as a fraction, e.g., 0.95
+    @rtype: float
+    @return: percentile value or None if there are no values
+    """
+    if not sorted_values:
+        return None
+    rank = int(fraction * len(sorted_values) + 0.5)
+    return sorted_values[min(max(rank, 1), len(sorted_values)) - 1]
+
+
+def summarise(durations, elapsed=None, errors=0):
+    """Summarises the durations of a set of operations.
+    @type durations: list
+    @param durations: durations of the successful operations in seconds
+    @type elapsed: float
+    @param elapsed: wall clock time over which the operations were made, for
+    the throughput
+    @type errors: int
+    @param errors: number of failed operations
+    @rtype: dict
+    @return: count, errors, throughput and latencies in milliseconds
+    """
+    values = sorted(durations)
+    ms = lambda value: None if value is None else round(value * 1000., 4)
+    summary = {
+        'count': len(values),
+        'errors': errors,
+        'mean_ms': ms(sum(values) / len(values) if values else None),
+        'min_ms': ms(values[0] if values else None),
+        'p50_ms': ms(percentile(values, .5)),
+        'p95_ms': ms(percentile(values, .95)),
+        'p99_ms': ms(percentile(values, .99)),
+        'max_ms': ms(values[-1] if values else None),
+    }
+    if elapsed:
+        summary['per_second'] = round(len(values) / elapsed, 2)
+    return summary
+
+
+def environment():
+    """
+    @rtype: dict
+    @return: description of the machine and interpreter running a benchmark
+    """
+    return {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': sys.version.split()[0],
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+    }
+
+
+def write_results(results, filename=None):
+    """Writes results as JSON to a file or, if no file name is given, to
+    stdout.
+    @type results: dict
+    @param results: results to write
+    @type filename: str
+    @param filename: output file name
+    """
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if filename:
+        with open(filename, 'w') as output_file:
+            output_file.write(output + '\n')
+    else:
+        sys.stdout.write(output + '\n')
+
+
+def format_table(rows, headings):
+    """Formats rows as a plain text table for reading on a terminal.
+    @type rows: list
+    @param rows: rows of values
+    @type headings: tuple
+    @param headings: column headings
+    @rtype: str
+    @return: table
+    """
+    cells = [list(headings)] + [['-' if value is None else str(value)
+                                 for value in row] for row in rows]
+    widths = [max(len(row[i]) for row in cells) for i in range(len(headings))]
+    lines = ['  '.join(cell.rjust(width) if i else cell.ljust(width)
+                       for i, (cell, width) in enumerate(zip(row, widths)))
+             for row in cells]
+    lines.insert(1, '  '.join('-' * width for width in widths))
+    return '\n'.join(lines)
@@ -7,24 +7,36 @@ __license__ = "BSD - see LICENSE file in top-level directory"
 __contact__ = "Philip.Kershaw@stfc.ac.uk"
 __revision__ = "$Id$"
 
-from datetime import datetime
+import time
 
 from ndg.oauth.server.lib.oauth.oauth_exception import OauthException
 from ndg.oauth.server.lib.oauth.access_token import (AccessTokenRequest, 
                                             AuthzCodeGrantAccessTokenResponse,
                                             ImplicitGrantAccessTokenResponse) 
 from ndg.oauth.server.lib.oauth.authorize import AuthorizeRequest
+from ndg.oauth.server.lib.utils import metrics
+from ndg.oauth.server.lib.utils.phase_timer import phase
                                                   
 AUTHORIZATION_CODE_GRANT_TYPE = 'authorization_code'
 MIN_N_ARGS = 3
+
+GRANTS_REDEEMED = metrics.counter(
+        'ndg_oauth_grants_redeemed_total',
+        'Authorization grants exchanged for access tokens')
+GRANT_REPLAYS = metrics.counter(
+        'ndg_oauth_grant_replays_total',
+        'Attempts to reuse authorization grants, which revoke the tokens '
+        'issued for them')
         
     
 def _make_access_token_from_authz_code_grant(token_request, client_id, 
                                              access_token_register, 
                                              access_token_generator,
-                                             authorization_grant_register):
+                                             authorization_grant_register,
+                                             timer=None):
     """Makes an access token based on a token request and using a given access
-    token generator.
+    token generator.  If a timer is given, the grant lookup, token generation
+    and storage phases are timed.
     Returns
       access token response or None if an error occurs that is not one of those
           that can be reported in an error response, i.e., internal server error
@@ -34,7 +46,8 @@ def _make_access_token_from_authz_code_grant(token_request, client_id,
         raise OauthException('invalid_request', 'Invalid grant_type')
 
     try:
-        grant = authorization_grant_register.get_value(token_request.code)
+        with phase(timer, 'grant'):
+            grant = authorization_grant_register.get_value(token_request.code)
         
     except KeyError:
         raise OauthException('invalid_grant', 'Invalid authorization code')
@@ -44,14 +57,18 @@ def _make_access_token_from_authz_code_grant(token_request, client_id,
         raise OauthException('invalid_grant', 'Invalid redirect URI')
 
     if grant.granted:
-        # Invalidate the associated token.
-        if grant.token:
-            grant.token.valid = False
+        # The code has been replayed - invalidate the tokens issued for it.
+        GRANT_REPLAYS.inc()
+        try:
+            access_token_register.revoke_by_grant(grant.code)
+        except NotImplementedError:
+            if grant.token_id:
+                access_token_register.revoke_token(grant.token_id)
         raise OauthException('invalid_grant', 
                              'Token already granted for authorization grant')
 
     # Check whether expired.
-    if grant.expires <= datetime.utcnow():
+    if grant.expires_at <= time.time():
         raise OauthException('invalid_grant', 'Authorization grant expired')
 
     # Check that the grant is issued to the requesting client.
@@ -63,25 +80,32 @@ def _make_access_token_from_authz_code_grant(token_request, client_id,
         raise OauthException('invalid_grant', 
                              'Token granted for different client')
 
-    token = access_token_generator.get_access_token(grant)
+    with phase(timer, 'generate'):
+        token = access_token_generator.get_access_token(grant)
     if not token:
         return None
 
-    grant.granted = True
-    grant.token = token
+    with phase(timer, 'store'):
+        # Record that the code has been used so that a replay is detected.
+        grant.granted = True
+        grant.token_id = token.token_id
+        authorization_grant_register.set_value(grant.code, grant)
+        GRANTS_REDEEMED.inc()
 
-    response = AuthzCodeGrantAccessTokenResponse(token.token_id, 
-                                                 token.token_type,
-                                                 token.lifetime, 
-                                                 refresh_token=None)
-    if access_token_register.add_token(token):
+        response = AuthzCodeGrantAccessTokenResponse(token.token_id, 
+                                                     token.token_type,
+                                                     token.lifetime, 
+                                                     refresh_token=None)
+        added = access_token_register.add_token(token)
+
+    if added:
         return response
     else:
         return None
     
 
 def _make_access_token_from_implicit_grant(authz_request, access_token_register, 
-                                           access_token_generator):
+                                           access_token_generator, timer=None):
     """
     Makes an access token based on a token request and using a given access
     token generator.
@@ -89,7 +113,8 @@ def _make_access_token_from_implicit_grant(authz_request, access_token_register,
       access token response or None if an error occurs that is not one of those
           that can be reported in an error response, i.e., internal server error
     """
-    token = access_token_generator.get_access_token(authz_request)
+    with phase(timer, 'generate'):
+        token = access_token_generator.get_access_token(authz_request)
     if not token:
         return None
 
@@ -97,26 +122,31 @@ def _make_access_token_from_implicit_grant(authz_request, access_token_register,
                                                 token.token_type,
                                                 token.lifetime,
                                                 authz_request.state,
-                                                scope=token.scope)
-    if access_token_register.add_token(token):
+                                                scope=authz_request.scope)
+    with phase(timer, 'store'):
+        added = access_token_register.add_token(token)
+
+    if added:
         return response
     else:
         return None
 
 
-def make_access_token(*args):
+def make_access_token(*args, **kw):
     '''Make an access token based on an access token request (Authorisation
-    Code flow) or an authorisation request (Implicit Grant flow)
+    Code flow) or an authorisation request (Implicit Grant flow).  A
+    ndg.oauth.server.lib.utils.phase_timer.PhaseTimer may be given with the
+    timer keyword.
     '''
     if len(args) < MIN_N_ARGS:
         raise TypeError('make_access_token takes at least %d, (%d given)' %
                         (MIN_N_ARGS, len(args)))
         
     if isinstance(args[0], AccessTokenRequest):
-        return _make_access_token_from_authz_code_grant(*args)
+        return _make_access_token_from_authz_code_grant(*args, **kw)
         
     elif isinstance(args[0], AuthorizeRequest):
-        return _make_access_token_from_implicit_grant(*args)
+        return _make_access_token_from_implicit_grant(*args, **kw)
         
     else:
         raise TypeError('Expecting %r or %r type for make_access_token first ' 
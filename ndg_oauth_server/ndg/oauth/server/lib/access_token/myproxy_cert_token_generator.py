@@ -12,6 +12,7 @@ import logging
 
 from ndg.oauth.server.lib.access_token.access_token_interface import AccessTokenInterface
 from ndg.oauth.server.lib.register.access_token import AccessToken
+from ndg.oauth.server.lib.utils.blocking import run_blocking
 
 log = logging.getLogger(__name__)
 
@@ -72,9 +73,9 @@ class MyProxyCertTokenGenerator(AccessTokenInterface):
 
         # Attempt to obtain a certificate from MyProxy.
         try:
-            creds = myproxyclient.logon(myproxy_id, 
-                                        self.myproxy_global_password, 
-                                        certReq=cert_req)
+            creds = run_blocking(myproxyclient.logon, myproxy_id,
+                                 self.myproxy_global_password,
+                                 certReq=cert_req)
         except Exception, exc:
             log.error('MyProxy logon failed: %s', exc.__str__())
             return None
@@ -0,0 +1,187 @@
+"""OAuth 2.0 WSGI server middleware - self-contained signed access tokens
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "(C) 2026 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+__revision__ = "$Id$"
+
+import base64
+import json
+import logging
+import time
+
+from ndg.oauth.server.lib.access_token.access_token_interface import \
+                                                        AccessTokenInterface
+from ndg.oauth.server.lib.register.access_token import AccessToken
+import ndg.oauth.server.lib.register.scopeutil as scopeutil
+
+log = logging.getLogger(__name__)
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip('=')
+
+
+def _b64decode(data):
+    return base64.urlsafe_b64decode(str(data) + '=' * (-len(data) % 4))
+
+
+class SignedTokenGenerator(AccessTokenInterface):
+    """Access token generator for self-contained tokens.  The token is a JSON
+    Web Token signed with the current key of a key set.  It carries the user
+    identifier, client ID, scope and expiry so that it can be validated with
+    the key set alone without a lookup in the access token register.
+
+    Tokens are still added to the access token register when issued but
+    revocation in the register does not affect validation by this class, so
+    short token lifetimes should be used.
+    """
+    JWT_TYPE = 'JWT'
+
+    def __init__(self, lifetime, token_type, **kw):
+        """
+        @type lifetime: int
+        @param lifetime: lifetimes of generated tokens in seconds
+
+        @type token_type: str
+        @param token_type: token type name
+
+        @type kw:dict
+        @param kw: additional keywords
+            key_set: ndg.oauth.server.lib.access_token.signing_key_set.\
+SigningKeySet used to sign and verify tokens
+        """
+        self.lifetime = int(lifetime)
+        self.token_type = token_type
+        self.key_set = kw['key_set']
+
+    def get_access_token(self, _arg):
+        """
+        Gets an access token with an ID that is a signed token containing the
+        token attributes.
+        @type _arg:
+        ndg.oauth.server.lib.register.authorization_grant.AuthorizationGrant /
+        ndg.oauth.server.lib.oauth.authorize.AuthorizeRequest
+        @param _arg: authorization grant (authorisation code flow) or
+        authorisation request (implicit flow)
+
+        @rtype: ndg.oauth.server.lib.register.access_token.AccessToken
+        @return: access token or None if an error occurs
+        """
+        key = self.key_set.current_key
+        if key is None or not key.can_sign:
+            log.error('No current key set with which to sign tokens')
+            return None
+
+        token = AccessToken.create(self.token_type, _arg, self.lifetime)
+
+        scope = token.scope
+        if isinstance(scope, basestring):
+            scope = scopeutil.scopeStringToList(scope)
+
+        claims = {
+            'jti': token.token_id,
+            'sub': token.user_identifier,
+            'client_id': token.client_id,
+            'scope': scope or [],
+            'iat': token.issued_at,
+            'exp': token.expires_at
+        }
+        header = {'typ': self.JWT_TYPE, 'alg': key.algorithm, 'kid': key.kid}
+
+        signing_input = '.'.join([
+            _b64encode(json.dumps(header, separators=(',', ':'))),
+            _b64encode(json.dumps(claims, separators=(',', ':')))])
+        token.token_id = '.'.join([signing_input,
+                                   _b64encode(key.sign(signing_input))])
+        return token
+
+    @staticmethod
+    def is_signed_token(token_id):
+        """Determines whether a token ID has the form of a signed token rather
+        than a token issued by another generator.
+        """
+        return token_id.count('.') == 2
+
+    def get_claims(self, token_id):
+        """Verifies the signature of a token and returns its claims.
+        @type token_id: str
+        @param token_id: signed token
+        @rtype: dict
+        @return: claims or None if the token is malformed, is signed with an
+        unknown key or the signature is invalid
+        """
+        try:
+            encoded_header, encoded_claims, encoded_signature = \
+                token_id.split('.')
+            header = json.loads(_b64decode(encoded_header))
+            signature = _b64decode(encoded_signature)
+        except (ValueError, TypeError, AttributeError):
+            log.debug("Malformed signed token: %s", token_id)
+            return None
+
+        # The header is checked before the signature so it may be anything
+        if (not isinstance(header, dict) or
+            not isinstance(header.get('kid'), basestring) or
+            not isinstance(header.get('alg'), basestring)):
+            log.debug("Malformed signed token header: %s", token_id)
+            return None
+
+        key = self.key_set.get_key(header['kid'])
+        if key is None or key.algorithm != header['alg']:
+            log.debug("Signed token key %r not found", header['kid'])
+            return None
+
+        if not key.verify('.'.join([encoded_header, encoded_claims]),
+                          signature):
+            log.debug("Invalid signature for signed token: %s", token_id)
+            return None
+
+        try:
+            claims = json.loads(_b64decode(encoded_claims))
+        except (ValueError, TypeError, AttributeError):
+            log.debug("Malformed claims in signed token: %s", token_id)
+            return None
+
+        if not isinstance(claims, dict):
+            log.debug("Malformed claims in signed token: %s", token_id)
+            return None
+        return claims
+
+    def verify_token(self, token_id, scope):
+        """Validates a signed token for a required scope.  This has the same
+        return values as
+        ndg.oauth.server.lib.register.access_token.AccessTokenRegister.get_token
+        @type token_id: basestring
+        @param token_id: token ID
+        @type scope: basestring
+        @param scope: required scopes as space separated string
+        @rtype: tuple (AccessToken, str)
+        @return: token and None or None and error string
+        """
+        claims = self.get_claims(token_id)
+        if not isinstance(claims, dict):
+            return None, 'invalid_token'
+
+        try:
+            expires = claims['exp']
+            claims['iat']
+        except KeyError:
+            log.debug("Signed token has missing claims: %s", token_id)
+            return None, 'invalid_token'
+
+        if expires <= time.time():
+            log.debug("Request for expired signed token: %s", token_id)
+            return None, 'invalid_token'
+
+        token = AccessToken.from_claims(token_id, self.token_type, claims)
+        if not scopeutil.isScopeGranted(token.scope,
+                                        scopeutil.scopeStringToList(
+                                                        scope, assign=False)):
+            log.debug("Request for signed token - token was not granted "
+                      "scope %s", scope)
+            return None, 'insufficient_scope'
+
+        return token, None
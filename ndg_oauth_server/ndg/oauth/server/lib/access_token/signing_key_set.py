@@ -0,0 +1,247 @@
+"""OAuth 2.0 WSGI server middleware - keys for signing self-contained access
+tokens
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "(C) 2026 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+__revision__ = "$Id$"
+
+from ConfigParser import SafeConfigParser
+import hashlib
+import hmac
+import logging
+import os
+import threading
+import time
+
+from ndg.oauth.server.lib.utils.secure_compare import compare_digest
+
+log = logging.getLogger(__name__)
+
+
+class SigningKeyConfigError(Exception):
+    '''Signing key configuration error'''
+
+
+class SigningKey(object):
+    """
+    Key used to sign and verify tokens.  HS256 keys are shared secrets.  RS256
+    keys use an RSA private key to sign and the corresponding certificate to
+    verify, so a verifying party need only be given the certificate.  RS256
+    requires pyOpenSSL.
+    """
+    HMAC_SHA256_ALG = 'HS256'
+    RSA_SHA256_ALG = 'RS256'
+    ALGORITHMS = (HMAC_SHA256_ALG, RSA_SHA256_ALG)
+
+    def __init__(self, kid, algorithm, secret=None, private_key=None,
+                 certificate=None):
+        """
+        @type kid: str
+        @param kid: key identifier - included in signed tokens so that the key
+        to verify them can be found
+
+        @type algorithm: str
+        @param algorithm: signature algorithm - HS256 or RS256
+
+        @type secret: str
+        @param secret: shared secret for HS256
+
+        @type private_key: OpenSSL.crypto.PKey
+        @param private_key: private key for RS256 signing.  Not needed for
+        verification.
+
+        @type certificate: OpenSSL.crypto.X509
+        @param certificate: certificate for RS256 verification
+        """
+        if algorithm not in self.__class__.ALGORITHMS:
+            raise SigningKeyConfigError('Signing algorithm %r for key %r not '
+                                        'a recognised algorithm %r' %
+                                        (algorithm, kid,
+                                         self.__class__.ALGORITHMS))
+
+        if algorithm == self.__class__.HMAC_SHA256_ALG and not secret:
+            raise SigningKeyConfigError('A secret must be set for key %r' %
+                                        kid)
+
+        if algorithm == self.__class__.RSA_SHA256_ALG and certificate is None:
+            raise SigningKeyConfigError('A certificate must be set for key %r'
+                                        % kid)
+
+        self.kid = kid
+        self.algorithm = algorithm
+        self.secret = secret
+        self.private_key = private_key
+        self.certificate = certificate
+
+    @property
+    def can_sign(self):
+        return (self.algorithm == self.__class__.HMAC_SHA256_ALG or
+                self.private_key is not None)
+
+    def sign(self, data):
+        """
+        @type data: str
+        @param data: data to sign
+        @rtype: str
+        @return: signature
+        """
+        if self.algorithm == self.__class__.HMAC_SHA256_ALG:
+            return hmac.new(self.secret, data, hashlib.sha256).digest()
+
+        from OpenSSL import crypto
+        return crypto.sign(self.private_key, data, 'sha256')
+
+    def verify(self, data, signature):
+        """
+        @type data: str
+        @param data: signed data
+        @type signature: str
+        @param signature: signature to check
+        @rtype: bool
+        @return: True if the signature is valid for the data
+        """
+        if self.algorithm == self.__class__.HMAC_SHA256_ALG:
+            return compare_digest(self.sign(data), signature)
+
+        from OpenSSL import crypto
+        try:
+            crypto.verify(self.certificate, signature, data, 'sha256')
+        except crypto.Error:
+            return False
+        return True
+
+
+class SigningKeySet(object):
+    """
+    Set of signing keys read from a configuration file of the form:
+
+    [signing_keys]
+    # Key used to sign new tokens
+    current = key2
+    # All keys accepted for verification
+    keys = key1, key2
+
+    [key:key1]
+    algorithm = HS256
+    secret = ...
+
+    [key:key2]
+    algorithm = RS256
+    private_key_file = ...
+    certificate_file = ...
+
+    Keys are rotated by adding a new key, making it current and removing the
+    old key once tokens signed with it have expired.  The file is checked for
+    changes at most every reload_interval seconds and the keys reloaded if it
+    has been modified, so that rotation doesn't require a restart.
+    """
+    SECTION_NAME = 'signing_keys'
+    KEY_SECTION_PREFIX = 'key:'
+    DEFAULT_RELOAD_INTERVAL = 60
+
+    def __init__(self, config_file, reload_interval=DEFAULT_RELOAD_INTERVAL):
+        """
+        @type config_file: basestring
+        @param config_file: key set configuration file
+
+        @type reload_interval: int or float
+        @param reload_interval: minimum time in seconds between checks for
+        modification of the configuration file
+        """
+        self.config_file = config_file
+        self.reload_interval = float(reload_interval)
+        self._keys = {}
+        self._current_key = None
+        self._mtime = None
+        self._checked = 0.
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        mtime = os.stat(self.config_file).st_mtime
+        config = SafeConfigParser(
+                    defaults={'here': os.path.dirname(self.config_file)})
+        config.read(self.config_file)
+
+        keys = {}
+        kids = config.get(self.SECTION_NAME, 'keys').strip()
+        for kid in [k.strip() for k in kids.split(',') if k.strip()]:
+            keys[kid] = self._create_key(config, kid)
+
+        current_kid = None
+        if config.has_option(self.SECTION_NAME, 'current'):
+            current_kid = config.get(self.SECTION_NAME, 'current').strip()
+            if current_kid not in keys:
+                raise SigningKeyConfigError('Current key %r is not in the '
+                                            'list of keys' % current_kid)
+
+        # Replace rather than update so that concurrent readers see either the
+        # old or new keys.
+        self._keys = keys
+        self._current_key = keys.get(current_kid)
+        self._mtime = mtime
+        log.debug("Loaded signing keys %r from %s (current key: %s)",
+                  keys.keys(), self.config_file, current_kid)
+
+    def _create_key(self, config, kid):
+        section_name = self.KEY_SECTION_PREFIX + kid
+        algorithm = config.get(section_name, 'algorithm')
+        secret = private_key = certificate = None
+
+        if config.has_option(section_name, 'secret'):
+            secret = config.get(section_name, 'secret')
+
+        if config.has_option(section_name, 'private_key_file'):
+            from OpenSSL import crypto
+            pem = open(config.get(section_name, 'private_key_file')).read()
+            private_key = crypto.load_privatekey(crypto.FILETYPE_PEM, pem)
+
+        if config.has_option(section_name, 'certificate_file'):
+            from OpenSSL import crypto
+            pem = open(config.get(section_name, 'certificate_file')).read()
+            certificate = crypto.load_certificate(crypto.FILETYPE_PEM, pem)
+
+        return SigningKey(kid, algorithm, secret=secret,
+                          private_key=private_key, certificate=certificate)
+
+    def _check_reload(self):
+        """Reloads the keys if the configuration file has changed.  An error
+        reloading leaves the existing keys in place.
+        """
+        now = time.time()
+        if now - self._checked < self.reload_interval:
+            return
+
+        if not self._lock.acquire(False):
+            # Another thread is checking.
+            return
+        try:
+            self._checked = now
+            if os.stat(self.config_file).st_mtime != self._mtime:
+                log.info("Reloading modified signing keys from %s",
+                         self.config_file)
+                self._load()
+        except Exception, exc:
+            log.error("Error reloading signing keys from %s: %s",
+                      self.config_file, exc)
+        finally:
+            self._lock.release()
+
+    @property
+    def current_key(self):
+        """Key with which to sign new tokens"""
+        self._check_reload()
+        return self._current_key
+
+    def get_key(self, kid):
+        """
+        @type kid: str
+        @param kid: key identifier
+        @rtype: SigningKey
+        @return: key or None if the key is not in the set
+        """
+        self._check_reload()
+        return self._keys.get(kid)
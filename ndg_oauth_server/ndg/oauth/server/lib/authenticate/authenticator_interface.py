@@ -34,3 +34,15 @@ class AuthenticatorInterface(object):
         @return: True if user authenticated
         """
         return None
+
+    def get_presented_id(self, request):
+        """Gets the ID presented in a request without authenticating it, for
+        limiting failed authentications before the slow part of the check.
+        @type request: webob.Request
+        @param request: HTTP request object
+
+        @rtype: str
+        @return: ID presented, or None if there is none or the authenticator
+        doesn't check one
+        """
+        return None
@@ -17,7 +17,9 @@ class CertificateAuthenticator(AuthenticatorInterface):
     Client authenticator implementation that checks for a SSL certificate DN
     in the environ and compares this with that registered for the client/resource/....
     SSL certificate authentication must be configured, e.g., in an Apache server
-    hosting the application.
+    hosting the application.  DNs are compared in normalised form so that
+    differences in DN format between the register and the server don't
+    matter.
     """
 
     def __init__(self, typ, register):
@@ -41,10 +43,13 @@ class CertificateAuthenticator(AuthenticatorInterface):
         if not dn:
             raise OauthException('invalid_%s' % self.typ, 'No certificate DN found.')
 
-        for authorization in self._register.register.itervalues():
-            if authorization.authentication_data == dn:
-                return authorization.id
+        registration = self._register.get_registration_by_dn(dn)
+        if registration is not None:
+            return registration.id
 
         raise OauthException('invalid_%s' % self.typ,
 			     'Certificate DN does not match that for any registered %s: %s' % (self.typ, dn))
 
+    def get_presented_id(self, request):
+        return request.environ.get(self.CERT_DN_ENVIRON_KEY) or None
+
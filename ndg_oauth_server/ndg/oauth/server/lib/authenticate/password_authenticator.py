@@ -8,9 +8,22 @@ __contact__ = "wvengen+oauth2@nikhef.nl"
 __revision__ = "$Id$"
 
 from base64 import b64decode
+import hashlib
+import hmac
+import os
 
 from ndg.oauth.server.lib.authenticate.authenticator_interface import AuthenticatorInterface
 from ndg.oauth.server.lib.oauth.oauth_exception import OauthException
+from ndg.oauth.server.lib.utils.lru_cache import LRUCache
+from ndg.oauth.server.lib.utils import metrics
+from ndg.oauth.server.lib.utils.secret_hash import (get_dummy_hash,
+                                                    verify_secret)
+
+SECRET_VERIFICATIONS = metrics.counter(
+        'ndg_oauth_secret_verifications_total',
+        'Client and resource secret checks: cached (found in the cache of '
+        'verified secrets), verified or failed',
+        ('type', 'result'))
 
 
 class PasswordAuthenticator(AuthenticatorInterface):
@@ -19,12 +32,46 @@ class PasswordAuthenticator(AuthenticatorInterface):
     combination, either in the HTTP Authorization header, or in the request
     parameters, according to the OAuth 2 RFC, section 2.3.1
 
+    Registered secrets may be salted hashes made with
+    ndg.oauth.server.lib.utils.secret_hash.hash_secret.  As checking these is
+    deliberately slow, successfully verified id+secret pairs are held in a
+    bounded cache for a limited time.  The cache is keyed on an HMAC of the
+    pair with a random per-process key so that secrets aren't held in memory
+    in the clear.
+
     @todo implement protection against brute force attacks (MUST)
     """
+    DEFAULT_CACHE_SIZE = 1000
+    DEFAULT_CACHE_EXPIRE = 300
+
+    def __init__(self, typ, register, cache_size=DEFAULT_CACHE_SIZE,
+                 cache_expire=DEFAULT_CACHE_EXPIRE):
+        """
+        @type typ: str
+        @param typ: type of entity authenticated: client or resource
 
-    def __init__(self, typ, register):
+        @type register: ndg.oauth.server.lib.register.client.ClientRegister /
+        ndg.oauth.server.lib.register.resource.ResourceRegister
+        @param register: register of ids and secrets
+
+        @type cache_size: int
+        @param cache_size: maximum number of verified id+secret pairs cached.
+        Set to zero to disable the cache.
+
+        @type cache_expire: int or float
+        @param cache_expire: time in seconds for which a verified pair is
+        cached
+        """
         super(PasswordAuthenticator, self).__init__(typ)
         self._register = register
+        self._cache_key = os.urandom(32)
+        if int(cache_size) > 0:
+            self._verified_cache = LRUCache(cache_size, ttl=cache_expire)
+        else:
+            self._verified_cache = None
+
+        # Made now rather than when the first unknown ID is presented
+        get_dummy_hash()
 
     def authenticate(self, request):
         """
@@ -38,6 +85,34 @@ class PasswordAuthenticator(AuthenticatorInterface):
         
         Raise OauthException if authentication fails.
         """
+        cid, secret = self._get_credentials(request)
+        if not cid or not secret:
+            raise OauthException('invalid_%s' % self.typ,
+				 'No %s password authentication supplied' % self.typ)
+
+        registration = self._register.register.get(cid)
+        if registration is None:
+            # Takes as long as the check of a hashed secret so that the
+            # response doesn't show whether the ID is registered
+            verify_secret(secret, get_dummy_hash())
+            SECRET_VERIFICATIONS.inc(self.typ, 'failed')
+
+        elif self._verify(cid, secret, registration.secret):
+            return registration.id
+
+        raise OauthException('invalid_%s' % self.typ,
+			     '%s access denied: %s' % (cid, self.typ))
+
+    def get_presented_id(self, request):
+        return self._get_credentials(request)[0] or None
+
+    @staticmethod
+    def _get_credentials(request):
+        """Gets the id/secret pair from the Authorization header, or else
+        POSTed request parameters.
+        @rtype: tuple
+        @return: id and secret, which are None if not found
+        """
         cid = secret = None
         if 'Authorization' in request.headers and request.headers['Authorization'].startswith('Basic'):
             cid, secret = b64decode(request.headers['Authorization'][6:]).split(':',1)
@@ -46,14 +121,34 @@ class PasswordAuthenticator(AuthenticatorInterface):
             cid = request.POST['client_id']
             secret = request.POST['client_secret']
 
-        if not cid or not secret:
-            raise OauthException('invalid_%s' % self.typ,
-				 'No %s password authentication supplied' % self.typ)
+        return cid, secret
 
-        for authorization in self._register.register.itervalues():
-            if authorization.id == cid and authorization.secret == secret:
-                return authorization.id
+    def _verify(self, cid, secret, stored_secret):
+        """Checks a secret, using the cache of verified secrets if enabled.
+        """
+        if self._verified_cache is None:
+            verified = verify_secret(secret, stored_secret)
+            SECRET_VERIFICATIONS.inc(self.typ,
+                                     'verified' if verified else 'failed')
+            return verified
 
-        raise OauthException('invalid_%s' % self.typ,
-			     '%s access denied: %s' % (cid, self.typ))
+        if isinstance(cid, unicode):
+            cid = cid.encode('utf-8')
+        if isinstance(secret, unicode):
+            secret = secret.encode('utf-8')
+        cache_key = hmac.new(self._cache_key, '%s\x00%s' % (cid, secret),
+                             hashlib.sha256).digest()
+
+        # The cached value is the registered secret at the time of
+        # verification so that a change of secret invalidates the entry.
+        if self._verified_cache.get(cache_key) == stored_secret:
+            SECRET_VERIFICATIONS.inc(self.typ, 'cached')
+            return True
+
+        if verify_secret(secret, stored_secret):
+            self._verified_cache.set(cache_key, stored_secret)
+            SECRET_VERIFICATIONS.inc(self.typ, 'verified')
+            return True
 
+        SECRET_VERIFICATIONS.inc(self.typ, 'failed')
+        return False
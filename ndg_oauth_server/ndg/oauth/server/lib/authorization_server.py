@@ -13,6 +13,7 @@ __revision__ = "$Id$"
 import json
 import logging
 import httplib
+import time
 import urllib
 
 from ndg.oauth.server.lib.access_token.make_access_token import \
@@ -25,9 +26,32 @@ from ndg.oauth.server.lib.oauth.oauth_exception import OauthException
 from ndg.oauth.server.lib.register.access_token import AccessTokenRegister
 from ndg.oauth.server.lib.register.authorization_grant import \
                                                     AuthorizationGrantRegister
+from ndg.oauth.server.lib.utils import metrics
+from ndg.oauth.server.lib.utils.phase_timer import phase
 
 log = logging.getLogger(__name__)
 
+AUTHENTICATIONS = metrics.counter(
+        'ndg_oauth_authentications_total',
+        'Client and resource authentications: success, failure or none where '
+        'authentication is disabled',
+        ('type', 'result'))
+ERRORS = metrics.counter(
+        'ndg_oauth_errors_total',
+        'OAuth error responses by endpoint and error code',
+        ('endpoint', 'error'))
+GRANTS_ISSUED = metrics.counter(
+        'ndg_oauth_grants_issued_total',
+        'Authorization grants issued')
+TOKENS_ISSUED = metrics.counter(
+        'ndg_oauth_access_tokens_issued_total',
+        'Access tokens issued by grant type',
+        ('grant_type',))
+TOKEN_VALIDATIONS = metrics.counter(
+        'ndg_oauth_token_validations_total',
+        'Access token validations: valid, invalid_token or insufficient_scope',
+        ('result',))
+
 
 class AuthorizationServer(object):
     """
@@ -40,11 +64,24 @@ class AuthorizationServer(object):
     AUTHZ_CODE_RESP_TYPE = 'code'
     TOK_RESP_TYPE = 'token'
     RESP_TYPES = (AUTHZ_CODE_RESP_TYPE, TOK_RESP_TYPE)
+    DEFAULT_CHECK_TOKENS_MAX_BATCH = 100
     
     def __init__(self, client_register, authorizer, client_authenticator,
                  resource_register, resource_authenticator,
-                 access_token_generator, config):
+                 access_token_generator, config, access_token_verifier=None,
+                 rate_limiter=None):
         """Initialise the all the settings for an Authorisation server instance
+
+        @type access_token_verifier: ndg.oauth.server.lib.access_token.\
+signed_token_generator.SignedTokenGenerator
+        @param access_token_verifier: optional verifier for self-contained
+        signed tokens.  Signed tokens are validated with this rather than
+        looked up in the access token register.
+
+        @type rate_limiter: ndg.oauth.server.lib.utils.rate_limiter.\
+RateLimiter
+        @param rate_limiter: optional limiter of the rate of requests to the
+        token endpoints by each client or resource
         """
         self.client_register = client_register
         self.authorizer = authorizer
@@ -54,6 +91,8 @@ class AuthorizationServer(object):
         self.access_token_generator = access_token_generator
         self.access_token_register = AccessTokenRegister(config)
         self.authorization_grant_register = AuthorizationGrantRegister(config)
+        self.access_token_verifier = access_token_verifier
+        self.rate_limiter = rate_limiter
 
     def authorize(self, request, client_authorized):
         """Handle an authorization request.
@@ -143,6 +182,7 @@ class AuthorizationServer(object):
                                                     authz_request.redirect_uri)
             if client_error:
                 log.error("Invalid client: %s", client_error)
+                ERRORS.inc('authorize', 'invalid_client')
                 return (None, httplib.BAD_REQUEST, client_error)
 
             # redirect_uri must be included in the request if the client has
@@ -152,6 +192,7 @@ class AuthorizationServer(object):
                 not authz_request.redirect_uri):
                 log.error("An authorization request has been made without a "
                           "return URI")
+                ERRORS.inc('authorize', 'invalid_request')
                 return (None, 
                         httplib.BAD_REQUEST, 
                         ('An authorization request has been made without a '
@@ -175,6 +216,7 @@ class AuthorizationServer(object):
                     raise OauthException('server_error', 
                                          'Authorization grant could not be '
                                          'created')
+                GRANTS_ISSUED.inc()
 
                 log.debug("Redirecting back after successful authorization.")
                 return self._redirect_after_authorize(authz_request, 
@@ -186,6 +228,8 @@ class AuthorizationServer(object):
                 impl_grant_response = make_access_token(authz_request, 
                                                     self.access_token_register,
                                                     self.access_token_generator)
+                if impl_grant_response is not None:
+                    TOKENS_ISSUED.inc('implicit')
                 
                 log.debug("Redirecting back after successful implicit grant.")
                 return self._redirect_after_authorize(authz_request, 
@@ -198,6 +242,7 @@ class AuthorizationServer(object):
         except OauthException, exc:
             log.error("Redirecting back after error: %s - %s", 
                       exc.error, exc.error_description)
+            ERRORS.inc('authorize', exc.error)
             
             return self._redirect_after_authorize(authz_request, None, 
                                                   exc.error,
@@ -294,7 +339,7 @@ class AuthorizationServer(object):
 
         return ''.join(url_parts)
 
-    def access_token(self, request):
+    def access_token(self, request, timer=None):
         """
         Handles a request for an access token.
 
@@ -328,6 +373,9 @@ class AuthorizationServer(object):
         @type request: webob.Request
         @param request: HTTP request object
 
+        @type timer: ndg.oauth.server.lib.utils.phase_timer.PhaseTimer
+        @param timer: timer for the phases of the request
+
         @rtype: tuple: (str, int, str)
         @return: tuple (
                      OAuth JSON response
@@ -345,7 +393,9 @@ class AuthorizationServer(object):
             self.check_request(request, params, post_only=True)
 
             # Check that the client is authenticated as a registered client.
-            client_id = self.client_authenticator.authenticate(request)
+            with phase(timer, 'authn'):
+                client_id = self._authenticate(self.client_authenticator,
+                                               request)
             if client_id is None:
                 log.warn('Client authentication not performed')
                 error_status = httplib.FORBIDDEN
@@ -367,6 +417,7 @@ class AuthorizationServer(object):
             # Assume client error 
             if error_status is None:
                 error_status = httplib.BAD_REQUEST
+            ERRORS.inc('access_token', exc.error)
                 
             return (self._error_access_token_response(exc.error, 
                                                       exc.error_description), 
@@ -379,19 +430,72 @@ class AuthorizationServer(object):
         try:
             response = make_access_token(
                 token_request, client_id, self.access_token_register,
-                self.access_token_generator, self.authorization_grant_register)
+                self.access_token_generator, self.authorization_grant_register,
+                timer=timer)
 
         except OauthException, exc:
+            ERRORS.inc('access_token', exc.error)
             return (self._error_access_token_response(exc.error, 
                                                       exc.error_description), 
                     None, exc.error_description)
 
         if response:
+            TOKENS_ISSUED.inc(token_request.grant_type)
             return self._access_token_response(response), None, None
         else:
+            ERRORS.inc('access_token', 'server_error')
             return (None, httplib.INTERNAL_SERVER_ERROR, 
                     'Access token generation failed.')
 
+    def _authenticate(self, authenticator, request):
+        """Authenticates a client or resource, counting the outcome.  If a
+        rate limiter is set, the request is counted against the authenticated
+        client or resource, or if it isn't authenticated, the remote address,
+        so that requests from other clients at the same address don't affect
+        an authenticated client.  Failures are also counted against the
+        address and the ID presented, and once their limit is reached the
+        request is refused before the ID is authenticated.
+        @rtype: str
+        @return: ID of the authenticated client or resource, or None if
+        authentication is not performed
+
+        Raises OauthException if authentication fails and
+        ndg.oauth.server.lib.utils.rate_limiter.RateLimitExceeded if the
+        rate limit is reached.
+        """
+        rate_limiter = self.rate_limiter
+        presented_id = None
+        if rate_limiter is not None:
+            presented_id = authenticator.get_presented_id(request)
+            if presented_id is not None:
+                rate_limiter.check_failures(authenticator.typ,
+                                            request.remote_addr, presented_id)
+        try:
+            entity_id = authenticator.authenticate(request)
+        except OauthException:
+            AUTHENTICATIONS.inc(authenticator.typ, 'failure')
+            if rate_limiter is not None:
+                if presented_id is not None:
+                    rate_limiter.record_failure(authenticator.typ,
+                                                request.remote_addr,
+                                                presented_id)
+
+                # Refused with a 429 rather than the authentication error once
+                # the limit for the address is reached
+                rate_limiter.acquire_address(authenticator.typ,
+                                             request.remote_addr)
+            raise
+
+        AUTHENTICATIONS.inc(authenticator.typ,
+                            'none' if entity_id is None else 'success')
+        if rate_limiter is not None:
+            if entity_id is None:
+                rate_limiter.acquire_address(authenticator.typ,
+                                             request.remote_addr)
+            else:
+                rate_limiter.acquire(authenticator.typ, entity_id)
+        return entity_id
+
     def _access_token_response(self, resp):
         """Constructs the JSON response to an access token request.
         @type resp: ndg.oauth.server.lib.oauth.access_token.AccessTokenResponse
@@ -468,7 +572,7 @@ class AuthorizationServer(object):
                 raise OauthException('invalid_request', 
                                      'Parameter "%s" is repeated.' % key)
 
-    def check_token(self, request, scope=None):
+    def check_token(self, request, scope=None, timer=None):
         """
         Simple service that could be used to validate bearer tokens. It would
         be called from a resource service that trusts this authorization
@@ -500,6 +604,9 @@ class AuthorizationServer(object):
         @type scope: str
         @param scope: required scope
 
+        @type timer: ndg.oauth.server.lib.utils.phase_timer.PhaseTimer
+        @param timer: timer for the phases of the request
+
         @rtype: tuple: (str, int, str)
         @return: tuple (
                      OAuth JSON response
@@ -511,7 +618,9 @@ class AuthorizationServer(object):
         params = request.POST
 
         # Check that the client is authenticated as a registered client.
-        resource_id = self.resource_authenticator.authenticate(request)
+        with phase(timer, 'authn'):
+            resource_id = self._authenticate(self.resource_authenticator,
+                                             request)
         if resource_id is None:
             log.warn('Resource authentication not performed')
         else:
@@ -526,23 +635,229 @@ class AuthorizationServer(object):
                 required_scope = scope
             else:
                 required_scope = params.get('scope', None)
-            token, error = self.access_token_register.get_token(access_token,
-                                                                required_scope)
+            with phase(timer, 'validate'):
+                token, error = self._get_token(access_token, required_scope)
         # Formulate response
-        status = {'invalid_request': httplib.BAD_REQUEST,
-                  'invalid_token': httplib.FORBIDDEN,
-                  None: httplib.OK}.get(error, httplib.BAD_REQUEST)
+        status = self._get_check_token_status(error)
 
         content_dict = {'status': status}
         if error:
+            ERRORS.inc('check_token', error)
             content_dict['error'] = error
         else:
             # TODO only get additional data when resource is allowed to
-            content_dict['user_name'] = token.grant.additional_data.get('user_identifier')
+            content_dict['user_name'] = token.user_identifier
+            content_dict['expires_in'] = max(
+                                    int(token.expires_at - time.time()), 0)
 
         content = json.dumps(content_dict)
         return (content, status, error)
 
+    def check_tokens(self, request, max_tokens=DEFAULT_CHECK_TOKENS_MAX_BATCH):
+        """
+        Batch version of check_token to validate several bearer tokens in one
+        request.  Tokens held in the access token register are read from it
+        in one operation where the register storage supports it.
+
+        Request body:
+              application/json format: array with an element for each token
+              which is either the access token or an object:
+        access_token
+              REQUIRED.  Bearer token
+        scope
+              OPTIONAL.  Scope
+
+        Response:
+              application/json format:
+        status
+              HTTP status of the request as a whole
+        error
+              error if the request as a whole is invalid
+        tokens
+              array with an element for each token in the request, in order:
+              status - HTTP status indicating the access control decision
+              user_name - user identifier corresponding to access token
+              expires_in - remaining lifetime of the token in seconds
+              error - error as described in
+              http://tools.ietf.org/html/draft-ietf-oauth-v2-22#section-5.2
+
+        @type request: webob.Request
+        @param request: HTTP request object
+
+        @type max_tokens: int
+        @param max_tokens: maximum number of tokens in one request
+
+        @rtype: tuple: (str, int, str)
+        @return: tuple (
+                     OAuth JSON response
+                     HTTP status
+                     error description
+                 )
+        """
+        # Check that the client is authenticated as a registered client.
+        try:
+            resource_id = self._authenticate(self.resource_authenticator,
+                                             request)
+        except OauthException, exc:
+            ERRORS.inc('check_tokens', exc.error)
+            content = json.dumps({'status': httplib.UNAUTHORIZED,
+                                  'error': exc.error})
+            return (content, httplib.UNAUTHORIZED, exc.error_description)
+
+        if resource_id is None:
+            log.warn('Resource authentication not performed')
+        else:
+            log.debug("Resource id: %s", resource_id)
+
+        try:
+            token_requests = self._parse_check_tokens_request(request,
+                                                              max_tokens)
+        except OauthException, exc:
+            ERRORS.inc('check_tokens', exc.error)
+            content = json.dumps({'status': httplib.BAD_REQUEST,
+                                  'error': exc.error})
+            return (content, httplib.BAD_REQUEST, exc.error_description)
+
+        # Signed tokens are verified individually; others are retrieved from
+        # the register together.
+        results = [None] * len(token_requests)
+        register_requests = []
+        register_indices = []
+        for i, (access_token, scope) in enumerate(token_requests):
+            if (self.access_token_verifier is not None and
+                self.access_token_verifier.is_signed_token(access_token)):
+                results[i] = self.access_token_verifier.verify_token(
+                                                        access_token, scope)
+            else:
+                register_requests.append((access_token, scope))
+                register_indices.append(i)
+
+        if register_requests:
+            for i, result in zip(
+                    register_indices,
+                    self.access_token_register.get_tokens(register_requests)):
+                results[i] = result
+
+        now = time.time()
+        token_content = []
+        for token, error in results:
+            TOKEN_VALIDATIONS.inc(error or 'valid')
+            token_dict = {'status': self._get_check_token_status(error)}
+            if error:
+                token_dict['error'] = error
+            else:
+                token_dict['user_name'] = token.user_identifier
+                token_dict['expires_in'] = max(int(token.expires_at - now), 0)
+            token_content.append(token_dict)
+
+        content = json.dumps({'status': httplib.OK, 'tokens': token_content})
+        return (content, httplib.OK, None)
+
+    @staticmethod
+    def _get_check_token_status(error):
+        """Gets the HTTP status indicating the access control decision for a
+        token, the same for check_token and each token of check_tokens.
+        @type error: str
+        @param error: error from validating the token or None if it is valid
+        @rtype: int
+        @return: HTTP status
+        """
+        return {'invalid_request': httplib.BAD_REQUEST,
+                'invalid_token': httplib.FORBIDDEN,
+                None: httplib.OK}.get(error, httplib.BAD_REQUEST)
+
+    @staticmethod
+    def _parse_check_tokens_request(request, max_tokens):
+        """Gets the access tokens and required scopes from a batch token check
+        request.
+        @rtype: list of tuple (basestring, basestring)
+        @return: access token and scope for each token
+        """
+        if request.method != 'POST':
+            raise OauthException('invalid_request',
+                                 'Batch token check requests must use POST')
+        try:
+            token_list = json.loads(request.body)
+        except ValueError, exc:
+            raise OauthException('invalid_request',
+                                 'Error parsing request body: %s' % exc)
+
+        if not isinstance(token_list, list):
+            raise OauthException('invalid_request',
+                                 'Expecting an array of tokens')
+
+        if len(token_list) > max_tokens:
+            raise OauthException('invalid_request',
+                                 'Number of tokens exceeds the maximum of %d' %
+                                 max_tokens)
+
+        token_requests = []
+        for item in token_list:
+            if isinstance(item, dict):
+                access_token = item.get('access_token')
+                scope = item.get('scope')
+            else:
+                access_token = item
+                scope = None
+
+            if (not isinstance(access_token, basestring) or
+                not (scope is None or isinstance(scope, basestring))):
+                raise OauthException('invalid_request',
+                                     'Invalid token array element: %r' % item)
+
+            token_requests.append((access_token.encode('utf-8'),
+                                   scope and scope.encode('utf-8')))
+
+        return token_requests
+
+    def _get_token(self, access_token, scope):
+        """Validates an access token, verifying the signature of signed tokens
+        and looking up other tokens in the access token register.
+        @rtype: tuple (AccessToken, str)
+        @return: token and None or None and error string
+        """
+        if (self.access_token_verifier is not None and
+            self.access_token_verifier.is_signed_token(access_token)):
+            result = self.access_token_verifier.verify_token(access_token,
+                                                             scope)
+        else:
+            result = self.access_token_register.get_token(access_token, scope)
+
+        TOKEN_VALIDATIONS.inc(result[1] or 'valid')
+        return result
+
+    @classmethod
+    def get_request_access_token(cls, request):
+        """Gets the bearer token from the Authorization header of a resource
+        request.
+        @type request: webob.Request
+        @param request: HTTP request object
+        @rtype: tuple (basestring, basestring)
+        @return: (access token, None) or (None, error)
+        """
+        authorization_hdr = request.environ.get(cls.AUTHZ_HDR_ENV_KEYNAME)
+        if authorization_hdr is None:
+            log.error('No Authorization header present for request to %r',
+                      request.path_url)
+            return None, 'invalid_request'
+
+        authorization_hdr_parts = authorization_hdr.split()
+        if len(authorization_hdr_parts) < 2:
+            log.error('Expecting at least two Authorization header '
+                      'elements for request to %r; '
+                      'header is: %r', request.path_url, authorization_hdr)
+            return None, 'invalid_request'
+
+        token_type, access_token = authorization_hdr_parts[:2]
+
+        # Currently only supports bearer type tokens
+        if token_type != cls.BEARER_TOK_ID:
+            log.error('Token type retrieved is %r, expecting "Bearer" '
+                      'type for request to %r', token_type, request.path_url)
+            return None, 'invalid_request'
+
+        return access_token, None
+
     def get_registered_token(self, request, scope=None):
         """
         Checks that a token in the request is valid. It would
@@ -576,32 +891,23 @@ class AuthorizationServer(object):
                      error description
                  )
         """
-        authorization_hdr = request.environ.get(
-                                        self.__class__.AUTHZ_HDR_ENV_KEYNAME)
-        if authorization_hdr is None:
-            log.error('No Authorization header present for request to %r',
-                      request.path_url)
-            error = 'invalid_request'
-            token = None            
-        else:
-            authorization_hdr_parts = authorization_hdr.split()
-            if len(authorization_hdr_parts) < 2:
-                log.error('Expecting at least two Authorization header '
-                          'elements for request to %r; '
-                          'header is: %r', request.path_url, authorization_hdr)
-                error = 'invalid_request'            
-                
-            token_type, access_token = authorization_hdr_parts[:2]
-            
-            # Currently only supports bearer type tokens
-            if token_type != self.__class__.BEARER_TOK_ID:
-                log.error('Token type retrieved is %r, expecting "Bearer" '
-                          'type for request to %r', token_type)
-                error = 'invalid_request'
-            else:   
-                token, error = self.access_token_register.get_token(
-                                                                access_token, 
-                                                                scope)
+        access_token, error = self.get_request_access_token(request)
+        if error is not None:
+            return None, httplib.BAD_REQUEST, error
+
+        return self.check_access_token(access_token, scope)
+
+    def check_access_token(self, access_token, scope=None):
+        """Checks that an access token is valid for a scope.
+        @type access_token: basestring
+        @param access_token: access token
+        @type scope: str
+        @param scope: required scope
+        @rtype: tuple: (str, int, str)
+        @return: tuple (access token, HTTP status, error description) as for
+        get_registered_token
+        """
+        token, error = self._get_token(access_token, scope)
 
         status = {'invalid_request': httplib.BAD_REQUEST,
                   'invalid_token': httplib.FORBIDDEN,
@@ -7,28 +7,78 @@ __license__ = "BSD - see LICENSE file in top-level directory"
 __contact__ = "Philip.Kershaw@stfc.ac.uk"
 __revision__ = "$Id$"
 
-from datetime import datetime, timedelta
+import calendar
+from datetime import datetime
 import logging
+import time
 import uuid
 
+from ndg.oauth.server.lib.register.record import RegisterRecord
 from ndg.oauth.server.lib.register.register_base import RegisterBase
 import ndg.oauth.server.lib.register.scopeutil as scopeutil
 
 log = logging.getLogger(__name__)
 
-class AccessToken(object):
+class AccessToken(RegisterRecord):
     """
-    Access token as stored in the reqister
+    Access token as stored in the reqister.  Times are held as integer seconds
+    since the epoch.  The authorization grant from which the token was issued
+    is referenced by its code rather than stored with the token.
     """
+    USER_IDENTIFIER_GRANT_DATA_KEY = 'user_identifier'
+    FIELDS = ('token_id', 'token_type', 'scope', 'client_id',
+              'user_identifier', 'grant_code', 'issued_at', 'lifetime',
+              'expires_at', 'valid')
+    __slots__ = FIELDS
+
     def __init__(self, token_type, lifetime):
         self.token_id = uuid.uuid4().hex
         self.token_type = token_type
-        self.grant = None
         self.scope = None
-        self.timestamp = datetime.now()
-        self.lifetime = lifetime
-        self.expires = self.timestamp + timedelta(days=0, seconds=lifetime)
+        self.client_id = None
+        self.user_identifier = None
+        self.grant_code = None
+        self.issued_at = int(time.time())
+        self.lifetime = int(lifetime)
+        self.expires_at = self.issued_at + self.lifetime
         self.valid = True
+
+    def __setstate__(self, state):
+        super(AccessToken, self).__setstate__(state)
+        if isinstance(self.scope, list):
+            self.scope = scopeutil.makeScopeList(self.scope)
+
+    @property
+    def timestamp(self):
+        return datetime.utcfromtimestamp(self.issued_at)
+
+    @property
+    def expires(self):
+        return datetime.utcfromtimestamp(self.expires_at)
+
+    def _set_legacy_state(self, state):
+        """Converts a token pickled with its grant by an earlier version.
+        """
+        grant = state.get('grant')
+        self.token_id = state['token_id']
+        self.token_type = state.get('token_type')
+        self.scope = state.get('scope')
+        self.client_id = state.get('client_id',
+                                   getattr(grant, 'client_id', None))
+        self.user_identifier = state.get('user_identifier',
+                                    self._get_grant_user_identifier(grant))
+        self.grant_code = getattr(grant, 'code', None)
+        self.issued_at = calendar.timegm(state['timestamp'].utctimetuple())
+        self.lifetime = int(state['lifetime'])
+        self.expires_at = calendar.timegm(state['expires'].utctimetuple())
+        self.valid = state.get('valid', True)
+
+    @classmethod
+    def _get_grant_user_identifier(cls, grant):
+        additional_data = getattr(grant, 'additional_data', None)
+        if not additional_data:
+            return None
+        return additional_data.get(cls.USER_IDENTIFIER_GRANT_DATA_KEY)
               
     @classmethod  
     def from_token_request(cls, token_type, grant, lifetime):
@@ -38,8 +88,10 @@ class AccessToken(object):
         obj = cls(token_type, lifetime)
         
         obj.token_type = token_type
-        obj.grant = grant        
+        obj.grant_code = grant.code
         obj.scope = scopeutil.scopeStringToList(grant.scope_str)
+        obj.client_id = grant.client_id
+        obj.user_identifier = cls._get_grant_user_identifier(grant)
         
         return obj
 
@@ -51,10 +103,27 @@ class AccessToken(object):
         obj = cls(token_type, lifetime)
 
         obj.token_type = token_type
-        obj.scope = authz_request.scope
+        obj.scope = scopeutil.scopeStringToList(authz_request.scope)
+        obj.client_id = authz_request.client_id
         
         return obj
 
+    @classmethod
+    def from_claims(cls, token_id, token_type, claims):
+        '''Create an instance from the claims contained in a self-contained
+        signed token
+        '''
+        obj = cls(token_type, claims['exp'] - claims['iat'])
+
+        obj.token_id = token_id
+        obj.scope = scopeutil.makeScopeList(claims.get('scope'))
+        obj.client_id = claims.get('client_id')
+        obj.user_identifier = claims.get('sub')
+        obj.issued_at = claims['iat']
+        obj.expires_at = claims['exp']
+
+        return obj
+
     @classmethod
     def create(cls, token_type, _arg, lifetime):
         if hasattr(_arg, 'scope_str'):
@@ -73,13 +142,37 @@ class AccessToken(object):
 class AccessTokenRegister(RegisterBase):
     """
     Access token reqister that holds access tokens as determined by the cache
-    options
+    options.  Tokens are indexed by user, client and authorization grant so
+    that all of the tokens for one of these can be revoked together.  This
+    needs storage which supports indexes, i.e., SQLite; the revoke_by methods
+    raise NotImplementedError otherwise.
+
+    Callables added with add_revocation_listener are called with the ID of
+    each token revoked, e.g., to remove it from caches of validated tokens.
     """
     CACHE_NAME = 'accesstokenregister'
+    USER_INDEX = 'user'
+    CLIENT_INDEX = 'client'
+    GRANT_INDEX = 'grant'
+    RECORD_CLASS = AccessToken
+    DEFAULT_MEMORY_CACHE_SIZE = 10000
 
     def __init__(self, config, prefix='cache'):
         cache_opts = self.parse_config(prefix, self.CACHE_NAME, config)
         super(AccessTokenRegister, self).__init__('AccessTokenRegister', cache_opts)
+        self._revocation_listeners = []
+
+    def add_revocation_listener(self, listener):
+        """
+        @type listener: callable
+        @param listener: function called with the ID of each revoked token
+        """
+        if listener not in self._revocation_listeners:
+            self._revocation_listeners.append(listener)
+
+    def remove_revocation_listener(self, listener):
+        if listener in self._revocation_listeners:
+            self._revocation_listeners.remove(listener)
 
     def add_token(self, token):
         """Adds a token to the register.
@@ -95,6 +188,85 @@ class AccessTokenRegister(RegisterBase):
         log.debug("Added token of ID: %s", token.token_id)
         return True
 
+    def revoke_token(self, token_id):
+        """Marks a registered token as invalid.
+        @type token_id: basestring
+        @param token_id: token ID
+        @rtype: bool
+        @return: True if the token was found and revoked, otherwise False
+        """
+        try:
+            token = self.get_value(token_id)
+        except KeyError:
+            log.debug("Request to revoke token of ID that is not registered: "
+                      "%s", token_id)
+            return False
+
+        if token.valid:
+            token.valid = False
+            self.set_value(token_id, token)
+
+        for listener in self._revocation_listeners:
+            try:
+                listener(token_id)
+            except Exception, exc:
+                log.error("Error notifying revocation of token of ID %s: %s",
+                          token_id, exc)
+
+        log.debug("Revoked token of ID: %s", token_id)
+        return True
+
+    def revoke_by_user(self, user_identifier):
+        """Revokes all tokens issued to a user.
+        @type user_identifier: basestring
+        @param user_identifier: user identifier
+        @rtype: int
+        @return: number of tokens revoked
+        """
+        return self._revoke_by_index(self.USER_INDEX, user_identifier)
+
+    def revoke_by_client(self, client_id):
+        """Revokes all tokens issued to a client.
+        @type client_id: basestring
+        @param client_id: client ID
+        @rtype: int
+        @return: number of tokens revoked
+        """
+        return self._revoke_by_index(self.CLIENT_INDEX, client_id)
+
+    def revoke_by_grant(self, grant_code):
+        """Revokes all tokens issued for an authorization grant.
+        @type grant_code: basestring
+        @param grant_code: authorization code
+        @rtype: int
+        @return: number of tokens revoked
+        """
+        return self._revoke_by_index(self.GRANT_INDEX, grant_code)
+
+    def _revoke_by_index(self, name, value):
+        n_revoked = 0
+        for token_id in self.get_keys_by_index(name, value):
+            if self.revoke_token(token_id):
+                n_revoked += 1
+
+        log.debug("Revoked %d tokens with %s %s", n_revoked, name, value)
+        return n_revoked
+
+    def get_indexes(self, token):
+        indexes = {}
+        for name, value in ((self.USER_INDEX, token.user_identifier),
+                            (self.CLIENT_INDEX, token.client_id),
+                            (self.GRANT_INDEX, token.grant_code)):
+            if value is not None:
+                indexes[name] = value
+        return indexes
+
+    def get_expiry(self, token):
+        """Gets the token expiry time as seconds since the epoch so that
+        expired tokens are not held in the in-memory cache.
+        """
+        return token.expires_at
+
     def get_token(self, token_id, scope):
         """Retrieves a registered token by token ID and required scope.
         @type token_id: basestring
@@ -105,21 +277,46 @@ class AccessTokenRegister(RegisterBase):
         try:
             token = self.get_value(token_id)
         except KeyError:
+            token = None
+
+        return self._check_token(token_id, token, scope)
+
+    def get_tokens(self, token_requests):
+        """Retrieves several registered tokens, reading them from the storage
+        in one operation where possible.
+        @type token_requests: iterable of tuple (basestring, basestring)
+        @param token_requests: token ID and required scopes as space separated
+        string for each token
+        @rtype: list of tuple (AccessToken, str)
+        @return: token and None or None and error string for each token
+        requested, in order
+        """
+        token_requests = list(token_requests)
+        tokens = self.get_values(set([token_id
+                                      for token_id, _ in token_requests]))
+        return [self._check_token(token_id, tokens.get(token_id), scope)
+                for token_id, scope in token_requests]
+
+    def _check_token(self, token_id, token, scope):
+        if token is None:
             log.debug("Request for token of ID that is not registered: %s",
                       token_id)
             return None, 'invalid_token'
 
         if not token.valid:
             log.debug("Request for invalid token of ID: %s", token_id)
+            self.invalidate(token_id)
             return None, 'invalid_token'
         
-        if token.expires <= datetime.utcnow():
+        if token.expires_at <= time.time():
             log.debug("Request for expired token of ID: %s", token_id)
+            self.invalidate(token_id)
             return None, 'invalid_token'
                     
         # Check scope
         if not scopeutil.isScopeGranted(token.scope,
-                                        scopeutil.scopeStringToList(scope)):
+                                        scopeutil.scopeStringToList(
+                                                        scope, assign=False)):
             log.debug("Request for token of ID: %s - token was not granted "
                       "scope %s", token_id, scope)
             return None, 'insufficient_scope'
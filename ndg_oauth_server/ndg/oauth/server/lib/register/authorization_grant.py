@@ -7,18 +7,28 @@ __license__ = "BSD - see LICENSE file in top-level directory"
 __contact__ = "Philip.Kershaw@stfc.ac.uk"
 __revision__ = "$Id$"
 
-from datetime import datetime, timedelta
+import calendar
+from datetime import datetime
 import logging
+import time
 
+from ndg.oauth.server.lib.register.record import RegisterRecord
 from ndg.oauth.server.lib.register.register_base import RegisterBase
 
 log = logging.getLogger(__name__)
 
 
-class AuthorizationGrant(object):
+class AuthorizationGrant(RegisterRecord):
     """
-    Authorization grant as stored in the reqister
+    Authorization grant as stored in the reqister.  Times are held as integer
+    seconds since the epoch.  The access token issued for the grant is
+    referenced by its ID.
     """
+    FIELDS = ('code', 'client_id', 'redirect_uri', 'scope_str',
+              'additional_data', 'issued_at', 'expires_at', 'granted',
+              'token_id')
+    __slots__ = FIELDS
+
     def __init__(self, code, request, lifetime, scope=None, additional_data=None):
         self.code = code
         self.client_id = request.client_id
@@ -26,9 +36,34 @@ class AuthorizationGrant(object):
         # Allow for authorized scope to be different from requested scope.
         self.scope_str = (scope if scope is not None else request.scope)
         self.additional_data = additional_data
-        self.timestamp = datetime.utcnow()
-        self.expires = self.timestamp + timedelta(days=0, seconds=lifetime)
+        self.issued_at = int(time.time())
+        self.expires_at = self.issued_at + int(lifetime)
         self.granted = False
+        self.token_id = None
+
+    @property
+    def timestamp(self):
+        return datetime.utcfromtimestamp(self.issued_at)
+
+    @property
+    def expires(self):
+        return datetime.utcfromtimestamp(self.expires_at)
+
+    def _set_legacy_state(self, state):
+        """Converts a grant pickled by an earlier version.
+        """
+        self.code = state['code']
+        self.client_id = state.get('client_id')
+        self.redirect_uri = state.get('redirect_uri')
+        self.scope_str = state.get('scope_str')
+        self.additional_data = state.get('additional_data')
+        self.issued_at = calendar.timegm(state['timestamp'].utctimetuple())
+        self.expires_at = calendar.timegm(state['expires'].utctimetuple())
+        self.granted = state.get('granted', False)
+
+        # The token may be only partly unpickled if this grant is embedded in
+        # it.
+        self.token_id = getattr(state.get('token'), 'token_id', None)
         
 
 class AuthorizationGrantRegister(RegisterBase):
@@ -37,6 +72,7 @@ class AuthorizationGrantRegister(RegisterBase):
     cache options
     """
     CACHE_NAME = 'authorizationgrantregister'
+    RECORD_CLASS = AuthorizationGrant
 
     def __init__(self, config, prefix='cache'):
         cache_opts = self.parse_config(prefix, self.CACHE_NAME, config)
@@ -52,3 +88,8 @@ class AuthorizationGrantRegister(RegisterBase):
 
         self.set_value(grant.code, grant)
         return True
+
+    def get_expiry(self, grant):
+        """Gets the grant expiry time as seconds since the epoch.
+        """
+        return grant.expires_at
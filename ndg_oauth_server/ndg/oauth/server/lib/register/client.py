@@ -7,7 +7,10 @@ __license__ = "BSD - see LICENSE file in top-level directory"
 __contact__ = "Philip.Kershaw@stfc.ac.uk"
 __revision__ = "$Id$"
 import logging
-from ConfigParser import SafeConfigParser
+
+from ndg.oauth.server.lib.register.file_register import (FileRegister,
+                                                         read_rate_limit)
+
 log = logging.getLogger(__name__)
 
 
@@ -24,7 +27,8 @@ class ClientRegistration(object):
     CLIENT_TYPES = (CLIENT_TYPE_PUBLIC, CLIENT_TYPE_CONFIDENTIAL)
     
     def __init__(self, name, client_id, client_secret, client_type,
-                 redirect_uris, authentication_data):
+                 redirect_uris, authentication_data, rate_limit=None,
+                 rate_limit_burst=None):
         self.name = name
         self.id = client_id
         self.secret = client_secret
@@ -50,26 +54,28 @@ class ClientRegistration(object):
         
         self.authentication_data = authentication_data
 
+        # Requests per second and burst size overriding the server's rate
+        # limit for this client
+        self.rate_limit = rate_limit
+        self.rate_limit_burst = rate_limit_burst
+
 
-class ClientRegister(object):
+class ClientRegister(FileRegister):
     """
-    Client reqister read from a configuration file
+    Client reqister read from a configuration file.  Clients are indexed by
+    the normalised form of their certificate DN for certificate
+    authentication.
     """
-    register = {}
-    def __init__(self, config_file=None):
-        """
-	    @type config_file: basestring
-	    @param config_file: configuration file to be read.  If the file is
-	    None or null, no read is attempted.
-	    """
-        if config_file:
-            config = SafeConfigParser()
-            config.read(config_file)
-            client_keys = config.get('client_register', 'clients').strip()
-
-            if client_keys:
-                for client_key in [k.strip() for k in client_keys.split(',')]:
-                    self._create_client(config, client_key, 'client')
+    SQLITE_REGISTER_CLASS = \
+        'ndg.oauth.server.lib.register.sqlite_register.SQLiteClientRegister'
+
+    def _read_registrations(self, config):
+        client_keys = config.get('client_register', 'clients').strip()
+        if not client_keys:
+            return []
+
+        return [self._create_client(config, k.strip(), 'client')
+                for k in client_keys.split(',')]
 
     def _create_client(self, config, client_key, prefix):
         client_section_name = prefix + ':' + client_key
@@ -86,15 +92,14 @@ class ClientRegister(object):
         else:
             authentication_data = None
             
-        client_registration = ClientRegistration(
+        return ClientRegistration(
             config.get(client_section_name, 'name'),
             client_id,
             client_secret,
             config.get(client_section_name, 'type'),
             config.get(client_section_name, 'redirect_uris'),
-            authentication_data)
-
-        self.register[client_id] = client_registration
+            authentication_data,
+            **read_rate_limit(config, client_section_name))
 
     def is_registered_client(self, client_id):
         """Determines if a client ID is in the client register.
@@ -109,11 +114,10 @@ class ClientRegister(object):
         redirect_uri is registered for that client.
         """
         # Check if client ID is registered.
-        if client_id not in self.register:
+        client = self.register.get(client_id)
+        if client is None:
             return 'Client of id "%s" is not registered.' % client_id
 
-        client = self.register[client_id]
-
         if redirect_uri is None:
             if len(client.redirect_uris) != 1:
                 return ('No redirect URI is registered for the client or '
@@ -124,4 +128,3 @@ class ClientRegister(object):
             return 'Redirect URI is not registered.'
 
         return None
-
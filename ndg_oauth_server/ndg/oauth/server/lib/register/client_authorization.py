@@ -13,12 +13,23 @@ class ClientAuthorization(object):
     """
     Represents authorizations granted by the resource owner to clients.
     """
-    def __init__(self, user, client_id, scope, is_authorized):
+    def __init__(self, user, client_id, scope, is_authorized, assign=True):
+        """
+        @type assign: bool
+        @param assign: assign scope bit positions - False for an authorization
+        requested rather than granted
+        """
         self.user = user
         self.client_id = client_id
-        self.scope = scopeutil.scopeStringToList(scope)
+        self.scope = scopeutil.scopeStringToList(scope, assign=assign)
         self.is_authorized = is_authorized
 
+    def __setstate__(self, state):
+        # Authorizations held in the session are pickled with a plain list of
+        # scopes
+        self.__dict__.update(state)
+        self.scope = scopeutil.makeScopeList(self.scope)
+
     def eq_authz_basis(self, other):
         """Determines whether a requested client authorization is equivalent to
         a granted one.
@@ -39,6 +50,46 @@ class ClientAuthorization(object):
                                                             self.scope, 
                                                             self.is_authorized)
 
+def merge_client_authorization(client_authorizations, client_authorization):
+    """Adds a decision to those made by a user for a client.  The decision
+    also applies to earlier ones for the same scopes or more, and replaces
+    any for the same scopes.
+    @type client_authorizations: list of ClientAuthorization
+    @param client_authorizations: earlier decisions, which are updated
+    @type client_authorization: ClientAuthorization
+    @param client_authorization: new decision
+    @rtype: list of ClientAuthorization
+    @return: decisions including the new one
+    """
+    scope = set(client_authorization.scope)
+    merged = []
+    for auth in client_authorizations:
+        if auth.eq_authz_basis(client_authorization):
+            auth.is_authorized = client_authorization.is_authorized
+        if set(auth.scope) != scope:
+            merged.append(auth)
+    merged.append(client_authorization)
+    return merged
+
+def find_client_authorization(client_authorizations, user, client_id, scope):
+    """Finds the decision made by a user for a client which covers a scope.
+    @type client_authorizations: list of ClientAuthorization
+    @param client_authorizations: decisions made by the user for the client
+    @rtype: bool
+    @return: the decision or None if there isn't one
+    """
+    if not client_authorizations:
+        return None
+    client_authorization = ClientAuthorization(user, client_id, scope, True,
+                                               assign=False)
+    # Assume small number of authorization types per user/client 
+    # (probably typically one).
+    for auth in client_authorizations:
+        if auth.eq_authz_basis(client_authorization):
+            return auth.is_authorized
+    return None
+
+
 class ClientAuthorizationRegister(object):
     """
     Register of authorizations granted by the resource owner to clients.
@@ -49,26 +100,17 @@ class ClientAuthorizationRegister(object):
     def add_client_authorization(self, client_authorization):
         user_authorizations = self.register.setdefault(
                                             client_authorization.user, {})
-        client_authorizations = user_authorizations.setdefault(
-                                            client_authorization.client_id, [])
-        for auth in client_authorizations:
-            if auth.eq_authz_basis(client_authorization):
-                auth.is_authorized = client_authorization.is_authorized
-
-        user_authorizations[client_authorization.client_id].append(
-                                            client_authorization)
-
+        user_authorizations[client_authorization.client_id] = \
+            merge_client_authorization(
+                user_authorizations.get(client_authorization.client_id, []),
+                client_authorization)
 
     def is_client_authorized_by_user(self, user, client_id, scope):
-        client_authorization = ClientAuthorization(user, client_id, scope, True)
         user_authorizations = self.register.get(user)
         if user_authorizations:
-            client_authorizations = user_authorizations.get(client_id, [])
-            # Assume small number of authorization types per user/client 
-            # (probably typically one).
-            for auth in client_authorizations:
-                if auth.eq_authz_basis(client_authorization):
-                    return auth.is_authorized
+            return find_client_authorization(
+                                        user_authorizations.get(client_id),
+                                        user, client_id, scope)
         return None
 
     def __repr__(self):
@@ -0,0 +1,229 @@
+"""OAuth 2.0 WSGI server middleware - server-side stores of the decisions made
+by users to authorize clients
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "(C) 2026 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+__revision__ = "$Id$"
+
+import copy
+import logging
+import os
+import sqlite3
+import threading
+import time
+import urllib
+
+from ndg.oauth.server.lib.register.client_authorization import (
+                                                ClientAuthorization,
+                                                find_client_authorization,
+                                                merge_client_authorization)
+from ndg.oauth.server.lib.render.factory import importModuleObject
+from ndg.oauth.server.lib.utils.blocking import (get_thread_local_class,
+                                                 run_blocking)
+from ndg.oauth.server.lib.utils.lru_cache import LRUCache
+
+log = logging.getLogger(__name__)
+
+
+class MemoryClientAuthorizationStore(object):
+    """
+    Client authorizations held in memory in the process and shared by all the
+    sessions of a user.  Decisions are held by user and client ID, with their
+    scopes as masks, so that a check is a dict lookup and mask comparison.
+    They are lost when the process exits and the least recently used are
+    dropped when the store is full, after which the user is asked again.
+    """
+    DEFAULT_MAX_ENTRIES = 100000
+
+    def __init__(self, config):
+        """
+        @type config: dict
+        @param config: options - max_entries is the number of user and client
+        pairs held
+        """
+        max_entries = int(config.get('max_entries') or
+                          self.DEFAULT_MAX_ENTRIES)
+        self._authorizations = LRUCache(max_entries)
+        self._lock = threading.Lock()
+
+    def add_client_authorization(self, client_authorization):
+        """
+        @type client_authorization: ClientAuthorization
+        @param client_authorization: decision made by a user
+        """
+        key = (client_authorization.user, client_authorization.client_id)
+        with self._lock:
+            # Lists held in the cache aren't changed so that they can be read
+            # without the lock
+            client_authorizations = [
+                copy.copy(auth) for auth in self._authorizations.get(key, ())]
+            self._authorizations.set(key, merge_client_authorization(
+                                                        client_authorizations,
+                                                        client_authorization))
+
+    def is_client_authorized_by_user(self, user, client_id, scope):
+        """
+        @type user: str
+        @param user: user identifier
+        @type client_id: str
+        @param client_id: client ID
+        @type scope: str
+        @param scope: space separated scopes requested
+        @rtype: bool
+        @return: the user's decision or None if they haven't made one
+        """
+        return find_client_authorization(
+                                self._authorizations.get((user, client_id)),
+                                user, client_id, scope)
+
+
+class SQLiteClientAuthorizationStore(object):
+    """
+    Client authorizations held in an SQLite database so that they persist
+    across restarts and are shared by the worker processes of a server on one
+    host.  The table is keyed by user, client ID and scopes, and a user's
+    decisions for a client are read in the order in which they were made.
+    When serving with gevent, the database is accessed in gevent's thread
+    pool and connections are held per OS thread.
+    """
+    TABLE = 'client_authorizations'
+    DEFAULT_TIMEOUT = 30.
+
+    def __init__(self, config):
+        """
+        @type config: dict
+        @param config: options - file is the database file and timeout the
+        time in seconds to wait for the database lock
+        """
+        self.filename = config.get('file')
+        if not self.filename:
+            raise ValueError('A database file must be set for client '
+                             'authorizations held in SQLite')
+        dir_name = os.path.dirname(self.filename)
+        if dir_name and not os.path.isdir(dir_name):
+            os.makedirs(dir_name)
+
+        self.timeout = float(config.get('timeout') or self.DEFAULT_TIMEOUT)
+        self._local = get_thread_local_class()()
+        self._get_connection().execute(
+            'CREATE TABLE IF NOT EXISTS %s ('
+            'user TEXT NOT NULL, '
+            'client_id TEXT NOT NULL, '
+            'scope TEXT NOT NULL, '
+            'authorized INTEGER NOT NULL, '
+            'updated REAL NOT NULL, '
+            'PRIMARY KEY (user, client_id, scope))' % self.TABLE)
+
+    def _get_connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.filename, timeout=self.timeout,
+                                   isolation_level=None)
+            conn.text_factory = str
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _encode_scope(scope):
+        """Converts a list of scopes to the form stored, which is the same for
+        any order of the scopes.
+        """
+        return ' '.join(sorted(set([urllib.quote_plus(s) for s in scope])))
+
+    def _get_client_authorizations(self, conn, user, client_id):
+        rows = conn.execute('SELECT scope, authorized FROM %s '
+                            'WHERE user = ? AND client_id = ? '
+                            'ORDER BY rowid' % self.TABLE,
+                            (user, client_id)).fetchall()
+        return [ClientAuthorization(user, client_id, scope, bool(authorized))
+                for scope, authorized in rows]
+
+    def add_client_authorization(self, client_authorization):
+        """
+        @type client_authorization: ClientAuthorization
+        @param client_authorization: decision made by a user
+        """
+        run_blocking(self._add_client_authorization, client_authorization)
+
+    def _add_client_authorization(self, client_authorization):
+        user = client_authorization.user
+        client_id = client_authorization.client_id
+        conn = self._get_connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            client_authorizations = merge_client_authorization(
+                        self._get_client_authorizations(conn, user, client_id),
+                        client_authorization)
+            conn.execute('DELETE FROM %s WHERE user = ? AND client_id = ?' %
+                         self.TABLE, (user, client_id))
+            now = time.time()
+            conn.executemany(
+                'INSERT INTO %s (user, client_id, scope, authorized, updated) '
+                'VALUES (?, ?, ?, ?, ?)' % self.TABLE,
+                [(user, client_id, self._encode_scope(auth.scope),
+                  int(bool(auth.is_authorized)), now)
+                 for auth in client_authorizations])
+            conn.execute('COMMIT')
+        except:
+            conn.execute('ROLLBACK')
+            raise
+
+    def is_client_authorized_by_user(self, user, client_id, scope):
+        """
+        @type user: str
+        @param user: user identifier
+        @type client_id: str
+        @param client_id: client ID
+        @type scope: str
+        @param scope: space separated scopes requested
+        @rtype: bool
+        @return: the user's decision or None if they haven't made one
+        """
+        return find_client_authorization(
+                run_blocking(self._read_client_authorizations, user,
+                             client_id),
+                user, client_id, scope)
+
+    def _read_client_authorizations(self, user, client_id):
+        return self._get_client_authorizations(self._get_connection(), user,
+                                               client_id)
+
+
+BACKENDS = {
+    'memory': MemoryClientAuthorizationStore,
+    'sqlite': SQLiteClientAuthorizationStore,
+}
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+def get_shared_store(backend, filename=None):
+    """Gets a client authorization store shared by all the middleware in the
+    process, creating it if necessary, so that decisions recorded by the
+    authorization and authentication filters are seen by the server.
+    @type backend: str
+    @param backend: memory, sqlite or the module:class name of a store with
+    the same interface, constructed with a dict of options
+    @type filename: str
+    @param filename: database file for the sqlite backend
+    @rtype: object
+    @return: store
+    """
+    if filename:
+        filename = os.path.abspath(filename)
+    key = (backend, filename)
+    with _shared_lock:
+        store = _shared.get(key)
+        if store is None:
+            store_class = BACKENDS.get(backend)
+            if store_class is None:
+                store_class = importModuleObject(backend)
+            store = store_class({'file': filename})
+            _shared[key] = store
+            log.debug("Using %s client authorization store", backend)
+    return store
@@ -0,0 +1,322 @@
+"""OAuth 2.0 WSGI server middleware - base for client and resource registers
+read from configuration files
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "(C) 2026 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+__revision__ = "$Id$"
+
+from ConfigParser import SafeConfigParser
+import atexit
+import logging
+import os
+import signal
+import threading
+
+from ndg.oauth.server.lib.render.factory import importModuleObject
+from ndg.oauth.server.lib.utils.dn import index_by_dn, normalise_dn
+
+log = logging.getLogger(__name__)
+
+
+def read_rate_limit(config, section_name):
+    """Reads the rate limit settings of a registration.
+    @type config: ConfigParser.SafeConfigParser
+    @param config: parsed register file
+    @type section_name: str
+    @param section_name: section of the registration
+    @rtype: dict
+    @return: rate_limit, in requests per second, and rate_limit_burst for
+    those which are set
+    """
+    settings = {}
+    for option in ('rate_limit', 'rate_limit_burst'):
+        if config.has_option(section_name, option):
+            value = config.get(section_name, option).strip()
+            if value:
+                settings[option] = float(value)
+    return settings
+
+
+class FileRegisterSnapshot(object):
+    """Registrations read from one version of a register file together with
+    the indexes derived from them.  A snapshot is not modified once it has
+    been created so it can be read without locking.
+    """
+    __slots__ = ('register', 'dn_index', 'mtime')
+
+    def __init__(self, register, mtime=None):
+        """
+        @type register: dict
+        @param register: registrations keyed by ID
+        @type mtime: float
+        @param mtime: modification time of the file read
+        """
+        self.register = register
+        self.dn_index = index_by_dn(register.itervalues())
+        self.mtime = mtime
+
+
+class FileRegister(object):
+    """
+    Base class for registers read from a configuration file.  The
+    registrations are held in a snapshot which is replaced as a whole when the
+    file is reloaded so that a request never sees a partly loaded register.
+    Derived classes implement _read_registrations.
+
+    Registers obtained with get_shared are shared by all the middleware in a
+    process which use the same file and can be reloaded by a background
+    thread when the file changes.  A file name with the prefix sqlite: gets
+    the register class named by SQLITE_REGISTER_CLASS which reads
+    registrations from an SQLite database.
+    """
+    DEFAULT_RELOAD_INTERVAL = 60
+    SQLITE_PREFIX = 'sqlite:'
+    SQLITE_REGISTER_CLASS = None
+
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, config_file=None):
+        """
+        @type config_file: basestring
+        @param config_file: configuration file to be read.  If the file is
+        None or null, no read is attempted.
+        """
+        self.config_file = config_file
+        self._reload_lock = threading.Lock()
+        self._failed_mtime = None
+        self._snapshot = self._load()
+
+    @classmethod
+    def get_shared(cls, config_file, reload_interval=DEFAULT_RELOAD_INTERVAL):
+        """Gets the register for a file shared across the process, creating it
+        if necessary.
+        @type config_file: basestring
+        @param config_file: configuration file, or sqlite: followed by the
+        database file
+        @type reload_interval: int or float
+        @param reload_interval: time in seconds between checks for changes to
+        the file.  Set to zero to disable reloading.
+        @rtype: FileRegister
+        @return: register
+        """
+        register_class = cls
+        if config_file and config_file.startswith(cls.SQLITE_PREFIX):
+            if cls.SQLITE_REGISTER_CLASS is None:
+                raise ValueError('%s has no SQLite implementation' %
+                                 cls.__name__)
+            register_class = importModuleObject(cls.SQLITE_REGISTER_CLASS,
+                                                objectType=cls)
+            config_file = config_file[len(cls.SQLITE_PREFIX):]
+
+        if config_file:
+            key = (register_class, os.path.abspath(config_file))
+        else:
+            key = (register_class, None)
+
+        cls._shared_lock.acquire()
+        try:
+            register = cls._shared.get(key)
+            if register is None:
+                register = register_class(config_file)
+                cls._shared[key] = register
+        finally:
+            cls._shared_lock.release()
+
+        if config_file and float(reload_interval) > 0:
+            FileRegisterReloader.get_instance().add(register, reload_interval)
+
+        return register
+
+    @property
+    def register(self):
+        """Current registrations keyed by ID"""
+        return self._snapshot.register
+
+    @property
+    def dn_index(self):
+        """Current registrations keyed by normalised certificate DN"""
+        return self._snapshot.dn_index
+
+    def _load(self):
+        register = {}
+        mtime = None
+        if self.config_file:
+            mtime = os.path.getmtime(self.config_file)
+            config = SafeConfigParser()
+            config.read(self.config_file)
+            for registration in self._read_registrations(config):
+                register[registration.id] = registration
+
+        return FileRegisterSnapshot(register, mtime=mtime)
+
+    def _read_registrations(self, config):
+        """Reads the registrations in a register file.
+        @type config: ConfigParser.SafeConfigParser
+        @param config: parsed file
+        @rtype: iterable
+        @return: registrations
+        """
+        raise NotImplementedError()
+
+    def reload(self, force=False):
+        """Re-reads the file if it has changed since it was last read.  The
+        current registrations are kept if the file can't be read.
+        @type force: bool
+        @param force: read the file even if its modification time hasn't
+        changed
+        @rtype: bool
+        @return: True if the registrations were replaced
+        """
+        if not self.config_file:
+            return False
+
+        self._reload_lock.acquire()
+        try:
+            try:
+                mtime = os.path.getmtime(self.config_file)
+            except OSError:
+                mtime = None
+
+            # Errors are only logged once for each change to the file.
+            if not force and mtime in (self._snapshot.mtime,
+                                       self._failed_mtime):
+                return False
+
+            try:
+                snapshot = self._load()
+            except Exception, exc:
+                self._failed_mtime = mtime
+                log.error("Error reloading register file %r - keeping the "
+                          "current registrations: %s", self.config_file, exc)
+                return False
+
+            self._snapshot = snapshot
+        finally:
+            self._reload_lock.release()
+
+        log.info("Reloaded %d registrations from %r", len(snapshot.register),
+                 self.config_file)
+        return True
+
+    def get_registration_by_dn(self, dn):
+        """Gets the registration with a certificate DN.
+        @type dn: basestring
+        @param dn: certificate DN in any of the formats handled by
+        ndg.oauth.server.lib.utils.dn.normalise_dn
+        @return: registration or None if there is none with the DN
+        """
+        return self._snapshot.dn_index.get(normalise_dn(dn))
+
+
+class FileRegisterReloader(threading.Thread):
+    """
+    Background thread which reloads shared file registers when their files
+    change.  The files are checked at the shortest interval requested for any
+    of them.  A reload of all the registers can also be requested with
+    SIGHUP once install_signal_handler has been called.
+    """
+    STOP_TIMEOUT = 5.
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self):
+        super(FileRegisterReloader, self).__init__(name='FileRegisterReloader')
+        self.daemon = True
+        self.registers = []
+        self.interval = None
+        self._lock = threading.Lock()
+        self._wake_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._force = False
+
+    @classmethod
+    def get_instance(cls):
+        """Gets the reloader for the process, starting it if necessary.
+        @rtype: FileRegisterReloader
+        @return: reloader
+        """
+        cls._instance_lock.acquire()
+        try:
+            if cls._instance is None:
+                cls._instance = cls()
+                cls._instance.start()
+
+                # Stop the thread before the interpreter starts to shut down.
+                atexit.register(cls._instance.stop, cls.STOP_TIMEOUT)
+            return cls._instance
+        finally:
+            cls._instance_lock.release()
+
+    def add(self, register, interval):
+        """
+        @type register: FileRegister
+        @param register: register to reload
+        @type interval: int or float
+        @param interval: time in seconds between checks for changes
+        """
+        interval = float(interval)
+        self._lock.acquire()
+        try:
+            if register not in self.registers:
+                self.registers.append(register)
+            if self.interval is None or interval < self.interval:
+                self.interval = interval
+                self._wake_event.set()
+        finally:
+            self._lock.release()
+
+    def reload_all(self, force=True):
+        """Requests a reload of all the registers by the thread.  This doesn't
+        wait for the reload so it is safe to call from a signal handler.
+        """
+        self._force = force
+        self._wake_event.set()
+
+    def install_signal_handler(self, signum=signal.SIGHUP):
+        """Reloads the registers when the process receives a signal.  This
+        must be called from the main thread.
+        @rtype: bool
+        @return: True if the handler was installed
+        """
+        try:
+            signal.signal(signum, lambda *args: self.reload_all())
+        except ValueError, exc:
+            log.warning("Unable to install handler to reload registers on "
+                        "signal %d: %s", signum, exc)
+            return False
+
+        return True
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self._wake_event.wait(self.interval)
+            self._wake_event.clear()
+            if self._stop_event.is_set():
+                break
+
+            force = self._force
+            self._force = False
+            self._lock.acquire()
+            try:
+                registers = list(self.registers)
+            finally:
+                self._lock.release()
+
+            for register in registers:
+                register.reload(force=force)
+
+    def stop(self, timeout=None):
+        """Stops the thread after any reload in progress has completed.
+        @type timeout: float
+        @param timeout: if set, wait up to this time in seconds for the thread
+        to finish
+        """
+        self._stop_event.set()
+        self._wake_event.set()
+        if timeout is not None and self.is_alive():
+            self.join(timeout)
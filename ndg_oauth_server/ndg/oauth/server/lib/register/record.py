@@ -0,0 +1,102 @@
+"""OAuth 2.0 WSGI server middleware - compact serialisation of register entries
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "(C) 2026 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+__revision__ = "$Id$"
+
+import json
+
+
+class RecordFormatError(Exception):
+    '''Stored register entry is not in a recognised format'''
+
+
+def _to_str(value):
+    """Converts the unicode strings returned by the JSON decoder to UTF-8
+    encoded strings as used elsewhere.
+    """
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if isinstance(value, list):
+        return [_to_str(i) for i in value]
+    if isinstance(value, dict):
+        return dict([(_to_str(k), _to_str(v)) for k, v in value.iteritems()])
+    return value
+
+
+class RegisterRecord(object):
+    """
+    Base class for register entries.  An entry is stored as a JSON list
+    containing a format version followed by the values of the attributes named
+    in FIELDS, in order.  Attribute values must be JSON serialisable.
+
+    Derived classes set FIELDS as their __slots__.  Entries pickled by earlier
+    versions, in which the attributes were held in the instance dict, are
+    converted by _set_legacy_state when they are unpickled.
+    """
+    __slots__ = ()
+    VERSION = 1
+    FIELDS = ()
+
+    def __getstate__(self):
+        return [self.VERSION] + [getattr(self, name) for name in self.FIELDS]
+
+    def __setstate__(self, state):
+        if isinstance(state, tuple) and len(state) == 2:
+            # Pickle protocol 2 state for an object with __dict__ and/or
+            # __slots__
+            state = state[0] or state[1]
+
+        if isinstance(state, dict):
+            self._set_legacy_state(state)
+            return
+
+        if not state or state[0] != self.VERSION:
+            raise RecordFormatError('Unrecognised %s record version %r' %
+                                    (self.__class__.__name__,
+                                     state[0] if state else None))
+
+        if len(state) != len(self.FIELDS) + 1:
+            raise RecordFormatError('Expecting %d fields for %s record; got '
+                                    '%d' % (len(self.FIELDS),
+                                            self.__class__.__name__,
+                                            len(state) - 1))
+
+        for name, value in zip(self.FIELDS, state[1:]):
+            setattr(self, name, value)
+
+    def _set_legacy_state(self, state):
+        """Sets attributes from the instance dict of an entry pickled by an
+        earlier version.
+        @type state: dict
+        @param state: unpickled instance dict
+        """
+        raise NotImplementedError()
+
+    def dumps(self):
+        """
+        @rtype: str
+        @return: entry serialised as a record
+        """
+        return json.dumps(self.__getstate__(), separators=(',', ':'))
+
+    @classmethod
+    def loads(cls, data):
+        """
+        @type data: str
+        @param data: entry serialised as a record
+        @rtype: RegisterRecord
+        @return: new instance
+        """
+        try:
+            state = json.loads(data)
+        except ValueError, exc:
+            raise RecordFormatError('Error parsing %s record: %s' %
+                                    (cls.__name__, exc))
+
+        obj = cls.__new__(cls)
+        obj.__setstate__(_to_str(state))
+        return obj
@@ -7,33 +7,387 @@ __license__ = "BSD - see LICENSE file in top-level directory"
 __contact__ = "Philip.Kershaw@stfc.ac.uk"
 __revision__ = "$Id$"
 
-from beaker.cache import CacheManager
-from beaker.util import parse_cache_config_options
+import logging
+import threading
+import time
+
+from ndg.oauth.server.lib.register.record import RecordFormatError
+from ndg.oauth.server.lib.render.factory import importModuleObject
+from ndg.oauth.server.lib.storage.beaker_storage import BeakerStorage
+from ndg.oauth.server.lib.storage.sqlite_storage import SQLiteStorage
+from ndg.oauth.server.lib.storage.storage_interface import StorageInterface
+from ndg.oauth.server.lib.storage.threadpool_storage import ThreadPoolStorage
+from ndg.oauth.server.lib.utils.blocking import is_cooperative
+from ndg.oauth.server.lib.utils.bloom_filter import BloomFilter
+from ndg.oauth.server.lib.utils.lru_cache import LRUCache
+from ndg.oauth.server.lib.utils import metrics
+
+log = logging.getLogger(__name__)
+
+REGISTER_LOOKUPS = metrics.counter(
+        'ndg_oauth_register_lookups_total',
+        'Register lookups by where they were answered: memory_cache, '
+        'filtered (rejected by the negative lookup filter), storage or '
+        'not_found',
+        ('register', 'result'))
+STORAGE_DURATION = metrics.histogram(
+        'ndg_oauth_storage_operation_duration_seconds',
+        'Time taken by register storage reads and writes',
+        ('register', 'operation'))
 
 class RegisterBase(object):
     """
-    Base class for persistent registers. Entries are stored in a Beaker cache.
+    Base class for persistent registers. Entries are held in a storage backend
+    selected by the cache type option: 'sqlite' selects an SQLite database, a
+    module path of the form <module>:<class> selects a custom StorageInterface
+    implementation and any other value is taken to be a Beaker cache type.
+
+    An optional in-memory LRU cache sits in front of the storage so that
+    frequently used entries are served without a file read.  It is configured
+    with the memory_cache_size and memory_cache_expire options: a size of zero
+    disables it.
+
+    Registers which set RECORD_CLASS to a RegisterRecord subclass store their
+    entries as compact records rather than pickled objects.  Entries pickled
+    by earlier versions are still read.
+
+    An optional Bloom filter of the keys in the storage allows lookups of
+    unknown keys, e.g., forged tokens, to fail without a storage read.  It is
+    configured with the negative_lookup_filter_capacity option: a capacity of
+    zero disables it.  The filter is loaded from the storage at startup and
+    updated as entries are added.  Entries added by other processes sharing
+    the storage are picked up by reloading keys from the storage when a key
+    isn't found, at most once every negative_lookup_filter_sync_interval
+    seconds.  Until then, such entries may be reported as not found.  The
+    storage must be able to list its keys - the SQLite storage lists only keys
+    added since the last reload.
+
+    When serving with gevent, storage operations, which may block on file I/O
+    or locks, are made in gevent's thread pool unless the threadpool option
+    is set to False.
     """
+    DEFAULT_MEMORY_CACHE_SIZE = 0
+    DEFAULT_MEMORY_CACHE_EXPIRE = 60
+    DEFAULT_NEGATIVE_LOOKUP_FILTER_CAPACITY = 0
+    DEFAULT_NEGATIVE_LOOKUP_FILTER_ERROR_RATE = BloomFilter.DEFAULT_ERROR_RATE
+    DEFAULT_NEGATIVE_LOOKUP_FILTER_SYNC_INTERVAL = 1.
+    RECORD_CLASS = None
+    STORAGE_TYPES = {
+        'sqlite': SQLiteStorage
+    }
+
     def __init__(self, name, config):
-        cacheMgr = CacheManager(**parse_cache_config_options(config))
-        self.cache = cacheMgr.get_cache(name)
+        self.name = name
+        memory_cache_size = int(config.get('memory_cache_size') or 0)
+        memory_cache_expire = config.get('memory_cache_expire')
+
+        self.storage = self._create_storage(name, config)
+
+        if memory_cache_size > 0:
+            self.memory_cache = LRUCache(memory_cache_size,
+                                         ttl=memory_cache_expire)
+        else:
+            self.memory_cache = None
+
+        self.negative_lookup_filter = None
+        self._filter_capacity = int(
+                    config.get('negative_lookup_filter_capacity') or 0)
+        if self._filter_capacity > 0:
+            self._filter_error_rate = float(
+                    config.get('negative_lookup_filter_error_rate') or
+                    self.DEFAULT_NEGATIVE_LOOKUP_FILTER_ERROR_RATE)
+            self._filter_sync_interval = float(
+                    config.get('negative_lookup_filter_sync_interval') or 0)
+            self._filter_marker = None
+            self._filter_synced = 0.
+            self._filter_lock = threading.RLock()
+            try:
+                self._sync_negative_lookup_filter()
+            except NotImplementedError:
+                log.warning("Storage for %s can't list its keys - negative "
+                            "lookup filter disabled", name)
+                self.negative_lookup_filter = None
+
+    def _sync_negative_lookup_filter(self):
+        """Adds keys added to the storage since the last call to the negative
+        lookup filter.  The filter is rebuilt if the storage lists all of its
+        keys or the filter has reached its capacity.
+        """
+        with self._filter_lock:
+            if (self.negative_lookup_filter is None or
+                self.negative_lookup_filter.is_full):
+                marker = None
+            else:
+                marker = self._filter_marker
+
+            keys, new_marker = self.storage.get_keys_since(marker)
+            if marker is None or new_marker is None:
+                if len(keys) >= self._filter_capacity:
+                    log.warning("%s negative lookup filter capacity %d is "
+                                "less than the number of entries %d - it "
+                                "will be rebuilt frequently", self.name,
+                                self._filter_capacity, len(keys))
+                negative_lookup_filter = BloomFilter(
+                            max(self._filter_capacity, len(keys) * 2),
+                            error_rate=self._filter_error_rate)
+            else:
+                negative_lookup_filter = self.negative_lookup_filter
+
+            for key in keys:
+                negative_lookup_filter.add(key)
+
+            self.negative_lookup_filter = negative_lookup_filter
+            self._filter_marker = new_marker
+            self._filter_synced = time.time()
+
+    def _may_have_key(self, key):
+        """Determines whether a key may be in the storage using the negative
+        lookup filter.
+        @rtype: bool
+        @return: False if the key is definitely not in the storage, otherwise
+        True
+        """
+        if (self.negative_lookup_filter is None or
+            key in self.negative_lookup_filter):
+            return True
+
+        # Check for entries added by other processes.  Don't wait if another
+        # thread is already doing this.
+        if (time.time() - self._filter_synced >= self._filter_sync_interval
+            and self._filter_lock.acquire(False)):
+            try:
+                self._sync_negative_lookup_filter()
+            except Exception, exc:
+                log.error("Error updating %s negative lookup filter: %s",
+                          self.name, exc)
+            finally:
+                self._filter_lock.release()
+            return key in self.negative_lookup_filter
+
+        return False
+
+    @classmethod
+    def _create_storage(cls, name, config):
+        """Creates the storage backend for the configured cache type.
+        """
+        storage_type = config.get('cache.type')
+        storage_class = cls.STORAGE_TYPES.get(storage_type)
+        if storage_class is None:
+            if (storage_type and ':' in storage_type and
+                not storage_type.startswith('ext:')):
+                storage_class = importModuleObject(
+                                            storage_type,
+                                            objectType=StorageInterface)
+            else:
+                storage_class = BeakerStorage
+
+        storage = storage_class(name, config)
+        threadpool = config.get('threadpool')
+        if threadpool in (None, ''):
+            use_threadpool = is_cooperative()
+        else:
+            use_threadpool = str(threadpool).lower() == 'true'
+        if use_threadpool:
+            storage = ThreadPoolStorage(storage)
+        return storage
+
+    def encode(self, value):
+        """Converts a value to the form held in the storage.
+        """
+        if self.RECORD_CLASS is None:
+            return value
+        return value.dumps()
+
+    def decode(self, data):
+        """Converts a value read from the storage.  Values which are not
+        strings were pickled by an earlier version and have already been
+        converted on unpickling.
+        """
+        if self.RECORD_CLASS is None or not isinstance(data, basestring):
+            return data
+        return self.RECORD_CLASS.loads(data)
 
     def set_value(self, key, value):
-        self.cache.put(key, value)
+        if self.negative_lookup_filter is not None:
+            # Hold the lock so that the key isn't lost if the filter is being
+            # rebuilt.
+            with self._filter_lock:
+                self._put(key, value)
+                self.negative_lookup_filter.add(key)
+        else:
+            self._put(key, value)
+
+    def _put(self, key, value):
+        expires = self.get_expiry(value)
+        indexes = self.storage.SUPPORTS_INDEXES and self.get_indexes(value)
+        if indexes:
+            with STORAGE_DURATION.time(self.name, 'put'):
+                self.storage.put(key, self.encode(value), expires=expires,
+                                 indexes=indexes)
+        else:
+            with STORAGE_DURATION.time(self.name, 'put'):
+                self.storage.put(key, self.encode(value), expires=expires)
+        if self.memory_cache is not None:
+            self.memory_cache.set(key, value, expires=expires)
+
+    def get_keys_by_index(self, name, value):
+        """Lists the keys of entries with a given index value.
+        @type name: basestring
+        @param name: index name as returned by get_indexes
+        @type value: basestring
+        @param value: index value
+        @rtype: list
+        @return: keys.  These may include keys of entries which have since
+        been removed.
+
+        Raises NotImplementedError if the storage doesn't support indexes.
+        """
+        return self.storage.get_keys_by_index(name, value)
 
     def get_value(self, key):
-        return self.cache.get(key)
+        if self.memory_cache is not None:
+            value = self.memory_cache.get(key)
+            if value is not None:
+                REGISTER_LOOKUPS.inc(self.name, 'memory_cache')
+                return value
+
+        if not self._may_have_key(key):
+            REGISTER_LOOKUPS.inc(self.name, 'filtered')
+            raise KeyError(key)
+
+        try:
+            with STORAGE_DURATION.time(self.name, 'get'):
+                data = self.storage.get(key)
+        except KeyError:
+            REGISTER_LOOKUPS.inc(self.name, 'not_found')
+            raise
+
+        REGISTER_LOOKUPS.inc(self.name, 'storage')
+        value = self.decode(data)
+        if self.memory_cache is not None:
+            self.memory_cache.set(key, value, expires=self.get_expiry(value))
+        return value
+
+    def get_values(self, keys):
+        """Gets several entries, reading those not in the in-memory cache from
+        the storage in one operation.
+        @type keys: iterable of basestring
+        @param keys: keys
+        @rtype: dict
+        @return: values keyed by key.  Keys which are not registered are
+        omitted.
+        """
+        values = {}
+        missing = []
+        for key in keys:
+            value = None
+            if self.memory_cache is not None:
+                value = self.memory_cache.get(key)
+            if value is not None:
+                values[key] = value
+            else:
+                missing.append(key)
+
+        if values:
+            REGISTER_LOOKUPS.add(len(values), self.name, 'memory_cache')
+
+        n_missing = len(missing)
+        missing = [key for key in missing if self._may_have_key(key)]
+        if n_missing > len(missing):
+            REGISTER_LOOKUPS.add(n_missing - len(missing), self.name,
+                                 'filtered')
+        if missing:
+            with STORAGE_DURATION.time(self.name, 'get_many'):
+                stored = self.storage.get_many(missing)
+            if stored:
+                REGISTER_LOOKUPS.add(len(stored), self.name, 'storage')
+            if len(missing) > len(stored):
+                REGISTER_LOOKUPS.add(len(missing) - len(stored), self.name,
+                                     'not_found')
+            for key, data in stored.iteritems():
+                value = self.decode(data)
+                values[key] = value
+                if self.memory_cache is not None:
+                    self.memory_cache.set(key, value,
+                                          expires=self.get_expiry(value))
+        return values
 
     def has_key(self, key):
-        return self.cache.has_key(key)
+        if self.memory_cache is not None and key in self.memory_cache:
+            return True
+        if not self._may_have_key(key):
+            return False
+        return self.storage.has_key(key)
+
+    def remove_value(self, key):
+        """Removes an entry from the register and from the in-memory cache.
+        """
+        self.invalidate(key)
+        self.storage.remove(key)
+
+    def invalidate(self, key):
+        """Drops an entry from the in-memory cache only so that the next
+        lookup is made against the storage.
+        """
+        if self.memory_cache is not None:
+            self.memory_cache.remove(key)
+
+    def remove_expired(self, limit):
+        """Removes up to a given number of expired entries from the storage.
+        @type limit: int
+        @param limit: maximum number of entries to remove
+        @rtype: int
+        @return: number of entries removed
+        """
+        return self.storage.remove_expired(time.time(), limit,
+                                           get_expiry=self._get_stored_expiry)
+
+    def _get_stored_expiry(self, data):
+        try:
+            return self.get_expiry(self.decode(data))
+        except RecordFormatError, exc:
+            log.warning("Error reading %s entry: %s", self.name, exc)
+            return None
+
+    def get_indexes(self, value):
+        """Returns the index names and values under which an entry is listed
+        so that entries can be found by attributes other than their key.
+        Override in derived classes which use indexes.
+        @rtype: dict
+        @return: index values keyed by index name or None
+        """
+        return None
+
+    def get_expiry(self, value):
+        """Returns the time at which a value expires as seconds since the
+        epoch.  This caps the time for which it is held in memory and allows
+        storage backends to discard it.  Override in derived classes for
+        values which carry an expiry time.
+        """
+        return None
 
     def parse_config(self, prefix, name, config):
         base = ("%s.%s." % (prefix, name))
         cache_opts = {
             'cache.expire': config.get(base + 'expire', None),
             'cache.type': config.get(base + 'type', 'file'),
-            'cache.data_dir': config.get(base + 'data_dir', 
+            'cache.data_dir': config.get(base + 'data_dir',
                                          '/tmp/ndgoauth/cache/' + name),
-            'cache.lock_dir': config.get(base + 'lock_dir', None)
+            'cache.lock_dir': config.get(base + 'lock_dir', None),
+            'file': config.get(base + 'file', None),
+            'threadpool': config.get(base + 'threadpool', None),
+            'memory_cache_size': config.get(base + 'memory_cache_size',
+                                            self.DEFAULT_MEMORY_CACHE_SIZE),
+            'memory_cache_expire': config.get(base + 'memory_cache_expire',
+                                              self.DEFAULT_MEMORY_CACHE_EXPIRE),
+            'negative_lookup_filter_capacity': config.get(
+                        base + 'negative_lookup_filter_capacity',
+                        self.DEFAULT_NEGATIVE_LOOKUP_FILTER_CAPACITY),
+            'negative_lookup_filter_error_rate': config.get(
+                        base + 'negative_lookup_filter_error_rate',
+                        self.DEFAULT_NEGATIVE_LOOKUP_FILTER_ERROR_RATE),
+            'negative_lookup_filter_sync_interval': config.get(
+                        base + 'negative_lookup_filter_sync_interval',
+                        self.DEFAULT_NEGATIVE_LOOKUP_FILTER_SYNC_INTERVAL)
             }
         return cache_opts
@@ -0,0 +1,186 @@
+"""OAuth 2.0 WSGI server middleware - removal of expired entries from the
+access token and authorization grant registers
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "(C) 2026 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+__revision__ = "$Id$"
+
+from ConfigParser import SafeConfigParser
+import logging
+import optparse
+import os
+import threading
+import time
+
+from ndg.oauth.server.lib.register.access_token import AccessTokenRegister
+from ndg.oauth.server.lib.register.authorization_grant import \
+                                                    AuthorizationGrantRegister
+
+log = logging.getLogger(__name__)
+
+
+class RegisterSweeper(threading.Thread):
+    """
+    Background thread which periodically removes expired entries from
+    registers.  Redeemed authorization grants are kept until they expire so
+    that reuse of the authorization code can still be detected.
+
+    Each sweep removes entries in batches and stops once the maximum number of
+    entries per sweep has been removed so that a large backlog is cleared over
+    several intervals rather than in one long pass.
+    """
+    DEFAULT_INTERVAL = 300
+    DEFAULT_BATCH_SIZE = 500
+    DEFAULT_MAX_PER_SWEEP = 5000
+
+    def __init__(self, registers, interval=DEFAULT_INTERVAL,
+                 batch_size=DEFAULT_BATCH_SIZE,
+                 max_per_sweep=DEFAULT_MAX_PER_SWEEP):
+        """
+        @type registers: iterable of
+        ndg.oauth.server.lib.register.register_base.RegisterBase
+        @param registers: registers to sweep
+
+        @type interval: int or float
+        @param interval: time in seconds between sweeps
+
+        @type batch_size: int
+        @param batch_size: maximum number of entries removed from a register in
+        one storage operation
+
+        @type max_per_sweep: int
+        @param max_per_sweep: maximum number of entries removed from each
+        register in one sweep
+        """
+        super(RegisterSweeper, self).__init__(name='RegisterSweeper')
+        self.daemon = True
+        self.registers = list(registers)
+        self.interval = float(interval)
+        self.batch_size = int(batch_size)
+        self.max_per_sweep = int(max_per_sweep)
+
+        self.sweeps = 0
+        self.reclaimed = dict([(register.name, 0)
+                               for register in self.registers])
+        self._unsupported = set()
+        self._stop_event = threading.Event()
+
+    @property
+    def total_reclaimed(self):
+        return sum(self.reclaimed.itervalues())
+
+    def sweep(self):
+        """Makes a single pass over the registers.
+        @rtype: int
+        @return: number of entries removed
+        """
+        start_time = time.time()
+        n_removed = 0
+        for register in self.registers:
+            if register.name in self._unsupported:
+                continue
+            try:
+                n_removed += self._sweep_register(register)
+            except NotImplementedError:
+                log.warning("Storage for %s does not support removal of "
+                            "expired entries - it will not be swept",
+                            register.name)
+                self._unsupported.add(register.name)
+            except Exception, exc:
+                log.error("Error removing expired entries from %s: %s",
+                          register.name, exc)
+
+        self.sweeps += 1
+        log.debug("Register sweep removed %d entries in %.3fs", n_removed,
+                  time.time() - start_time)
+        return n_removed
+
+    def _sweep_register(self, register):
+        n_removed = 0
+        while n_removed < self.max_per_sweep:
+            limit = min(self.batch_size, self.max_per_sweep - n_removed)
+            n_batch = register.remove_expired(limit)
+            n_removed += n_batch
+            self.reclaimed[register.name] += n_batch
+            if n_batch < limit:
+                break
+
+        return n_removed
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self._stop_event.wait(self.interval)
+            if not self._stop_event.is_set():
+                self.sweep()
+
+    def stop(self, timeout=None):
+        """Stops the thread after any sweep in progress has completed.
+        @type timeout: float
+        @param timeout: if set, wait up to this time in seconds for the thread
+        to finish
+        """
+        self._stop_event.set()
+        if timeout is not None and self.is_alive():
+            self.join(timeout)
+
+
+def main():
+    """Sweeps the registers configured in a Paste ini file section.  This can
+    be run from cron as an alternative to the background thread started by
+    the server middleware.
+    """
+    parser = optparse.OptionParser(
+                            usage='%prog [options] <Paste ini file>')
+    parser.add_option("-s",
+                      "--section",
+                      dest="section",
+                      default='filter:OAuth2ServerFilter',
+                      help="Section of the ini file containing the register "
+                           "configuration")
+    parser.add_option("-p",
+                      "--prefix",
+                      dest="prefix",
+                      default='oauth2server.',
+                      help="Prefix of the register configuration options")
+    parser.add_option("-b",
+                      "--batch-size",
+                      dest="batch_size",
+                      default=RegisterSweeper.DEFAULT_BATCH_SIZE,
+                      type='int',
+                      help="Number of entries removed per storage operation")
+    parser.add_option("-m",
+                      "--max",
+                      dest="max_per_sweep",
+                      default=RegisterSweeper.DEFAULT_MAX_PER_SWEEP,
+                      type='int',
+                      help="Maximum number of entries removed per register")
+
+    opt, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error('A Paste ini file must be specified')
+
+    config_filepath = os.path.abspath(args[0])
+    config_parser = SafeConfigParser(
+                        defaults={'here': os.path.dirname(config_filepath)})
+    config_parser.read(config_filepath)
+
+    prefix_len = len(opt.prefix)
+    config = dict([(k[prefix_len:], v)
+                   for k, v in config_parser.items(opt.section)
+                   if k.startswith(opt.prefix)])
+
+    logging.basicConfig(level=logging.INFO)
+    sweeper = RegisterSweeper([AccessTokenRegister(config),
+                               AuthorizationGrantRegister(config)],
+                              batch_size=opt.batch_size,
+                              max_per_sweep=opt.max_per_sweep)
+    sweeper.sweep()
+    for name, n_reclaimed in sorted(sweeper.reclaimed.items()):
+        log.info("%s: removed %d expired entries", name, n_reclaimed)
+
+
+if __name__ == '__main__':
+    main()
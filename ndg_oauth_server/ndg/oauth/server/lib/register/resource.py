@@ -7,7 +7,10 @@ __license__ = "BSD - see LICENSE file in top-level directory"
 __contact__ = "wvengen@nikhef.nl"
 __revision__ = "$Id$"
 import logging
-from ConfigParser import SafeConfigParser
+
+from ndg.oauth.server.lib.register.file_register import (FileRegister,
+                                                         read_rate_limit)
+
 log = logging.getLogger(__name__)
 
 
@@ -16,27 +19,35 @@ class ResourceRegistration(object):
     An entry in the resource register.
     """
     def __init__(self, name, resource_id,
-                 resource_secret, authentication_data):
+                 resource_secret, authentication_data, rate_limit=None,
+                 rate_limit_burst=None):
         self.name = name
         self.id = resource_id
         self.secret = resource_secret
         self.authentication_data = authentication_data
 
+        # Requests per second and burst size overriding the server's rate
+        # limit for this resource
+        self.rate_limit = rate_limit
+        self.rate_limit_burst = rate_limit_burst
+
 
-class ResourceRegister(object):
+class ResourceRegister(FileRegister):
     """
-    Resource reqister read from a configuration file
+    Resource reqister read from a configuration file.  Resources are indexed
+    by the normalised form of their certificate DN for certificate
+    authentication.
     """
-    register = {}
-    def __init__(self, config_file=None):
-        if config_file:
-            config = SafeConfigParser()
-            config.read(config_file)
-            resource_keys = config.get('resource_register', 'resources').strip()
+    SQLITE_REGISTER_CLASS = \
+        'ndg.oauth.server.lib.register.sqlite_register.SQLiteResourceRegister'
 
-            if resource_keys:
-                for resource_key in [k.strip() for k in resource_keys.split(',')]:
-                    self._create_resource(config, resource_key, 'resource')
+    def _read_registrations(self, config):
+        resource_keys = config.get('resource_register', 'resources').strip()
+        if not resource_keys:
+            return []
+
+        return [self._create_resource(config, k.strip(), 'resource')
+                for k in resource_keys.split(',')]
 
     def _create_resource(self, config, resource_key, prefix):
         resource_section_name = prefix + ':' + resource_key
@@ -50,12 +61,12 @@ class ResourceRegister(object):
         if config.has_option(resource_section_name, 'authentication_data'):
             resource_authentication_data = config.get(resource_section_name, 'authentication_data')
 
-        resource_registration = ResourceRegistration(
+        return ResourceRegistration(
             config.get(resource_section_name, 'name'),
             resource_id,
             resource_secret,
-            resource_authentication_data)
-        self.register[resource_id] = resource_registration
+            resource_authentication_data,
+            **read_rate_limit(config, resource_section_name))
 
     def is_registered_resource(self, resource_id):
         """Determines if a resource ID is in the resource register.
@@ -64,4 +75,3 @@ class ResourceRegister(object):
             return ('Resource of id "%s" is not registered.' % resource_id)
 
         return None
-
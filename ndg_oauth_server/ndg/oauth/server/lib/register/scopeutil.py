@@ -9,27 +9,243 @@ __contact__ = "Philip.Kershaw@stfc.ac.uk"
 __revision__ = "$Id$"
 
 import logging
+import threading
 import urllib
 
+from ndg.oauth.server.lib.utils.lru_cache import LRUCache
+
 log = logging.getLogger(__name__)
 
-def scopeStringToList(scope_str):
+# Each distinct scope is interned as a bit position so that sets of scopes
+# can be held as integer masks and compared with a single bitwise operation.
+# Only scopes which are granted, i.e., those of issued tokens, grants and
+# configured required scopes, are assigned bits.  Scopes from requests are
+# looked up without assigning bits so that requests can't fill the table - a
+# requested scope which isn't interned can't be in a granted mask.  The table
+# is bounded and scopes not interned once it is full are compared as sets.
+MAX_INTERNED_SCOPES = 65536
+PARSE_CACHE_SIZE = 1024
+
+# Structured scopes are made up of segments, e.g., dataset:cmip5:read.  When
+# wildcard matching is enabled, a granted scope with a wildcard segment
+# matches any segment in that position, or if it is the last segment, one or
+# more segments, so dataset:* grants dataset:cmip5:read.
+SCOPE_SEPARATOR = ':'
+SCOPE_WILDCARD = '*'
+TRIE_CACHE_SIZE = 1024
+
+_interned_scopes = {}
+_intern_lock = threading.Lock()
+_parse_cache = LRUCache(PARSE_CACHE_SIZE)
+_trie_cache = LRUCache(TRIE_CACHE_SIZE)
+_wildcard_scopes = False
+_NO_WILDCARDS = {}
+
+
+class ScopeList(list):
+    """List of scopes which also holds the mask of its interned scopes, or
+    None if any of the scopes could not be interned.  It is pickled as a plain
+    list as the bit positions only apply to the current process.
+    """
+    __slots__ = ('mask', 'trie')
+
+    def __init__(self, scopes=(), mask=None):
+        super(ScopeList, self).__init__(scopes)
+        self.mask = mask
+        self.trie = None
+
+    def __reduce__(self):
+        return (list, (list(self),))
+
+
+def internScope(scope, assign=True):
+    """Gets the bit position for a scope, assigning one if necessary.
+    @type scope: basestring
+    @param scope: scope
+    @type assign: bool
+    @param assign: assign a bit position if the scope doesn't have one.  Set
+    to False for scopes from requests.
+    @rtype: int
+    @return: bit position or None if the scope isn't interned and either
+    assign is False or the table of scopes is full
+    """
+    bit = _interned_scopes.get(scope)
+    if bit is None and assign:
+        with _intern_lock:
+            bit = _interned_scopes.get(scope)
+            if bit is None and len(_interned_scopes) < MAX_INTERNED_SCOPES:
+                bit = len(_interned_scopes)
+                _interned_scopes[scope] = bit
+    return bit
+
+def scopeListToMask(scopes, assign=True):
+    """Converts a list of scopes to a mask of their bit positions.
+    @type scopes: list of basestring
+    @param scopes: scopes
+    @type assign: bool
+    @param assign: assign bit positions to scopes which don't have them
+    @rtype: int
+    @return: mask or None if any of the scopes is not interned
+    """
+    mask = 0
+    for scope in scopes:
+        bit = internScope(scope, assign=assign)
+        if bit is None:
+            return None
+        mask |= 1 << bit
+    return mask
+
+def makeScopeList(scopes):
+    """Converts a list of scopes to a ScopeList with the mask set.
+    @type scopes: list of basestring
+    @param scopes: scopes
+    @rtype: ScopeList
+    @return: scopes and mask
+    """
+    if isinstance(scopes, ScopeList):
+        return scopes
+    scopes = scopes or []
+    return ScopeList(scopes, scopeListToMask(scopes))
+
+def _parseScopeString(scope_str, assign=True):
+    parsed = _parse_cache.get(scope_str)
+    if parsed is None:
+        scopes = tuple([urllib.unquote_plus(s) for s in scope_str.split()])
+        parsed = (scopes, scopeListToMask(scopes, assign=assign))
+        _parse_cache.set(scope_str, parsed)
+    elif parsed[1] is None:
+        # Parsed before all of its scopes were interned
+        mask = scopeListToMask(parsed[0], assign=assign)
+        if mask is not None:
+            parsed = (parsed[0], mask)
+            _parse_cache.set(scope_str, parsed)
+    return parsed
+
+def scopeStringToList(scope_str, assign=True):
     """Converts a scope string to a list. The strings are space separated and
-    must not contain '"' or '\' so allow them to be URL encoded.
+    must not contain '"' or '\' so allow them to be URL encoded.  Parsed
+    strings are cached.
     @type scope_str: basestring
     @param scope_str: space separated list of scopes
-    @rtype: list of basestring
+    @type assign: bool
+    @param assign: assign bit positions to scopes which don't have them.  Set
+    to False for scopes from requests.
+    @rtype: ScopeList
     @return: list of scopes
     """
-    result = []
-    if scope_str:
-        for s in scope_str.split():
-            result.append(urllib.unquote_plus(s))
-    log.debug("Converted scope string %s to %r", scope_str, result)
-    return result
+    if not scope_str:
+        return ScopeList(mask=0)
+    scopes, mask = _parseScopeString(scope_str, assign=assign)
+    log.debug("Converted scope string %s to %r", scope_str, scopes)
+    return ScopeList(scopes, mask)
+
+def scopeStringToMask(scope_str, assign=True):
+    """Converts a scope string to a mask of its interned scopes.
+    @type scope_str: basestring
+    @param scope_str: space separated list of scopes
+    @type assign: bool
+    @param assign: assign bit positions to scopes which don't have them
+    @rtype: int
+    @return: mask or None if any of the scopes is not interned
+    """
+    if not scope_str:
+        return 0
+    return _parseScopeString(scope_str, assign=assign)[1]
+
+def setWildcardScopes(enabled):
+    """Enables or disables wildcard matching of granted scopes.  This applies
+    to the whole process.
+    @type enabled: bool
+    @param enabled: True to enable matching
+    """
+    global _wildcard_scopes
+    _wildcard_scopes = bool(enabled)
+
+def compileScopeTrie(scopes):
+    """Compiles granted scopes into a trie of their segments.  Each node is a
+    dict keyed by segment, with the key None marking the end of a scope.
+    @type scopes: list of basestring
+    @param scopes: granted scopes
+    @rtype: dict
+    @return: root node
+    """
+    root = {}
+    for scope in scopes:
+        node = root
+        for segment in scope.split(SCOPE_SEPARATOR):
+            node = node.setdefault(segment, {})
+        node[None] = True
+    return root
+
+def _getScopeTrie(granted_scope):
+    """Gets the compiled trie for granted scopes, or _NO_WILDCARDS if none of
+    them has a wildcard segment.  The trie is cached with a ScopeList or in
+    the trie cache for other lists.
+    """
+    trie = getattr(granted_scope, 'trie', None)
+    if trie is not None:
+        return trie
+
+    cache_key = None
+    if not isinstance(granted_scope, ScopeList):
+        cache_key = tuple(granted_scope)
+        trie = _trie_cache.get(cache_key)
+        if trie is not None:
+            return trie
+
+    if [s for s in granted_scope
+        if SCOPE_WILDCARD in s.split(SCOPE_SEPARATOR)]:
+        trie = compileScopeTrie(granted_scope)
+    else:
+        trie = _NO_WILDCARDS
+
+    if cache_key is None:
+        granted_scope.trie = trie
+    else:
+        _trie_cache.set(cache_key, trie)
+    return trie
+
+def _matchScopeTrie(node, segments, i):
+    if i == len(segments):
+        return None in node
+
+    child = node.get(segments[i])
+    if child is not None and _matchScopeTrie(child, segments, i + 1):
+        return True
+
+    child = node.get(SCOPE_WILDCARD)
+    if child is not None:
+        # A final wildcard matches all the remaining segments.
+        if None in child or _matchScopeTrie(child, segments, i + 1):
+            return True
+
+    return False
+
+def isScopeMatched(granted_scope, scope):
+    """Determines whether a scope is granted by a granted scope list,
+    including by any wildcard scopes it contains.  The check is proportional
+    to the number of segments in the scope.
+    @type granted_scope: list of basestring
+    @param granted_scope: list of granted scopes
+    @type scope: basestring
+    @param scope: scope
+    @rtype: bool
+    @return: True if the scope is granted
+    """
+    trie = _getScopeTrie(granted_scope)
+    if trie is _NO_WILDCARDS:
+        return scope in granted_scope
+    return _matchScopeTrie(trie, scope.split(SCOPE_SEPARATOR), 0)
+
+def _getMask(scopes):
+    mask = getattr(scopes, 'mask', None)
+    if mask is None and not isinstance(scopes, ScopeList):
+        mask = scopeListToMask(scopes, assign=False)
+    return mask
 
 def isScopeGranted(granted_scope, requested_scope):
-    """Determines whether all scopes requested have been granted.
+    """Determines whether all scopes requested have been granted.  Scopes are
+    compared as masks of their interned bit positions where possible.
     @type granted_scope: list of basestring
     @param granted_scope: list of granted scopes
     @type requested_scope: list of basestring
@@ -38,10 +254,21 @@ def isScopeGranted(granted_scope, requested_scope):
     @return: True if all requested scopes are in the list of granted scopes,
     or if no scopes are requested, otherwise False
     """
-    result = True
-    for s in requested_scope:
-        if s not in granted_scope:
-            result = False
+    # Tokens issued by the implicit grant flow by earlier versions hold the
+    # scope string
+    if isinstance(granted_scope, basestring):
+        granted_scope = scopeStringToList(granted_scope)
+    requested_mask = _getMask(requested_scope)
+    granted_mask = _getMask(granted_scope) if requested_mask else 0
+    if requested_mask is not None and granted_mask is not None:
+        result = not (requested_mask & ~granted_mask)
+    else:
+        result = set(requested_scope).issubset(granted_scope)
+
+    if (not result and _wildcard_scopes and
+        _getScopeTrie(granted_scope) is not _NO_WILDCARDS):
+        result = all([isScopeMatched(granted_scope, s)
+                      for s in requested_scope])
     log.debug(
         "Checking for requested scopes %r in granted scopes %r - result: %r",
         requested_scope, granted_scope, result)
@@ -0,0 +1,465 @@
+"""OAuth 2.0 WSGI server middleware - client and resource registers held in an
+SQLite database
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "(C) 2026 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+__revision__ = "$Id$"
+
+import logging
+import optparse
+import os
+import sqlite3
+import threading
+
+from ndg.oauth.server.lib.register.client import (ClientRegister,
+                                                  ClientRegistration)
+from ndg.oauth.server.lib.register.resource import (ResourceRegister,
+                                                    ResourceRegistration)
+from ndg.oauth.server.lib.utils.blocking import (get_thread_local_class,
+                                                 run_blocking)
+from ndg.oauth.server.lib.utils.dn import normalise_dn
+from ndg.oauth.server.lib.utils.lru_cache import LRUCache
+
+log = logging.getLogger(__name__)
+
+
+class SQLiteRegistrations(object):
+    """Read-only dict-like view of the registrations in an SQLite register
+    keyed on one column.  Registrations are read from the database when they
+    are first looked up and then held in the register's cache.
+    """
+    def __init__(self, register, column):
+        """
+        @type register: SQLiteRegisterBase
+        @param register: register
+        @type column: str
+        @param column: column on which registrations are looked up
+        """
+        self._register = register
+        self._column = column
+
+    def get(self, key, default=None):
+        registration = self._register.get_registration(self._column, key)
+        if registration is None:
+            return default
+        return registration
+
+    def __getitem__(self, key):
+        registration = self._register.get_registration(self._column, key)
+        if registration is None:
+            raise KeyError(key)
+        return registration
+
+    def __contains__(self, key):
+        return self._register.get_registration(self._column, key) is not None
+
+    def has_key(self, key):
+        return key in self
+
+    def __len__(self):
+        return self._register.count()
+
+    def __iter__(self):
+        return self._register.iter_ids()
+
+    def iterkeys(self):
+        return self._register.iter_ids()
+
+    def itervalues(self):
+        return self._register.iter_registrations()
+
+
+class SQLiteRegisterBase(object):
+    """
+    Register held in a table of an SQLite database rather than read from a
+    configuration file, for large numbers of registrations.  Registrations
+    are read on demand by ID or certificate DN, both of which are indexed, and
+    the most recently used are held in an LRU cache.  The cache is cleared
+    when the register is reloaded after the database has changed.
+
+    When serving with gevent, registrations not in the cache are read in
+    gevent's thread pool so that waits for the database lock don't hold up
+    other requests, and connections are held per OS thread.
+
+    This is combined with ClientRegister or ResourceRegister which provide
+    the lookup methods.  The register and dn_index attributes of those
+    classes are replaced by SQLiteRegistrations views.
+    """
+    TABLE = None
+    COLUMNS = ()
+
+    # SQLite types of the columns in COLUMNS which aren't TEXT
+    COLUMN_TYPES = {}
+    DEFAULT_CACHE_SIZE = 10000
+    DEFAULT_CACHE_EXPIRE = 300
+    DEFAULT_TIMEOUT = 30.
+
+    # Version of the normalised DN form held in the dn column.  Rows written
+    # with an earlier form are converted when the register is opened.
+    DN_FORM_VERSION = 2
+    META_TABLE = 'register_meta'
+
+    def __init__(self, config_file=None, cache_size=DEFAULT_CACHE_SIZE,
+                 cache_expire=DEFAULT_CACHE_EXPIRE, timeout=DEFAULT_TIMEOUT):
+        """
+        @type config_file: basestring
+        @param config_file: SQLite database file.  The register table is
+        created if it doesn't exist.
+
+        @type cache_size: int
+        @param cache_size: maximum number of registrations cached
+
+        @type cache_expire: int or float
+        @param cache_expire: maximum time in seconds for which a registration
+        is cached
+
+        @type timeout: float
+        @param timeout: time in seconds to wait for a database lock
+        """
+        self.config_file = config_file
+        self.timeout = float(timeout)
+        self._local = get_thread_local_class()()
+        self._cache = LRUCache(cache_size, ttl=cache_expire)
+        self._reload_lock = threading.Lock()
+        self._mtime = None
+
+        self._registrations = SQLiteRegistrations(self, 'id')
+        self._dn_registrations = SQLiteRegistrations(self, 'dn')
+
+        self._create_schema()
+        self._mtime = self._get_mtime()
+
+    @property
+    def register(self):
+        """Registrations keyed by ID"""
+        return self._registrations
+
+    @property
+    def dn_index(self):
+        """Registrations keyed by certificate DN"""
+        return self._dn_registrations
+
+    def _get_connection(self):
+        """Gets the connection for the current thread, opening it if
+        necessary.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.config_file, timeout=self.timeout,
+                                   isolation_level=None)
+            conn.text_factory = str
+            self._local.conn = conn
+        return conn
+
+    def _get_column_definition(self, column):
+        return '%s %s' % (column, self.COLUMN_TYPES.get(column, 'TEXT'))
+
+    def _create_schema(self):
+        conn = self._get_connection()
+        conn.execute('CREATE TABLE IF NOT EXISTS %s (id TEXT PRIMARY KEY, %s, '
+                     'dn TEXT)' % (self.TABLE,
+                                   ', '.join([self._get_column_definition(c)
+                                              for c in self.COLUMNS])))
+        self._add_missing_columns(conn)
+        conn.execute('CREATE INDEX IF NOT EXISTS %s_dn ON %s (dn)' %
+                     (self.TABLE, self.TABLE))
+        conn.execute('CREATE TABLE IF NOT EXISTS %s (name TEXT PRIMARY KEY, '
+                     'value TEXT)' % self.META_TABLE)
+        self._update_dn_form(conn)
+
+    def _add_missing_columns(self, conn):
+        """Adds columns to a table created by an earlier version which
+        didn't have them.  The values of existing rows are NULL.
+        """
+        existing_columns = set([row[1] for row in conn.execute(
+                                    'PRAGMA table_info(%s)' % self.TABLE)])
+        for column in self.COLUMNS:
+            if column not in existing_columns:
+                conn.execute('ALTER TABLE %s ADD COLUMN %s' %
+                             (self.TABLE, self._get_column_definition(column)))
+                log.info("Added column %r to table %r in %s", column,
+                         self.TABLE, self.config_file)
+
+    def _update_dn_form(self, conn):
+        """Normalises the DNs of rows written with an earlier form of
+        normalised DN.
+        """
+        name = '%s.dn_form' % self.TABLE
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT value FROM %s WHERE name = ?' %
+                               self.META_TABLE, (name,)).fetchone()
+            if row is None or int(row[0]) < self.DN_FORM_VERSION:
+                if 'authentication_data' in self.COLUMNS:
+                    rows = conn.execute('SELECT id, authentication_data '
+                                        'FROM %s' % self.TABLE).fetchall()
+                    conn.executemany('UPDATE %s SET dn = ? WHERE id = ?' %
+                                     self.TABLE,
+                                     [(normalise_dn(authentication_data), id_)
+                                      for id_, authentication_data in rows])
+                    if rows:
+                        log.info("Normalised the DNs of %d registrations in "
+                                 "%s", len(rows), self.config_file)
+                conn.execute('INSERT OR REPLACE INTO %s (name, value) '
+                             'VALUES (?, ?)' % self.META_TABLE,
+                             (name, str(self.DN_FORM_VERSION)))
+        except:
+            conn.execute('ROLLBACK')
+            raise
+
+        conn.execute('COMMIT')
+
+    def _get_mtime(self):
+        """Modification time of the database, including the write-ahead log
+        if there is one.
+        """
+        mtimes = []
+        for filename in (self.config_file, self.config_file + '-wal'):
+            try:
+                mtimes.append(os.path.getmtime(filename))
+            except OSError:
+                pass
+        return max(mtimes) if mtimes else None
+
+    def _make_registration(self, registration_id, values):
+        """Makes a registration from its column values.
+        @type registration_id: str
+        @param registration_id: ID
+        @type values: dict
+        @param values: values of the columns in COLUMNS
+        """
+        raise NotImplementedError()
+
+    def _get_values(self, registration):
+        """Gets the column values for a registration.
+        @rtype: dict
+        @return: values of the columns in COLUMNS
+        """
+        raise NotImplementedError()
+
+    def _select(self, where='', args=()):
+        columns = ('id',) + self.COLUMNS
+        cursor = self._get_connection().execute(
+            'SELECT %s FROM %s%s' % (', '.join(columns), self.TABLE, where),
+            args)
+        for row in cursor:
+            yield self._make_registration(row[0],
+                                          dict(zip(self.COLUMNS, row[1:])))
+
+    def get_registration(self, column, value):
+        """Looks up a registration, using the cache if possible.
+        @type column: str
+        @param column: id or dn
+        @type value: basestring
+        @param value: ID or certificate DN
+        @return: registration or None if there is none with the value
+        """
+        if column == 'dn':
+            value = normalise_dn(value)
+        if not value:
+            return None
+
+        cache_key = (column, value)
+        registration = self._cache.get(cache_key)
+        if registration is not None:
+            return registration
+
+        registration = run_blocking(self._select_one, column, value)
+        if registration is not None:
+            self._cache.set(cache_key, registration)
+        return registration
+
+    def _select_one(self, column, value):
+        # Order by ID so that the choice between registrations with the same
+        # DN is consistent.
+        for registration in self._select(
+                ' WHERE %s = ? ORDER BY id LIMIT 1' % column, (value,)):
+            return registration
+
+        return None
+
+    def get_registration_by_dn(self, dn):
+        """Gets the registration with a certificate DN.
+        @type dn: basestring
+        @param dn: certificate DN in any of the formats handled by
+        ndg.oauth.server.lib.utils.dn.normalise_dn
+        @return: registration or None if there is none with the DN
+        """
+        return self.get_registration('dn', dn)
+
+    def count(self):
+        return self._get_connection().execute(
+            'SELECT COUNT(*) FROM %s' % self.TABLE).fetchone()[0]
+
+    def iter_ids(self):
+        for row in self._get_connection().execute(
+                'SELECT id FROM %s ORDER BY id' % self.TABLE):
+            yield row[0]
+
+    def iter_registrations(self):
+        return self._select(' ORDER BY id')
+
+    def put_registrations(self, registrations, replace=False):
+        """Adds or updates registrations in a single transaction.
+        @type registrations: iterable
+        @param registrations: registrations
+        @type replace: bool
+        @param replace: remove all existing registrations first
+        @rtype: int
+        @return: number of registrations written
+        """
+        columns = ('id',) + self.COLUMNS + ('dn',)
+        sql = 'INSERT OR REPLACE INTO %s (%s) VALUES (%s)' % (
+                    self.TABLE, ', '.join(columns),
+                    ', '.join(['?'] * len(columns)))
+
+        conn = self._get_connection()
+        n_written = 0
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if replace:
+                conn.execute('DELETE FROM %s' % self.TABLE)
+
+            for registration in registrations:
+                values = self._get_values(registration)
+                conn.execute(sql,
+                    [registration.id] +
+                    [values[column] for column in self.COLUMNS] +
+                    [normalise_dn(registration.authentication_data)])
+                n_written += 1
+        except:
+            conn.execute('ROLLBACK')
+            raise
+
+        conn.execute('COMMIT')
+        self._cache.clear()
+        return n_written
+
+    def remove_registration(self, registration_id):
+        """
+        @type registration_id: str
+        @param registration_id: ID of registration to remove
+        """
+        self._get_connection().execute('DELETE FROM %s WHERE id = ?' %
+                                       self.TABLE, (registration_id,))
+        self._cache.clear()
+
+    def reload(self, force=False):
+        """Clears the cache if the database has changed since it was last
+        checked.
+        @type force: bool
+        @param force: clear the cache whether or not the database has changed
+        @rtype: bool
+        @return: True if the cache was cleared
+        """
+        self._reload_lock.acquire()
+        try:
+            mtime = self._get_mtime()
+            if not force and mtime == self._mtime:
+                return False
+
+            self._mtime = mtime
+            self._cache.clear()
+        finally:
+            self._reload_lock.release()
+
+        log.info("Cleared cached registrations for %r", self.config_file)
+        return True
+
+
+class SQLiteClientRegister(SQLiteRegisterBase, ClientRegister):
+    """Client register held in an SQLite database.
+    """
+    TABLE = 'clients'
+    COLUMNS = ('name', 'secret', 'type', 'redirect_uris',
+               'authentication_data', 'rate_limit', 'rate_limit_burst')
+    COLUMN_TYPES = {'rate_limit': 'REAL', 'rate_limit_burst': 'REAL'}
+
+    def _make_registration(self, registration_id, values):
+        return ClientRegistration(values['name'], registration_id,
+                                  values['secret'], values['type'],
+                                  values['redirect_uris'],
+                                  values['authentication_data'],
+                                  rate_limit=values['rate_limit'],
+                                  rate_limit_burst=values['rate_limit_burst'])
+
+    def _get_values(self, registration):
+        return {
+            'name': registration.name,
+            'secret': registration.secret,
+            'type': registration.type,
+            'redirect_uris': ','.join(registration.redirect_uris),
+            'authentication_data': registration.authentication_data,
+            'rate_limit': registration.rate_limit,
+            'rate_limit_burst': registration.rate_limit_burst
+        }
+
+
+class SQLiteResourceRegister(SQLiteRegisterBase, ResourceRegister):
+    """Resource register held in an SQLite database.
+    """
+    TABLE = 'resources'
+    COLUMNS = ('name', 'secret', 'authentication_data', 'rate_limit',
+               'rate_limit_burst')
+    COLUMN_TYPES = {'rate_limit': 'REAL', 'rate_limit_burst': 'REAL'}
+
+    def _make_registration(self, registration_id, values):
+        return ResourceRegistration(values['name'], registration_id,
+                                    values['secret'],
+                                    values['authentication_data'],
+                                    rate_limit=values['rate_limit'],
+                                    rate_limit_burst=values['rate_limit_burst'])
+
+    def _get_values(self, registration):
+        return {
+            'name': registration.name,
+            'secret': registration.secret,
+            'authentication_data': registration.authentication_data,
+            'rate_limit': registration.rate_limit,
+            'rate_limit_burst': registration.rate_limit_burst
+        }
+
+
+def main():
+    """Imports the registrations in a client or resource register
+    configuration file into an SQLite database.
+    """
+    register_classes = {
+        'client': (ClientRegister, SQLiteClientRegister),
+        'resource': (ResourceRegister, SQLiteResourceRegister)
+    }
+    parser = optparse.OptionParser(
+                        usage='%prog [options] <register file> <database file>')
+    parser.add_option("-t",
+                      "--type",
+                      dest="register_type",
+                      default='client',
+                      choices=register_classes.keys(),
+                      help="Register type: client (default) or resource")
+    parser.add_option("-r",
+                      "--replace",
+                      dest="replace",
+                      action="store_true",
+                      default=False,
+                      help="Remove registrations not in the register file")
+
+    opt, args = parser.parse_args()
+    if len(args) != 2:
+        parser.error('A register file and database file must be specified')
+
+    logging.basicConfig(level=logging.INFO)
+    file_register_class, sqlite_register_class = \
+                                    register_classes[opt.register_type]
+    file_register = file_register_class(args[0])
+    sqlite_register = sqlite_register_class(args[1])
+    n_written = sqlite_register.put_registrations(
+                    file_register.register.itervalues(), replace=opt.replace)
+    log.info("Imported %d %s registrations into %r", n_written,
+             opt.register_type, args[1])
+
+
+if __name__ == '__main__':
+    main()
@@ -11,6 +11,8 @@ __revision__ = "$Id$"
 import base64
 import logging
 
+from ndg.oauth.server.lib.utils.blocking import run_blocking
+
 log = logging.getLogger(__name__)
 
 
@@ -39,8 +41,6 @@ class MyproxyCertRequest(object):
         @rtype: basestring
         @returns: certificate
         """
-        grant = token.grant
-
         myproxyclient = request.environ.get(self.myproxy_client_env_key)
         if myproxyclient is None:
             log.error('MyProxy client not found in environ')
@@ -53,17 +53,16 @@ class MyproxyCertRequest(object):
         cert_req = base64.b64decode(cert_req_enc)
 
         # Get the user identification as set by an authentication filter.
-        myproxy_id = grant.additional_data.get(
-                                            self.user_identifier_grant_data_key)
+        myproxy_id = token.user_identifier
         if not myproxy_id:
-            log.error('User identifier not stored with grant')
+            log.error('User identifier not stored with token')
             return None
 
         # Attempt to obtain a certificate from MyProxy.
         try:
-            creds = myproxyclient.logon(myproxy_id,
-                                        self.myproxy_global_password,
-                                        certReq=cert_req)
+            creds = run_blocking(myproxyclient.logon, myproxy_id,
+                                 self.myproxy_global_password,
+                                 certReq=cert_req)
         except Exception, exc:
             log.error('MyProxy logon failed: %s', exc.__str__())
             return None
@@ -0,0 +1,177 @@
+"""OAuth 2.0 WSGI server middleware - table of protected resource paths and
+the scopes they require
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "(C) 2026 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+__revision__ = "$Id$"
+
+import logging
+import re
+
+log = logging.getLogger(__name__)
+
+_REGEX_SPECIAL_CHARS = frozenset('.^$*+?{}[]\\|()')
+
+
+def _get_literal_prefix(pattern):
+    """Gets the string matched by a pattern containing no regular expression
+    operators other than escaped characters and a leading ^.
+    @type pattern: basestring
+    @param pattern: regular expression
+    @rtype: basestring
+    @return: literal string or None if the pattern isn't a literal
+    """
+    if pattern.startswith('^'):
+        pattern = pattern[1:]
+
+    chars = []
+    escaped = False
+    for char in pattern:
+        if escaped:
+            if char.isalnum():
+                # Character class such as \d
+                return None
+            chars.append(char)
+            escaped = False
+        elif char == '\\':
+            escaped = True
+        elif char in _REGEX_SPECIAL_CHARS:
+            return None
+        else:
+            chars.append(char)
+
+    if escaped:
+        return None
+
+    return ''.join(chars)
+
+
+class Route(object):
+    """Protected path pattern and the scope required for it"""
+    __slots__ = ('pattern', 'scope', 'index')
+
+    def __init__(self, pattern, scope, index):
+        """
+        @type pattern: basestring
+        @param pattern: regular expression matched against the start of the
+        request path
+        @type scope: basestring
+        @param scope: required scopes as space separated string
+        @type index: int
+        @param index: position of the route in the table
+        """
+        self.pattern = pattern
+        self.scope = scope
+        self.index = index
+
+    def __repr__(self):
+        return '<Route %r scope=%r>' % (self.pattern, self.scope)
+
+
+class RouteTable(object):
+    """
+    Maps request paths to the scopes required to access them.  Each route's
+    pattern is a regular expression matched against the start of the path and
+    the first route in the table that matches applies.
+
+    Routes which are literal prefixes are held in a character trie so that
+    the path is looked up in a single walk which stops at the first character
+    that doesn't continue a prefix - typically after a few characters for
+    unprotected paths.  The remaining patterns are combined into alternation
+    regular expressions.  The re module allows at most 100 named groups per
+    expression so large tables use more than one.
+    """
+    MAX_PATTERNS_PER_REGEX = 90
+
+    def __init__(self, routes=()):
+        """
+        @type routes: iterable
+        @param routes: (path pattern, scope) tuples in order of precedence
+        """
+        self.routes = [Route(pattern, scope, i)
+                       for i, (pattern, scope) in enumerate(routes)]
+        self._trie = {}
+        self._regexes = []
+
+        regex_routes = []
+        for route in self.routes:
+            literal = _get_literal_prefix(route.pattern)
+            if literal is None:
+                regex_routes.append(route)
+                continue
+
+            node = self._trie
+            for char in literal:
+                node = node.setdefault(char, {})
+
+            # Only the first route with a given prefix can match.
+            node.setdefault(None, route)
+
+        for i in range(0, len(regex_routes), self.MAX_PATTERNS_PER_REGEX):
+            self._regexes.extend(self._compile(
+                        regex_routes[i:i + self.MAX_PATTERNS_PER_REGEX]))
+
+    @classmethod
+    def _compile(cls, routes):
+        """Compiles routes into a single regular expression with a named
+        group for each route.  Patterns which can't be combined, e.g., because
+        they contain their own named groups, are compiled separately.
+        @rtype: list
+        @return: (first route index, regular expression, routes by group
+        name) tuples
+        """
+        groups = dict([('r%d' % route.index, route) for route in routes])
+        combined = '|'.join(['(?P<r%d>%s)' % (route.index, route.pattern)
+                             for route in routes])
+        try:
+            return [(routes[0].index, re.compile(combined), groups)]
+        except (re.error, AssertionError), exc:
+            log.debug("Compiling resource path patterns separately: %s", exc)
+
+        return [(route.index,
+                 re.compile('(?P<r%d>%s)' % (route.index, route.pattern)),
+                 {'r%d' % route.index: route}) for route in routes]
+
+    def match(self, path):
+        """Finds the route for a request path.
+        @type path: basestring
+        @param path: request path
+        @rtype: Route
+        @return: first matching route or None if no route matches
+        """
+        matched = None
+
+        node = self._trie
+        for char in path:
+            route = node.get(None)
+            if route is not None and (matched is None or
+                                      route.index < matched.index):
+                matched = route
+            node = node.get(char)
+            if node is None:
+                break
+        else:
+            route = node.get(None)
+            if route is not None and (matched is None or
+                                      route.index < matched.index):
+                matched = route
+
+        # The regular expressions are in route order so stop at the first
+        # match or once no route can precede a literal match.
+        for first_index, regex, groups in self._regexes:
+            if matched is not None and first_index > matched.index:
+                break
+            match = regex.match(path)
+            if match is not None:
+                route = groups[match.lastgroup]
+                if matched is None or route.index < matched.index:
+                    matched = route
+                break
+
+        return matched
+
+    def __len__(self):
+        return len(self.routes)
@@ -0,0 +1,107 @@
+"""OAuth 2.0 WSGI server middleware - register storage in a Beaker cache
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "(C) 2026 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+__revision__ = "$Id$"
+
+from beaker.cache import CacheManager
+from beaker.util import parse_cache_config_options
+
+from ndg.oauth.server.lib.storage.storage_interface import StorageInterface
+
+
+class BeakerStorage(StorageInterface):
+    """
+    Storage implementation using a Beaker cache.  This is used for all of the
+    Beaker cache types (file, memory, dbm, ext:memcached etc.).  Entries expire
+    according to the cache-wide Beaker expire option.
+
+    Indexes aren't supported: an index value held as a cache entry listing its
+    keys has to be read and rewritten whole as each key is added, which for
+    the file type rewrites the file.  Entries with the reserved index key
+    prefix, written by earlier versions, are removed by remove_expired.
+    """
+    INDEX_KEY_PREFIX = '\x00index\x00'
+
+    def __init__(self, name, config):
+        cacheMgr = CacheManager(**parse_cache_config_options(config))
+        self.cache = cacheMgr.get_cache(name)
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def put(self, key, value, expires=None, indexes=None):
+        self.cache.put(key, value)
+
+    @classmethod
+    def _is_index_key(cls, key):
+        return isinstance(key, basestring) and key.startswith(
+                                                        cls.INDEX_KEY_PREFIX)
+
+    def has_key(self, key):
+        return self.cache.has_key(key)
+
+    def remove(self, key):
+        self.cache.remove_value(key)
+
+    def get_keys_since(self, marker=None):
+        """Lists all keys in the cache namespace as Beaker doesn't record when
+        entries were added.  Not all Beaker cache types can list their keys.
+        """
+        namespace = self.cache.namespace
+        namespace.acquire_read_lock()
+        try:
+            return [key for key in namespace.keys()
+                    if not self._is_index_key(key)], None
+        finally:
+            namespace.release_read_lock()
+
+    def remove_expired(self, now, limit, get_expiry=None):
+        """Scans the cache namespace for expired entries and index entries
+        left by earlier versions.  This is only possible for Beaker cache
+        types which can list their keys, i.e., not memcached.
+        """
+        namespace = self.cache.namespace
+        expired_keys = []
+        namespace.acquire_read_lock()
+        try:
+            for key in namespace.keys():
+                if self._is_index_key(key):
+                    expired_keys.append(key)
+                    continue
+                try:
+                    stored_time, expire_time, value = namespace[key]
+                except (KeyError, TypeError, ValueError):
+                    continue
+
+                if expire_time is not None and stored_time + expire_time <= now:
+                    expired_keys.append(key)
+                elif get_expiry is not None:
+                    expires = get_expiry(value)
+                    if expires is not None and expires <= now:
+                        expired_keys.append(key)
+
+                if len(expired_keys) >= limit:
+                    break
+        finally:
+            namespace.release_read_lock()
+
+        if not expired_keys:
+            return 0
+
+        # The batch is removed under one write lock so that file based types
+        # load and rewrite the namespace once rather than once for each key
+        namespace.acquire_write_lock()
+        try:
+            for key in expired_keys:
+                try:
+                    del namespace[key]
+                except KeyError:
+                    pass
+        finally:
+            namespace.release_write_lock()
+
+        return len(expired_keys)
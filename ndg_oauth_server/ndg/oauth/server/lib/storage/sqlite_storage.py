@@ -0,0 +1,237 @@
+"""OAuth 2.0 WSGI server middleware - register storage in an SQLite database
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "(C) 2026 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+__revision__ = "$Id$"
+
+import cPickle as pickle
+import logging
+import os
+import re
+import sqlite3
+import time
+
+from ndg.oauth.server.lib.storage.storage_interface import StorageInterface
+from ndg.oauth.server.lib.utils.blocking import get_thread_local_class
+
+log = logging.getLogger(__name__)
+
+
+class SQLiteStorage(StorageInterface):
+    """
+    Storage implementation using an SQLite database in write-ahead logging
+    mode.  Each register has its own table, keyed on the register key with an
+    index on the entry expiry time.  By default, the database file is created
+    in the configured data_dir; set the file option to keep several registers
+    in one database file.
+
+    Index entries are held in a second table, <table>_index, keyed on index
+    name, index value and register key and written in the same transaction as
+    the entry.
+
+    A connection is opened for each thread using the storage.
+    """
+    DEFAULT_TIMEOUT = 30.
+    FILE_EXT = '.db'
+    SUPPORTS_INDEXES = True
+    PICKLE_PROTOCOL_2_PREFIX = '\x80'
+
+    # Keep below the SQLite default limit of 999 host parameters
+    MAX_QUERY_PARAMS = 500
+
+    # Bounds the index entries removed with a batch of expired entries
+    MAX_INDEXES_PER_ENTRY = 4
+
+    def __init__(self, name, config):
+        self.table = re.sub(r'\W', '_', name).lower()
+
+        filename = config.get('file')
+        if not filename:
+            filename = os.path.join(config['cache.data_dir'],
+                                    self.table + self.FILE_EXT)
+        dir_name = os.path.dirname(filename)
+        if dir_name and not os.path.isdir(dir_name):
+            os.makedirs(dir_name)
+        self.filename = filename
+
+        expire = config.get('cache.expire')
+        self.expire = int(expire) if expire else None
+
+        self.timeout = float(config.get('timeout') or self.DEFAULT_TIMEOUT)
+        # Connections are held per OS thread, not per greenlet, so that there
+        # are no more than the threads of the thread pool when serving with
+        # gevent
+        self._local = get_thread_local_class()()
+        self._create_schema()
+
+    def _get_connection(self):
+        """Gets the connection for the current thread, opening it if
+        necessary.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.filename, timeout=self.timeout,
+                                   isolation_level=None)
+            conn.text_factory = str
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _create_schema(self):
+        conn = self._get_connection()
+        conn.execute('CREATE TABLE IF NOT EXISTS %s ('
+                     'seq INTEGER PRIMARY KEY AUTOINCREMENT, '
+                     'key TEXT NOT NULL UNIQUE, '
+                     'value BLOB NOT NULL, '
+                     'expires INTEGER)' % self.table)
+        conn.execute('CREATE INDEX IF NOT EXISTS %s_expires ON %s (expires)' %
+                     (self.table, self.table))
+        conn.execute('CREATE TABLE IF NOT EXISTS %s_index ('
+                     'name TEXT NOT NULL, '
+                     'value TEXT NOT NULL, '
+                     'key TEXT NOT NULL, '
+                     'expires INTEGER, '
+                     'PRIMARY KEY (name, value, key))' % self.table)
+        conn.execute('CREATE INDEX IF NOT EXISTS %s_index_key ON %s_index '
+                     '(key)' % (self.table, self.table))
+        log.debug("Using SQLite storage table %s in %s", self.table,
+                  self.filename)
+
+    def encode(self, value):
+        """Converts a value to the form stored in the database.  Strings, such
+        as serialised register records, are stored as they are and other
+        values are pickled.
+        """
+        if isinstance(value, str):
+            return sqlite3.Binary(value)
+        return sqlite3.Binary(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+
+    def decode(self, data):
+        """Converts a value read from the database.
+        """
+        data = str(data)
+        if data.startswith(self.PICKLE_PROTOCOL_2_PREFIX):
+            return pickle.loads(data)
+        return data
+
+    def _get_expires(self, expires):
+        """Applies the cache-wide expiry to an entry's own expiry time.
+        """
+        if self.expire is not None:
+            cache_expires = int(time.time()) + self.expire
+            if expires is None or cache_expires < expires:
+                return cache_expires
+        if expires is not None:
+            return int(expires)
+        return None
+
+    def get(self, key):
+        row = self._get_connection().execute(
+            'SELECT value FROM %s WHERE key = ? AND '
+            '(expires IS NULL OR expires > ?)' % self.table,
+            (key, int(time.time()))).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return self.decode(row[0])
+
+    def get_many(self, keys):
+        keys = list(keys)
+        values = {}
+        now = int(time.time())
+        conn = self._get_connection()
+        for i in range(0, len(keys), self.MAX_QUERY_PARAMS):
+            chunk = keys[i:i + self.MAX_QUERY_PARAMS]
+            rows = conn.execute(
+                'SELECT key, value FROM %s WHERE key IN (%s) AND '
+                '(expires IS NULL OR expires > ?)' %
+                (self.table, ', '.join(['?'] * len(chunk))),
+                chunk + [now])
+            for key, data in rows:
+                values[key] = self.decode(data)
+        return values
+
+    def put(self, key, value, expires=None, indexes=None):
+        conn = self._get_connection()
+        expires = self._get_expires(expires)
+        if not indexes:
+            conn.execute(
+                'INSERT OR REPLACE INTO %s (key, value, expires) '
+                'VALUES (?, ?, ?)' % self.table,
+                (key, self.encode(value), expires))
+            return
+
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute(
+                'INSERT OR REPLACE INTO %s (key, value, expires) '
+                'VALUES (?, ?, ?)' % self.table,
+                (key, self.encode(value), expires))
+            conn.execute('DELETE FROM %s_index WHERE key = ?' % self.table,
+                         (key,))
+            conn.executemany(
+                'INSERT INTO %s_index (name, value, key, expires) '
+                'VALUES (?, ?, ?, ?)' % self.table,
+                [(name, index_value, key, expires)
+                 for name, index_value in indexes.iteritems()])
+            conn.execute('COMMIT')
+        except:
+            conn.execute('ROLLBACK')
+            raise
+
+    def get_keys_by_index(self, name, value):
+        rows = self._get_connection().execute(
+            'SELECT key FROM %s_index WHERE name = ? AND value = ? AND '
+            '(expires IS NULL OR expires > ?)' % self.table,
+            (name, value, int(time.time())))
+        return [row[0] for row in rows]
+
+    def has_key(self, key):
+        row = self._get_connection().execute(
+            'SELECT 1 FROM %s WHERE key = ? AND '
+            '(expires IS NULL OR expires > ?)' % self.table,
+            (key, int(time.time()))).fetchone()
+        return row is not None
+
+    def remove(self, key):
+        conn = self._get_connection()
+        conn.execute('DELETE FROM %s WHERE key = ?' % self.table, (key,))
+        conn.execute('DELETE FROM %s_index WHERE key = ?' % self.table, (key,))
+
+    def get_keys_since(self, marker=None):
+        """Lists keys by row sequence number so that a later call returns only
+        entries added since.  Replaced entries are given a new row and so are
+        listed again.
+        """
+        conn = self._get_connection()
+        if marker is None:
+            rows = conn.execute(
+                'SELECT seq, key FROM %s WHERE '
+                '(expires IS NULL OR expires > ?)' % self.table,
+                (int(time.time()),)).fetchall()
+            marker = 0
+        else:
+            rows = conn.execute('SELECT seq, key FROM %s WHERE seq > ?' %
+                                self.table, (marker,)).fetchall()
+
+        if rows:
+            marker = max(marker, max([row[0] for row in rows]))
+        return [row[1] for row in rows], marker
+
+    def remove_expired(self, now, limit, get_expiry=None):
+        conn = self._get_connection()
+        cursor = conn.execute(
+            'DELETE FROM %s WHERE seq IN (SELECT seq FROM %s WHERE '
+            'expires <= ? LIMIT ?)' % (self.table, self.table),
+            (int(now), limit))
+        n_removed = cursor.rowcount
+
+        # Index entries have the same expiry time as their entry.
+        conn.execute(
+            'DELETE FROM %s_index WHERE rowid IN (SELECT rowid FROM %s_index '
+            'WHERE expires <= ? LIMIT ?)' % (self.table, self.table),
+            (int(now), limit * self.MAX_INDEXES_PER_ENTRY))
+        return n_removed
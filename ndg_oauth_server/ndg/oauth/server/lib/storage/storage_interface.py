@@ -0,0 +1,153 @@
+"""OAuth 2.0 WSGI server middleware - interface for register storage backends
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "(C) 2026 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+__revision__ = "$Id$"
+
+from abc import ABCMeta, abstractmethod
+
+
+class StorageInterface(object):
+    """
+    Interface for persistent key/value storage used by the access token and
+    authorization grant registers.
+
+    Backends which support indexes set SUPPORTS_INDEXES and implement
+    get_keys_by_index.  Index values are only passed to put for these.
+    """
+    __metaclass__ = ABCMeta
+    SUPPORTS_INDEXES = False
+
+    @abstractmethod
+    def __init__(self, name, config):
+        """
+        @type name: str
+        @param name: register name - identifies the namespace, table etc.
+        within which entries are held
+
+        @type config: dict
+        @param config: cache configuration options as returned by
+        ndg.oauth.server.lib.register.register_base.RegisterBase.parse_config
+        """
+        pass
+
+    @abstractmethod
+    def get(self, key):
+        """Gets the value stored for a key.
+        @type key: basestring
+        @param key: key
+
+        @rtype: object
+        @return: stored value
+
+        Raises KeyError if there is no entry for the key or it has expired.
+        """
+        return None
+
+    def get_many(self, keys):
+        """Gets the values stored for several keys.  Backends which can fetch
+        several entries in one operation should override this.
+        @type keys: iterable of basestring
+        @param keys: keys
+
+        @rtype: dict
+        @return: stored values keyed by key.  Keys for which there is no entry
+        are omitted.
+        """
+        values = {}
+        for key in keys:
+            try:
+                values[key] = self.get(key)
+            except KeyError:
+                pass
+        return values
+
+    @abstractmethod
+    def put(self, key, value, expires=None, indexes=None):
+        """Stores a value, replacing any existing value for the key.
+        @type key: basestring
+        @param key: key
+
+        @type value: object
+        @param value: value to store
+
+        @type expires: int or float
+        @param expires: time after which the entry is no longer required as
+        seconds since the epoch, or None if the value doesn't expire.
+        Backends may ignore this.
+
+        @type indexes: dict
+        @param indexes: index names and values under which the key is to be
+        listed by get_keys_by_index.  This is only given to backends which
+        support indexes, by registers which use them.
+        """
+        pass
+
+    @abstractmethod
+    def has_key(self, key):
+        """
+        @type key: basestring
+        @param key: key
+
+        @rtype: bool
+        @return: True if there is an entry for the key, otherwise False
+        """
+        return False
+
+    @abstractmethod
+    def remove(self, key):
+        """Removes the entry for a key if present.
+        @type key: basestring
+        @param key: key
+        """
+        pass
+
+    def get_keys_by_index(self, name, value):
+        """Lists the keys stored with a given index value.  Backends which
+        don't support indexes need not implement this.
+        @type name: basestring
+        @param name: index name
+
+        @type value: basestring
+        @param value: index value
+
+        @rtype: list
+        @return: keys.  These may include keys of entries which have since
+        been removed.
+        """
+        raise NotImplementedError()
+
+    def get_keys_since(self, marker=None):
+        """Lists the keys of entries added since an earlier call.  Backends
+        which can't list their keys need not implement this.
+        @type marker: object
+        @param marker: marker returned by an earlier call or None to list all
+        keys
+
+        @rtype: tuple (list, object)
+        @return: keys and a marker for the next call.  If the given marker is
+        None or the returned marker is None, the keys are those of all current
+        entries rather than only those added since the earlier call.
+        """
+        raise NotImplementedError()
+
+    def remove_expired(self, now, limit, get_expiry=None):
+        """Removes up to a given number of expired entries.  Backends which
+        cannot enumerate their entries need not implement this.
+        @type now: float
+        @param now: current time as seconds since the epoch
+
+        @type limit: int
+        @param limit: maximum number of entries to remove
+
+        @type get_expiry: callable
+        @param get_expiry: function returning the expiry time of a stored value
+        as seconds since the epoch, for backends which don't record it
+
+        @rtype: int
+        @return: number of entries removed
+        """
+        raise NotImplementedError()
@@ -0,0 +1,56 @@
+"""OAuth 2.0 WSGI server middleware - register storage accessed from a thread
+pool
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "(C) 2026 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+__revision__ = "$Id$"
+
+from ndg.oauth.server.lib.storage.storage_interface import StorageInterface
+from ndg.oauth.server.lib.utils.blocking import run_blocking
+
+
+class ThreadPoolStorage(StorageInterface):
+    """
+    Adapter for a storage backend whose operations block, e.g., on file I/O or
+    database locks, for use when serving with gevent.  Each operation is made
+    in gevent's thread pool so that other requests are served while it waits.
+    When not serving with gevent, operations are made directly.
+    """
+
+    def __init__(self, storage):
+        """
+        @type storage: ndg.oauth.server.lib.storage.storage_interface.\
+StorageInterface
+        @param storage: storage backend to wrap
+        """
+        self.storage = storage
+        self.SUPPORTS_INDEXES = storage.SUPPORTS_INDEXES
+
+    def get(self, key):
+        return run_blocking(self.storage.get, key)
+
+    def get_many(self, keys):
+        return run_blocking(self.storage.get_many, keys)
+
+    def put(self, key, value, expires=None, indexes=None):
+        return run_blocking(self.storage.put, key, value, expires=expires,
+                            indexes=indexes)
+
+    def has_key(self, key):
+        return run_blocking(self.storage.has_key, key)
+
+    def remove(self, key):
+        return run_blocking(self.storage.remove, key)
+
+    def get_keys_by_index(self, name, value):
+        return run_blocking(self.storage.get_keys_by_index, name, value)
+
+    def get_keys_since(self, marker=None):
+        return run_blocking(self.storage.get_keys_since, marker)
+
+    def remove_expired(self, now, limit, get_expiry=None):
+        return run_blocking(self.storage.remove_expired, now, limit,
+                            get_expiry=get_expiry)
@@ -0,0 +1,54 @@
+"""OAuth 2.0 WSGI server middleware - blocking calls made in a thread pool when
+serving with gevent
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "(C) 2026 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+__revision__ = "$Id$"
+
+import threading
+
+try:
+    import gevent
+    import gevent.monkey
+except ImportError:
+    gevent = None
+
+
+def is_cooperative():
+    """
+    @rtype: bool
+    @return: True if requests are being served by greenlets, i.e., gevent has
+    patched the socket module
+    """
+    return gevent is not None and gevent.monkey.is_module_patched('socket')
+
+
+def get_thread_local_class():
+    """Gets a thread local class which is local to OS threads even when gevent
+    has patched threading, rather than to greenlets.  Resources held in it,
+    such as database connections, are then bounded by the number of threads:
+    when serving with gevent, the main thread and those of the thread pool.
+    @rtype: type
+    @return: threading.local or the original class if it has been patched
+    """
+    if gevent is not None and gevent.monkey.is_module_patched('threading'):
+        return gevent.monkey.get_original('threading', 'local')
+    return threading.local
+
+
+def run_blocking(func, *args, **kw):
+    """Calls a function which may block without yielding to other greenlets,
+    e.g., one doing file I/O or using an SSL library which reads the socket
+    directly.  When serving with gevent, the call is made in gevent's thread
+    pool so that other requests are served in the meantime.  Otherwise it is
+    made directly.
+    @type func: callable
+    @param func: function to call
+    @return: result of the call
+    """
+    if is_cooperative():
+        return gevent.get_hub().threadpool.apply(func, args, kw)
+    return func(*args, **kw)
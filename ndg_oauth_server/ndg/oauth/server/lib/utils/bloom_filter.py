@@ -0,0 +1,76 @@
+"""OAuth 2.0 WSGI server middleware - Bloom filter for set membership tests
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "(C) 2026 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+__revision__ = "$Id$"
+
+import hashlib
+import math
+import struct
+
+
+class BloomFilter(object):
+    """Probabilistic set of strings.  A membership test may give a false
+    positive, with a probability close to the configured error rate while the
+    number of members is within the capacity, but never a false negative.
+    Members can't be removed.
+
+    Bit positions are derived from the two halves of the MD5 digest of each
+    member by double hashing.
+    """
+    DEFAULT_ERROR_RATE = 0.001
+
+    def __init__(self, capacity, error_rate=DEFAULT_ERROR_RATE):
+        """
+        @type capacity: int
+        @param capacity: number of members for which the filter is sized
+
+        @type error_rate: float
+        @param error_rate: false positive probability when the filter holds
+        capacity members
+        """
+        self.capacity = int(capacity)
+        self.error_rate = float(error_rate)
+
+        n_bits = int(math.ceil(-self.capacity * math.log(self.error_rate) /
+                               math.log(2) ** 2))
+        self.n_bits = max(n_bits, 8)
+        self.n_hashes = max(int(round(self.n_bits * math.log(2) /
+                                      self.capacity)), 1)
+        self.count = 0
+        self._bits = bytearray((self.n_bits + 7) // 8)
+
+    def _get_positions(self, key):
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        h1, h2 = struct.unpack('<QQ', hashlib.md5(key).digest())
+        return [(h1 + i * h2) % self.n_bits for i in xrange(self.n_hashes)]
+
+    def add(self, key):
+        """
+        @type key: basestring
+        @param key: member to add
+        """
+        for pos in self._get_positions(key):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        bits = self._bits
+        for pos in self._get_positions(key):
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+    def __len__(self):
+        """Number of additions, which includes any repeated additions of the
+        same member.
+        """
+        return self.count
+
+    @property
+    def is_full(self):
+        return self.count >= self.capacity
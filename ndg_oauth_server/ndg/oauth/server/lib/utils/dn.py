@@ -0,0 +1,118 @@
+"""OAuth 2.0 WSGI server middleware - normalisation of X.509 distinguished names
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "(C) 2026 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+__revision__ = "$Id$"
+
+import logging
+import re
+
+log = logging.getLogger(__name__)
+
+# Separators not preceded by a backslash escape
+_SLASH_SEP_PAT = re.compile(r'(?<!\\)/')
+_COMMA_SEP_PAT = re.compile(r'(?<!\\)[,;]')
+_MULTI_VALUE_SEP_PAT = re.compile(r'(?<!\\)\+')
+_ESCAPE_PAT = re.compile(r'\\(.)')
+_WHITESPACE_PAT = re.compile(r'\s+')
+# Characters escaped in values of the canonical form so that it can't be
+# read as different RDNs
+_SPECIAL_CHAR_PAT = re.compile(r'([\\/+])')
+
+# Alternative names for attribute types
+ATTRIBUTE_TYPE_ALIASES = {
+    'E': 'EMAILADDRESS',
+    'EMAIL': 'EMAILADDRESS',
+    'COMMONNAME': 'CN',
+    'COUNTRYNAME': 'C',
+    'LOCALITYNAME': 'L',
+    'STATEORPROVINCENAME': 'ST',
+    'S': 'ST',
+    'ORGANIZATIONNAME': 'O',
+    'ORGANIZATIONALUNITNAME': 'OU',
+    'USERID': 'UID',
+    'DOMAINCOMPONENT': 'DC'
+}
+
+
+def _escape_value(value):
+    return _SPECIAL_CHAR_PAT.sub(r'\\\1', value)
+
+
+def normalise_dn(dn):
+    """Converts a distinguished name to a canonical form so that the same name
+    in different formats compares equal.  This handles the OpenSSL
+    /C=UK/O=STFC/CN=name form and the RFC 2253 CN=name,O=STFC,C=UK form,
+    whitespace around separators, alternative attribute type names and case.
+    RFC 2253 names list the RDNs in the reverse order so they are reversed.
+    The order of the RDNs is significant as names with the same attributes
+    in a different order are different names; only the attributes of a
+    multi-valued RDN are sorted.
+    @type dn: basestring
+    @param dn: distinguished name
+    @rtype: str
+    @return: canonical form of the name, or None if dn can't be parsed
+    """
+    if not dn:
+        return None
+
+    dn = dn.strip()
+    if dn.startswith('/'):
+        rdns = _SLASH_SEP_PAT.split(dn[1:])
+    else:
+        rdns = _COMMA_SEP_PAT.split(dn)
+        rdns.reverse()
+
+    normalised_rdns = []
+    for rdn in rdns:
+        attributes = []
+        for attribute in _MULTI_VALUE_SEP_PAT.split(rdn):
+            if not attribute.strip():
+                continue
+            try:
+                attr_type, value = attribute.split('=', 1)
+            except ValueError:
+                log.debug("Error parsing distinguished name %r", dn)
+                return None
+
+            attr_type = attr_type.strip().upper()
+            attr_type = ATTRIBUTE_TYPE_ALIASES.get(attr_type, attr_type)
+            value = _ESCAPE_PAT.sub(r'\1', value.strip())
+            value = _WHITESPACE_PAT.sub(' ', value).lower()
+            attributes.append('%s=%s' % (attr_type, _escape_value(value)))
+
+        if attributes:
+            normalised_rdns.append('+'.join(sorted(attributes)))
+
+    if not normalised_rdns:
+        return None
+
+    return '/' + '/'.join(normalised_rdns)
+
+
+def index_by_dn(registrations):
+    """Makes an index of registrations by the normalised form of their
+    authentication data DN.
+    @type registrations: iterable
+    @param registrations: client or resource registrations
+    @rtype: dict
+    @return: registrations keyed by normalised DN
+    """
+    dn_index = {}
+    for registration in registrations:
+        dn = normalise_dn(registration.authentication_data)
+        if dn is None:
+            continue
+
+        if dn in dn_index:
+            log.warning("Registrations %r and %r have the same certificate "
+                        "DN %r - using %r", dn_index[dn].id, registration.id,
+                        registration.authentication_data, dn_index[dn].id)
+            continue
+
+        dn_index[dn] = registration
+
+    return dn_index
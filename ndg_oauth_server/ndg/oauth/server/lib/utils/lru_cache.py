@@ -0,0 +1,96 @@
+"""OAuth 2.0 WSGI server middleware - bounded, TTL-aware in-memory LRU cache
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "(C) 2026 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+__revision__ = "$Id$"
+
+from collections import OrderedDict
+from threading import Lock
+import time
+
+_MISSING = object()
+
+
+class LRUCache(object):
+    """Thread-safe least recently used cache with a bounded number of entries.
+
+    Each entry has an expiry time which is the earlier of the cache-wide TTL
+    and any expiry time given when the entry is set.  Expired entries are
+    dropped lazily on lookup.
+    """
+    def __init__(self, max_size, ttl=None):
+        """
+        @type max_size: int
+        @param max_size: maximum number of entries held.  When full, the least
+        recently used entry is discarded.
+
+        @type ttl: int or float
+        @param ttl: maximum time in seconds for which an entry is held, or None
+        for no limit
+        """
+        self.max_size = int(max_size)
+        self.ttl = float(ttl) if ttl else None
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, default=None):
+        """Returns the value for a key, or the default if there is no entry for
+        the key or the entry has expired.
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return default
+
+            value, expires = entry
+            if expires is not None and expires <= time.time():
+                return default
+
+            # Re-insert to mark as most recently used.
+            self._entries[key] = entry
+            return value
+
+    def set(self, key, value, expires=None):
+        """Adds or replaces an entry.
+        @type key: hashable
+        @param key: cache key
+
+        @type value: object
+        @param value: value to cache
+
+        @type expires: float
+        @param expires: optional expiry time for this entry as seconds since
+        the epoch.  The cache TTL applies if this is later.
+        """
+        if self.max_size <= 0:
+            return
+
+        if self.ttl is not None:
+            ttl_expires = time.time() + self.ttl
+            if expires is None or ttl_expires < expires:
+                expires = ttl_expires
+
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, expires)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def remove(self, key):
+        """Removes the entry for a key if present.
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,320 @@
+"""OAuth 2.0 WSGI server middleware - counters and latency histograms exposed
+in the Prometheus text format
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "(C) 2026 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+__revision__ = "$Id$"
+
+from bisect import bisect_left
+import threading
+import time
+import weakref
+
+from ndg.oauth.server.lib.utils.blocking import get_thread_local_class
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Request latency buckets in seconds
+DEFAULT_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1., 2.5, 5.,
+                   10.)
+
+
+def _escape_label_value(value):
+    return (str(value).replace('\\', r'\\').replace('\n', r'\n')
+            .replace('"', r'\"'))
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+
+class Metric(object):
+    """Base class for metrics held in a MetricsRegistry"""
+    TYPE = None
+
+    def __init__(self, registry, name, description, labelnames=()):
+        """
+        @type registry: MetricsRegistry
+        @param registry: registry holding the values
+        @type name: str
+        @param name: metric name
+        @type description: str
+        @param description: help text
+        @type labelnames: tuple
+        @param labelnames: names of the labels whose values are given when
+        recording
+        """
+        self._registry = registry
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+
+    def _format_labels(self, labelvalues, extra=()):
+        pairs = ['%s="%s"' % (name, _escape_label_value(value))
+                 for name, value in zip(self.labelnames, labelvalues)]
+        pairs.extend(['%s="%s"' % (name, _escape_label_value(value))
+                      for name, value in extra])
+        if not pairs:
+            return ''
+        return '{%s}' % ','.join(pairs)
+
+    def render(self, values):
+        """
+        @type values: dict
+        @param values: aggregated values keyed by label values
+        @rtype: list
+        @return: lines in the text exposition format
+        """
+        raise NotImplementedError()
+
+
+class Counter(Metric):
+    """Monotonically increasing count"""
+    TYPE = 'counter'
+
+    def inc(self, *labelvalues):
+        """Adds one to the count for the label values."""
+        values = self._registry._get_shard()
+        key = (self, labelvalues)
+        values[key] = values.get(key, 0) + 1
+
+    def add(self, amount, *labelvalues):
+        """Adds to the count for the label values."""
+        values = self._registry._get_shard()
+        key = (self, labelvalues)
+        values[key] = values.get(key, 0) + amount
+
+    @staticmethod
+    def _merge(total, value):
+        return (total or 0) + value
+
+    def render(self, values):
+        return ['%s%s %s' % (self.name, self._format_labels(labelvalues),
+                             _format_value(value))
+                for labelvalues, value in sorted(values.items())]
+
+
+class Histogram(Metric):
+    """Distribution of observed values, e.g., request durations"""
+    TYPE = 'histogram'
+
+    def __init__(self, registry, name, description, labelnames=(),
+                 buckets=DEFAULT_BUCKETS):
+        """
+        @type buckets: tuple
+        @param buckets: upper bounds of the buckets in increasing order
+        """
+        super(Histogram, self).__init__(registry, name, description,
+                                        labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labelvalues):
+        """Records a value for the label values."""
+        values = self._registry._get_shard()
+        key = (self, labelvalues)
+        counts = values.get(key)
+        if counts is None:
+            # Bucket counts, with one for values above the largest bound,
+            # followed by the sum of the values
+            counts = [0] * (len(self.buckets) + 1) + [0.]
+            values[key] = counts
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def time(self, *labelvalues):
+        """Gets a context manager which records the time taken by its block."""
+        return _Timer(self, labelvalues)
+
+    @staticmethod
+    def _merge(total, value):
+        if total is None:
+            return list(value)
+        return [a + b for a, b in zip(total, value)]
+
+    def render(self, values):
+        lines = []
+        for labelvalues, counts in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),),
+                                    counts[:-1]):
+                cumulative += count
+                lines.append('%s_bucket%s %d' % (
+                    self.name,
+                    self._format_labels(labelvalues,
+                                        (('le', _format_value(bound)),)),
+                    cumulative))
+            labels = self._format_labels(labelvalues)
+            lines.append('%s_sum%s %s' % (self.name, labels,
+                                          _format_value(counts[-1])))
+            lines.append('%s_count%s %d' % (self.name, labels, cumulative))
+        return lines
+
+
+class _Timer(object):
+    __slots__ = ('histogram', 'labelvalues', 'start')
+
+    def __init__(self, histogram, labelvalues):
+        self.histogram = histogram
+        self.labelvalues = labelvalues
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.time() - self.start, *self.labelvalues)
+
+
+class _ShardOwner(object):
+    """Held in a thread's local storage to detect when the thread finishes"""
+    __slots__ = ('__weakref__',)
+
+
+class MetricsRegistry(object):
+    """
+    Holds the values of a set of metrics.  Each thread records values in its
+    own shard so that recording takes no lock.  The shards are only combined
+    when the metrics are rendered, which takes a snapshot of each shard.
+    When a thread finishes, its shard is added to the retired totals so that
+    counts don't go backwards and servers which start a thread per request
+    don't accumulate shards.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        # Shards keyed by a weak reference to an object held only by the
+        # thread's local storage, which is released when the thread finishes
+        self._shards = {}
+        self._retired = {}
+        self._lock = threading.Lock()
+        # A shard per thread rather than per greenlet
+        self._local = get_thread_local_class()()
+
+    def _get_shard(self):
+        try:
+            return self._local.values
+        except AttributeError:
+            values = {}
+            owner = _ShardOwner()
+            with self._lock:
+                self._shards[weakref.ref(owner, self._retire_shard)] = values
+            self._local.owner = owner
+            self._local.values = values
+            return values
+
+    def _retire_shard(self, ref):
+        """Adds the values of a finished thread's shard to the retired
+        totals.
+        """
+        with self._lock:
+            values = self._shards.pop(ref, None)
+            if values:
+                for key, value in values.iteritems():
+                    self._retired[key] = key[0]._merge(self._retired.get(key),
+                                                       value)
+
+    def _get_metric(self, metric_class, name, description, labelnames, **kw):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = metric_class(self, name, description, labelnames,
+                                      **kw)
+                self._metrics[name] = metric
+            elif not isinstance(metric, metric_class):
+                raise ValueError('Metric %r is already registered as a %s' %
+                                 (name, metric.TYPE))
+            return metric
+
+    def counter(self, name, description, labelnames=()):
+        """Gets a counter, creating it if it isn't registered.
+        @rtype: Counter
+        """
+        return self._get_metric(Counter, name, description, labelnames)
+
+    def histogram(self, name, description, labelnames=(),
+                  buckets=DEFAULT_BUCKETS):
+        """Gets a histogram, creating it if it isn't registered.
+        @rtype: Histogram
+        """
+        return self._get_metric(Histogram, name, description, labelnames,
+                                buckets=buckets)
+
+    def collect(self):
+        """Combines the values recorded by all threads.
+        @rtype: dict
+        @return: values keyed by metric and then by label values
+        """
+        with self._lock:
+            shards = self._shards.values()
+            retired = self._retired.copy()
+
+        collected = {}
+        for (metric, labelvalues), value in retired.iteritems():
+            collected.setdefault(metric, {})[labelvalues] = value
+
+        for shard in shards:
+            # Copying a dict is atomic so the thread which owns the shard can
+            # carry on recording.
+            for (metric, labelvalues), value in shard.copy().iteritems():
+                values = collected.setdefault(metric, {})
+                values[labelvalues] = metric._merge(values.get(labelvalues),
+                                                    value)
+        return collected
+
+    def render(self):
+        """
+        @rtype: str
+        @return: all metrics in the Prometheus text exposition format
+        """
+        collected = self.collect()
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: m.name)
+
+        lines = []
+        for metric in metrics:
+            lines.append('# HELP %s %s' % (metric.name, metric.description))
+            lines.append('# TYPE %s %s' % (metric.name, metric.TYPE))
+            lines.extend(metric.render(collected.get(metric, {})))
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        """Resets all values to zero."""
+        with self._lock:
+            for shard in self._shards.itervalues():
+                shard.clear()
+            self._retired.clear()
+
+
+# Registry for the process, shared by all the middleware
+REGISTRY = MetricsRegistry()
+
+
+def counter(name, description, labelnames=()):
+    """Gets a counter in the process registry."""
+    return REGISTRY.counter(name, description, labelnames)
+
+
+def histogram(name, description, labelnames=(), buckets=DEFAULT_BUCKETS):
+    """Gets a histogram in the process registry."""
+    return REGISTRY.histogram(name, description, labelnames, buckets=buckets)
+
+
+def metrics_response(start_response, registry=REGISTRY):
+    """Responds to a metrics request with the metrics in a registry.
+    @type start_response: function
+    @param start_response: WSGI start response function
+    @rtype: list
+    @return: WSGI response
+    """
+    response = registry.render()
+    start_response('200 OK', [('Content-Type', CONTENT_TYPE),
+                              ('Content-Length', str(len(response))),
+                              ('Cache-Control', 'no-store')])
+    return [response]
@@ -0,0 +1,115 @@
+"""OAuth 2.0 WSGI server middleware - timing of the phases of a request
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "(C) 2026 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+__revision__ = "$Id$"
+
+import logging
+import time
+
+from ndg.oauth.server.lib.utils import metrics
+
+# Timings are logged to their own logger so that they can be enabled
+# separately from other messages.
+timing_log = logging.getLogger('ndg.oauth.server.timing')
+
+PHASE_DURATION = metrics.histogram(
+        'ndg_oauth_phase_duration_seconds',
+        'Time taken by each phase of requests to the token endpoints',
+        ('endpoint', 'phase'))
+
+
+class _Phase(object):
+    __slots__ = ('timer', 'name', 'start')
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.timer.phases.append((self.name, time.time() - self.start))
+
+
+class _NoPhase(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+_NO_PHASE = _NoPhase()
+
+
+def phase(timer, name):
+    """Gets a context manager which times its block as a phase of a request.
+    @type timer: PhaseTimer
+    @param timer: timer for the request, or None if it isn't being timed
+    @type name: str
+    @param name: phase name
+    """
+    if timer is None:
+        return _NO_PHASE
+    return _Phase(timer, name)
+
+
+class PhaseTimer(object):
+    """
+    Records how long each phase of a request takes, e.g., client
+    authentication, grant lookup, token generation and storage for an access
+    token request.  When the request is complete, the durations are recorded
+    in the metrics, logged to the ndg.oauth.server.timing logger and
+    optionally returned to the client in a Server-Timing header.
+    """
+    __slots__ = ('endpoint', 'phases', 'start')
+
+    def __init__(self, endpoint):
+        """
+        @type endpoint: str
+        @param endpoint: name of the endpoint handling the request
+        """
+        self.endpoint = endpoint
+        self.phases = []
+        self.start = time.time()
+
+    def phase(self, name):
+        """Gets a context manager which times its block as a phase."""
+        return _Phase(self, name)
+
+    def server_timing_header(self, total=None):
+        """
+        @type total: float
+        @param total: total time for the request in seconds
+        @rtype: tuple
+        @return: Server-Timing header name and value with durations in
+        milliseconds
+        """
+        metrics_ = ['%s;dur=%.3f' % (name, duration * 1000.)
+                    for name, duration in self.phases]
+        if total is not None:
+            metrics_.append('total;dur=%.3f' % (total * 1000.))
+        return 'Server-Timing', ', '.join(metrics_)
+
+    def finish(self):
+        """Records the phase durations in the metrics and logs them.
+        @rtype: float
+        @return: total time for the request in seconds
+        """
+        total = time.time() - self.start
+        for name, duration in self.phases:
+            PHASE_DURATION.observe(duration, self.endpoint, name)
+
+        if timing_log.isEnabledFor(logging.INFO):
+            timing_log.info('endpoint=%s total_ms=%.3f %s', self.endpoint,
+                            total * 1000.,
+                            ' '.join(['%s_ms=%.3f' % (name, duration * 1000.)
+                                      for name, duration in self.phases]))
+        return total
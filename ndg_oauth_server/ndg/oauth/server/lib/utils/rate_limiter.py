@@ -0,0 +1,409 @@
+"""OAuth 2.0 WSGI server middleware - token bucket rate limiting of clients
+and resources
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "(C) 2026 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+__revision__ = "$Id$"
+
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+
+from ndg.oauth.server.lib.render.factory import importModuleObject
+from ndg.oauth.server.lib.utils import metrics
+from ndg.oauth.server.lib.utils.blocking import (get_thread_local_class,
+                                                 run_blocking)
+
+log = logging.getLogger(__name__)
+
+# Not in httplib.responses for Python 2
+TOO_MANY_REQUESTS = 429
+TOO_MANY_REQUESTS_STATUS = '429 Too Many Requests'
+
+RATE_LIMITED = metrics.counter(
+        'ndg_oauth_rate_limited_total',
+        'Requests refused by the rate limiter by what they were limited by: '
+        'client, resource, address or failure (failed authentication from an '
+        'address with an ID)',
+        ('type',))
+
+
+class RateLimitExceeded(Exception):
+    """Raised when a request is refused by the rate limiter"""
+
+    def __init__(self, key, retry_after):
+        """
+        @type key: str
+        @param key: bucket key
+        @type retry_after: float
+        @param retry_after: time in seconds before a request would be allowed
+        """
+        Exception.__init__(self, 'Rate limit exceeded for %s' % key)
+        self.key = key
+        self.retry_after = retry_after
+
+
+class TokenBucketStore(object):
+    """
+    Token buckets held in memory in the process.  A bucket holds up to burst
+    tokens and is refilled at rate tokens per second; each request takes a
+    token.  Buckets are split between stripes, each with its own lock held
+    only for the update of one bucket.  A bucket which has refilled is the
+    same as no bucket so full buckets are dropped when a stripe grows beyond
+    its share of max_keys.
+    """
+    N_STRIPES = 64
+    DEFAULT_MAX_KEYS = 100000
+
+    def __init__(self, config):
+        """
+        @type config: dict
+        @param config: options - max_keys is the number of buckets held
+        before full ones are dropped
+        """
+        max_keys = int(config.get('max_keys') or self.DEFAULT_MAX_KEYS)
+        self._max_stripe_keys = max(1, max_keys // self.N_STRIPES)
+        self._stripes = [({}, threading.Lock())
+                         for _ in range(self.N_STRIPES)]
+
+    def take(self, key, rate, burst, now=None):
+        """Takes a token from a bucket.
+        @type key: str
+        @param key: bucket key
+        @type rate: float
+        @param rate: tokens added per second
+        @type burst: float
+        @param burst: bucket capacity
+        @type now: float
+        @param now: current time
+        @rtype: float
+        @return: zero if a token was taken, otherwise the time in seconds
+        until one is available
+        """
+        if now is None:
+            now = time.time()
+        buckets, lock = self._stripes[hash(key) % self.N_STRIPES]
+        with lock:
+            bucket = buckets.get(key)
+            if bucket is None:
+                tokens = burst
+            else:
+                tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+
+            if tokens >= 1.:
+                tokens -= 1.
+                wait = 0.
+            else:
+                wait = (1. - tokens) / rate
+
+            # Time at which the bucket will be full again
+            buckets[key] = (tokens, now, now + (burst - tokens) / rate)
+            if len(buckets) > self._max_stripe_keys:
+                self._prune(buckets, now)
+        return wait
+
+    def peek(self, key, rate, burst, now=None):
+        """Gets the time until a token is available without taking one.
+        @rtype: float
+        @return: zero if a token is available, otherwise the time in seconds
+        until one is
+        """
+        if now is None:
+            now = time.time()
+        buckets = self._stripes[hash(key) % self.N_STRIPES][0]
+        bucket = buckets.get(key)
+        if bucket is None:
+            return 0.
+
+        tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+        if tokens >= 1.:
+            return 0.
+        return (1. - tokens) / rate
+
+    def _prune(self, buckets, now):
+        """Drops full buckets and, if the stripe is still too big, those
+        closest to being full.  Called with the stripe lock held.
+        """
+        for key in [k for k, bucket in buckets.iteritems()
+                    if bucket[2] <= now]:
+            del buckets[key]
+
+        excess = len(buckets) - self._max_stripe_keys * 3 // 4
+        if excess > 0:
+            for key in sorted(buckets, key=lambda k: buckets[k][2])[:excess]:
+                del buckets[key]
+
+
+class SQLiteTokenBucketStore(object):
+    """
+    Token buckets held in an SQLite database so that they are shared by the
+    worker processes of a server on one host.  Each bucket is updated in an
+    immediate transaction.  If the database can't be updated, e.g., because
+    it is locked for longer than the timeout, the request is allowed rather
+    than failed.  Full buckets are deleted periodically.  When serving with
+    gevent, the database is accessed in gevent's thread pool and connections
+    are held per OS thread.
+    """
+    TABLE = 'rate_limit_buckets'
+    DEFAULT_TIMEOUT = 1.
+    PRUNE_INTERVAL = 60.
+
+    def __init__(self, config):
+        """
+        @type config: dict
+        @param config: options - file is the database file and timeout the
+        time in seconds to wait for the database lock
+        """
+        self.filename = config.get('file')
+        if not self.filename:
+            raise ValueError('A database file must be set for rate limit '
+                             'buckets held in SQLite')
+        dir_name = os.path.dirname(self.filename)
+        if dir_name and not os.path.isdir(dir_name):
+            os.makedirs(dir_name)
+
+        self.timeout = float(config.get('timeout') or self.DEFAULT_TIMEOUT)
+        self._local = get_thread_local_class()()
+        self._next_prune = 0.
+        self._get_connection().execute(
+            'CREATE TABLE IF NOT EXISTS %s ('
+            'key TEXT PRIMARY KEY, '
+            'tokens REAL NOT NULL, '
+            'updated REAL NOT NULL, '
+            'full_at REAL NOT NULL)' % self.TABLE)
+
+    def _get_connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.filename, timeout=self.timeout,
+                                   isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=OFF')
+            self._local.conn = conn
+        return conn
+
+    def take(self, key, rate, burst, now=None):
+        if now is None:
+            now = time.time()
+        return run_blocking(self._take, key, rate, burst, now)
+
+    def _take(self, key, rate, burst, now):
+        try:
+            conn = self._get_connection()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = conn.execute('SELECT tokens, updated FROM %s '
+                                   'WHERE key = ?' % self.TABLE,
+                                   (key,)).fetchone()
+                if row is None:
+                    tokens = burst
+                else:
+                    tokens = min(burst, row[0] + (now - row[1]) * rate)
+
+                if tokens >= 1.:
+                    tokens -= 1.
+                    wait = 0.
+                else:
+                    wait = (1. - tokens) / rate
+
+                conn.execute('INSERT OR REPLACE INTO %s '
+                             '(key, tokens, updated, full_at) '
+                             'VALUES (?, ?, ?, ?)' % self.TABLE,
+                             (key, tokens, now,
+                              now + (burst - tokens) / rate))
+                if now >= self._next_prune:
+                    self._next_prune = now + self.PRUNE_INTERVAL
+                    conn.execute('DELETE FROM %s WHERE full_at <= ?' %
+                                 self.TABLE, (now,))
+                conn.execute('COMMIT')
+            except:
+                conn.execute('ROLLBACK')
+                raise
+        except sqlite3.Error, exc:
+            log.error("Error updating rate limit for %s in %s: %s", key,
+                      self.filename, exc)
+            return 0.
+        return wait
+
+    def peek(self, key, rate, burst, now=None):
+        if now is None:
+            now = time.time()
+        return run_blocking(self._peek, key, rate, burst, now)
+
+    def _peek(self, key, rate, burst, now):
+        try:
+            row = self._get_connection().execute(
+                                    'SELECT tokens, updated FROM %s '
+                                    'WHERE key = ?' % self.TABLE,
+                                    (key,)).fetchone()
+        except sqlite3.Error, exc:
+            log.error("Error reading rate limit for %s in %s: %s", key,
+                      self.filename, exc)
+            return 0.
+
+        if row is None:
+            return 0.
+
+        tokens = min(burst, row[0] + (now - row[1]) * rate)
+        if tokens >= 1.:
+            return 0.
+        return (1. - tokens) / rate
+
+
+class RateLimiter(object):
+    """
+    Limits the rate of requests made by each client or resource.  Requests
+    are counted against the authenticated client or resource ID.  Requests
+    which aren't authenticated, because authentication fails or isn't
+    configured, are counted against the remote address and refused once its
+    limit is reached.  Authenticated requests are never refused on the
+    address limit so that clients behind the same NAT or proxy as a
+    misbehaving one aren't affected.
+
+    Failed authentications are also counted against the remote address
+    together with the ID presented, and once that limit is reached requests
+    presenting the ID from the address are refused before the secret or
+    certificate is checked, so that guessing a secret doesn't cost the server
+    a slow verification for each attempt.
+
+    The default rate and burst may be overridden for a client or resource
+    with the rate_limit and rate_limit_burst settings of its registration.  A
+    rate of zero means that it is not limited.
+
+    Buckets are held in memory in the process by default.  The sqlite backend
+    shares them between the processes on a host through a database file; any
+    other backend is the module:class name of a store with the same
+    interface as TokenBucketStore.
+    """
+    BACKENDS = {
+        'memory': TokenBucketStore,
+        'sqlite': SQLiteTokenBucketStore,
+    }
+    ADDRESS_TYPE = 'address'
+    FAILURE_TYPE = 'failure'
+
+    def __init__(self, rate, burst=None, backend='memory', config=None,
+                 registers=None):
+        """
+        @type rate: float
+        @param rate: requests per second allowed by default
+        @type burst: float
+        @param burst: number of requests which may be made at once by
+        default.  Defaults to the rate or one if that is greater.
+        @type backend: str
+        @param backend: bucket store: memory, sqlite or module:class name
+        @type config: dict
+        @param config: bucket store options
+        @type registers: dict
+        @param registers: client and resource registers keyed by type,
+        client or resource, for per-registration limits
+        """
+        self.rate = float(rate)
+        if self.rate <= 0:
+            raise ValueError('The rate limit must be greater than zero')
+        self.burst = float(burst) if burst else max(self.rate, 1.)
+        self.registers = registers or {}
+
+        store_class = self.BACKENDS.get(backend)
+        if store_class is None:
+            store_class = importModuleObject(backend)
+        self.store = store_class(config or {})
+
+    def _get_limit(self, typ, entity_id):
+        """Gets the rate and burst for a client or resource.
+        @rtype: tuple
+        @return: (rate, burst), with a rate of zero if it is not limited
+        """
+        register = self.registers.get(typ)
+        registration = None
+        if register is not None:
+            registration = register.register.get(entity_id)
+
+        rate = getattr(registration, 'rate_limit', None)
+        if rate is None:
+            return self.rate, self.burst
+
+        burst = getattr(registration, 'rate_limit_burst', None)
+        return rate, burst or max(rate, 1.)
+
+    def _take(self, typ, key, rate, burst):
+        wait = self.store.take(key, rate, burst)
+        if wait > 0:
+            RATE_LIMITED.inc(typ)
+            raise RateLimitExceeded(key, wait)
+
+    def _get_address_key(self, typ, address):
+        return '%s:%s:%s' % (self.ADDRESS_TYPE, typ, address)
+
+    def acquire_address(self, typ, address):
+        """Counts an unauthenticated request against its remote address.
+        @type typ: str
+        @param typ: client or resource
+        @type address: str
+        @param address: remote address
+        @raise RateLimitExceeded: if the limit has been reached
+        """
+        self._take(self.ADDRESS_TYPE, self._get_address_key(typ, address),
+                   self.rate, self.burst)
+
+    def _get_failure_key(self, typ, address, presented_id):
+        return '%s:%s:%s:%s' % (self.FAILURE_TYPE, typ, address, presented_id)
+
+    def check_failures(self, typ, address, presented_id):
+        """Checks the limit of failed authentications for an ID presented
+        from an address, without counting the request.
+        @type typ: str
+        @param typ: client or resource
+        @type address: str
+        @param address: remote address
+        @type presented_id: str
+        @param presented_id: ID presented, before it is authenticated
+        @raise RateLimitExceeded: if the limit has been reached
+        """
+        key = self._get_failure_key(typ, address, presented_id)
+        wait = self.store.peek(key, self.rate, self.burst)
+        if wait > 0:
+            RATE_LIMITED.inc(self.FAILURE_TYPE)
+            raise RateLimitExceeded(key, wait)
+
+    def record_failure(self, typ, address, presented_id):
+        """Counts a failed authentication of an ID presented from an
+        address.  Later requests are refused by check_failures once the limit
+        is reached.
+        @type typ: str
+        @param typ: client or resource
+        @type address: str
+        @param address: remote address
+        @type presented_id: str
+        @param presented_id: ID presented, before it is authenticated
+        """
+        self.store.take(self._get_failure_key(typ, address, presented_id),
+                        self.rate, self.burst)
+
+    def acquire(self, typ, entity_id):
+        """Counts a request against an authenticated client or resource.
+        @type typ: str
+        @param typ: client or resource
+        @type entity_id: str
+        @param entity_id: client or resource ID
+        @raise RateLimitExceeded: if the limit has been reached
+        """
+        rate, burst = self._get_limit(typ, entity_id)
+        if rate > 0:
+            self._take(typ, '%s:%s' % (typ, entity_id), rate, burst)
+
+
+def retry_after_header(exc):
+    """
+    @type exc: RateLimitExceeded
+    @param exc: exception raised by the rate limiter
+    @rtype: tuple
+    @return: Retry-After header with the wait rounded up to whole seconds
+    """
+    return 'Retry-After', str(max(1, int(math.ceil(exc.retry_after))))
@@ -0,0 +1,153 @@
+"""OAuth 2.0 WSGI server middleware - salted hashes of client and resource
+secrets
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "(C) 2026 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+__revision__ = "$Id$"
+
+import base64
+import getpass
+import hashlib
+import hmac
+import optparse
+import os
+import struct
+
+from ndg.oauth.server.lib.utils.secure_compare import compare_digest
+
+HASH_ALGORITHM = 'pbkdf2_sha256'
+DEFAULT_ITERATIONS = 100000
+SALT_LENGTH = 16
+SEPARATOR = '$'
+
+# Made on first use by get_dummy_hash
+_dummy_hash = None
+
+if hasattr(hashlib, 'pbkdf2_hmac'):
+    def _pbkdf2_sha256(secret, salt, iterations):
+        return hashlib.pbkdf2_hmac('sha256', secret, salt, iterations)
+
+else: # Python < 2.7.8
+    def _pbkdf2_sha256(secret, salt, iterations):
+        """PBKDF2 with HMAC-SHA256 for a single output block"""
+        mac = hmac.new(secret, digestmod=hashlib.sha256)
+
+        def prf(data):
+            h = mac.copy()
+            h.update(data)
+            return h.digest()
+
+        u = prf(salt + struct.pack('>I', 1))
+        result = [ord(c) for c in u]
+        for _ in xrange(iterations - 1):
+            u = prf(u)
+            for i, c in enumerate(u):
+                result[i] ^= ord(c)
+        return ''.join([chr(i) for i in result])
+
+
+def _to_str(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+def hash_secret(secret, iterations=DEFAULT_ITERATIONS, salt=None):
+    """Makes a salted hash of a secret for storage in a register file.
+    @type secret: str
+    @param secret: secret
+    @type iterations: int
+    @param iterations: number of PBKDF2 iterations
+    @type salt: str
+    @param salt: salt - a random salt is used if this isn't set
+    @rtype: str
+    @return: hash in the form pbkdf2_sha256$<iterations>$<salt>$<hash>
+    """
+    if salt is None:
+        salt = os.urandom(SALT_LENGTH)
+
+    secret = _to_str(secret)
+    digest = _pbkdf2_sha256(secret, salt, iterations)
+    return SEPARATOR.join([HASH_ALGORITHM, str(iterations),
+                           base64.b64encode(salt), base64.b64encode(digest)])
+
+
+def is_hashed_secret(value):
+    """
+    @type value: str
+    @param value: secret as held in a register
+    @rtype: bool
+    @return: True if value is a hash made by hash_secret
+    """
+    return bool(value) and value.startswith(HASH_ALGORITHM + SEPARATOR)
+
+
+def get_dummy_hash():
+    """Gets a hash of a random secret made with the default parameters.  A
+    secret presented with an unknown ID is checked against it so that the
+    check takes as long as for a registered ID and IDs can't be found by
+    timing.
+    @rtype: str
+    @return: hash in the form made by hash_secret
+    """
+    global _dummy_hash
+    if _dummy_hash is None:
+        _dummy_hash = hash_secret(os.urandom(SALT_LENGTH))
+    return _dummy_hash
+
+
+def verify_secret(secret, stored_secret):
+    """Checks a secret against that held in a register, which may be a hash
+    made by hash_secret or, for compatibility with existing registers, the
+    secret itself.
+    @type secret: str
+    @param secret: secret to check
+    @type stored_secret: str
+    @param stored_secret: secret or secret hash held in the register
+    @rtype: bool
+    @return: True if the secret matches
+    """
+    if not secret or not stored_secret:
+        return False
+
+    secret = _to_str(secret)
+    stored_secret = _to_str(stored_secret)
+    if not is_hashed_secret(stored_secret):
+        return compare_digest(secret, stored_secret)
+
+    try:
+        _, iterations, salt, digest = stored_secret.split(SEPARATOR)
+        iterations = int(iterations)
+        salt = base64.b64decode(salt)
+        digest = base64.b64decode(digest)
+    except (ValueError, TypeError):
+        return False
+
+    return compare_digest(_pbkdf2_sha256(secret, salt, iterations), digest)
+
+
+def main():
+    """Prints the hash of a secret for use as the secret option in a client
+    or resource register file.
+    """
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option("-i",
+                      "--iterations",
+                      dest="iterations",
+                      default=DEFAULT_ITERATIONS,
+                      type='int',
+                      help="Number of PBKDF2 iterations")
+    opt = parser.parse_args()[0]
+
+    secret = getpass.getpass('Secret: ')
+    if secret != getpass.getpass('Confirm secret: '):
+        parser.error('Secrets do not match')
+
+    print(hash_secret(secret, iterations=opt.iterations))
+
+
+if __name__ == '__main__':
+    main()
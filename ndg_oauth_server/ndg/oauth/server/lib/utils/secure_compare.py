@@ -0,0 +1,30 @@
+"""OAuth 2.0 WSGI server middleware - constant time comparison of secrets
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "(C) 2026 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+__revision__ = "$Id$"
+
+import hmac
+
+try:
+    compare_digest = hmac.compare_digest
+
+except AttributeError: # Python < 2.7.7
+    def compare_digest(a, b):
+        """Compares two strings in time independent of the position of the
+        first difference to avoid leaking information about secrets.
+        @type a: str
+        @type b: str
+        @rtype: bool
+        @return: True if the strings are equal
+        """
+        if len(a) != len(b):
+            return False
+
+        result = 0
+        for x, y in zip(a, b):
+            result |= ord(x) ^ ord(y)
+        return result == 0
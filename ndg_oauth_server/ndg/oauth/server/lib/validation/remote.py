@@ -0,0 +1,314 @@
+"""OAuth 2.0 WSGI server middleware - validation of access tokens by a remote
+authorization server
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "(C) 2026 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+__revision__ = "$Id$"
+
+from base64 import b64encode
+import httplib
+import json
+import logging
+import socket
+import ssl
+import threading
+import time
+import urllib
+import urlparse
+
+from ndg.oauth.server.lib.authorization_server import AuthorizationServer
+from ndg.oauth.server.lib.utils.rate_limiter import TOO_MANY_REQUESTS
+
+log = logging.getLogger(__name__)
+
+
+class ConnectionPoolError(Exception):
+    """Raised when no connection becomes free within the pool timeout"""
+
+
+class HTTPConnectionPool(object):
+    """
+    Pool of persistent connections to a single host.  Connections are kept
+    open between requests, relying on HTTP/1.1 keep-alive, and the number in
+    use at once is bounded.  A request on a connection which has been reused
+    is retried once on a new connection if it fails, since the server may
+    have closed an idle connection.
+    """
+    DEFAULT_TIMEOUT = 10.
+    DEFAULT_MAX_CONNECTIONS = 10
+
+    def __init__(self, host, port=None, scheme='https',
+                 timeout=DEFAULT_TIMEOUT,
+                 max_connections=DEFAULT_MAX_CONNECTIONS,
+                 pool_timeout=None, cert_file=None, key_file=None,
+                 ca_certs=None):
+        """
+        @type host: str
+        @param host: host name
+        @type port: int
+        @param port: port - defaults to that for the scheme
+        @type scheme: str
+        @param scheme: https or http
+        @type timeout: float
+        @param timeout: socket timeout in seconds for connecting and for
+        each read
+        @type max_connections: int
+        @param max_connections: maximum number of concurrent requests
+        @type pool_timeout: float
+        @param pool_timeout: time in seconds to wait for a free connection -
+        defaults to timeout
+        @type cert_file: str
+        @param cert_file: client certificate file for HTTPS connections
+        @type key_file: str
+        @param key_file: client private key file - if not set the key is read
+        from cert_file
+        @type ca_certs: str
+        @param ca_certs: file of CA certificates used to verify the server -
+        if not set the default CA certificates are used
+        """
+        if scheme not in ('http', 'https'):
+            raise ValueError('Expecting http or https scheme; got %r' % scheme)
+
+        self.host = host
+        self.port = port
+        self.scheme = scheme
+        self.timeout = float(timeout)
+        self.max_connections = int(max_connections)
+        if pool_timeout is None:
+            self.pool_timeout = self.timeout
+        else:
+            self.pool_timeout = float(pool_timeout)
+        self.cert_file = cert_file
+        self.key_file = key_file
+        self.ca_certs = ca_certs
+
+        self._ssl_context = None
+        self._idle = []
+        self._lock = threading.Lock()
+        self._semaphore = threading.BoundedSemaphore(self.max_connections)
+
+    def _get_ssl_context(self):
+        if self._ssl_context is None:
+            context = ssl.create_default_context(cafile=self.ca_certs)
+            if self.cert_file:
+                context.load_cert_chain(self.cert_file, self.key_file)
+            self._ssl_context = context
+        return self._ssl_context
+
+    def _new_connection(self):
+        if self.scheme == 'https':
+            return httplib.HTTPSConnection(self.host, self.port,
+                                           timeout=self.timeout,
+                                           context=self._get_ssl_context())
+        return httplib.HTTPConnection(self.host, self.port,
+                                      timeout=self.timeout)
+
+    def _acquire(self):
+        """Waits for a free slot up to the pool timeout, since
+        threading.Semaphore.acquire takes no timeout in Python 2.
+        """
+        deadline = time.time() + self.pool_timeout
+        delay = 0.0005
+        while not self._semaphore.acquire(False):
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise ConnectionPoolError('No connection to %s free after '
+                                          '%s seconds' % (self.host,
+                                                          self.pool_timeout))
+            delay = min(delay * 2, remaining, .05)
+            time.sleep(delay)
+
+    def request(self, method, path, body=None, headers=None):
+        """Makes a request on a pooled connection.
+        @type method: str
+        @param method: HTTP method
+        @type path: str
+        @param path: request path and query
+        @type body: str
+        @param body: request body
+        @type headers: dict
+        @param headers: request headers
+        @rtype: tuple
+        @return: (status, response body)
+        """
+        self._acquire()
+        try:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            reused = conn is not None
+            if conn is None:
+                conn = self._new_connection()
+
+            while True:
+                try:
+                    conn.request(method, path, body, headers or {})
+                    response = conn.getresponse()
+                    content = response.read()
+                except (httplib.HTTPException, socket.error):
+                    conn.close()
+                    if reused:
+                        # The server may have closed an idle connection -
+                        # retry once only, on a new connection
+                        log.debug("Retrying request to %s on a new "
+                                  "connection", self.host)
+                        reused = False
+                        conn = self._new_connection()
+                        continue
+                    raise
+
+                if response.will_close:
+                    conn.close()
+                else:
+                    with self._lock:
+                        self._idle.append(conn)
+
+                return response.status, content
+        finally:
+            self._semaphore.release()
+
+    def close(self):
+        """Closes the idle connections"""
+        with self._lock:
+            idle = self._idle
+            self._idle = []
+        for conn in idle:
+            conn.close()
+
+
+class RemoteAccessToken(object):
+    """Details of a token validated by a remote authorization server"""
+    __slots__ = ('token_id', 'user_identifier', 'scope', 'expires_at')
+
+    def __init__(self, token_id, user_identifier, scope=None,
+                 expires_at=None):
+        self.token_id = token_id
+        self.user_identifier = user_identifier
+        self.scope = scope
+        self.expires_at = expires_at
+
+
+class RemoteTokenValidator(object):
+    """
+    Validates access tokens with the check_token service of an authorization
+    server in another process, for resource servers which are deployed
+    separately from the authorization server.  The resource server
+    authenticates to the authorization server with a client certificate,
+    or with the ID and secret of its entry in the authorization server's
+    resource register, or both.
+
+    This provides the methods of
+    ndg.oauth.server.lib.authorization_server.AuthorizationServer used by the
+    resource server middleware.
+    """
+    STATUS_BY_ERROR = {
+        'invalid_request': httplib.BAD_REQUEST,
+        'invalid_token': httplib.FORBIDDEN,
+        'insufficient_scope': httplib.FORBIDDEN,
+        None: httplib.OK
+    }
+    UNAVAILABLE_ERROR = 'temporarily_unavailable'
+
+    def __init__(self, check_token_url, resource_id=None,
+                 resource_secret=None, **pool_kw):
+        """
+        @type check_token_url: str
+        @param check_token_url: URL of the authorization server's check_token
+        service
+        @type resource_id: str
+        @param resource_id: ID of the resource server in the authorization
+        server's resource register
+        @type resource_secret: str
+        @param resource_secret: resource server's secret
+        @type pool_kw: dict
+        @param pool_kw: HTTPConnectionPool keywords
+        """
+        url = urlparse.urlsplit(check_token_url)
+        if not url.hostname:
+            raise ValueError('Invalid check_token URL %r' % check_token_url)
+
+        self.check_token_url = check_token_url
+        self.path = url.path or '/'
+        self.pool = HTTPConnectionPool(url.hostname, url.port,
+                                       scheme=url.scheme, **pool_kw)
+        self.headers = {'Content-Type': 'application/x-www-form-urlencoded',
+                        'Accept': 'application/json'}
+        if resource_id:
+            self.headers['Authorization'] = 'Basic ' + b64encode(
+                                '%s:%s' % (resource_id, resource_secret or ''))
+
+    def get_request_access_token(self, request):
+        """Gets the bearer token from the Authorization header of a resource
+        request as for AuthorizationServer.get_request_access_token.
+        """
+        return AuthorizationServer.get_request_access_token(request)
+
+    def get_registered_token(self, request, scope=None):
+        """Checks that the token in a resource request is valid.
+        @type request: webob.Request
+        @param request: HTTP request object
+        @type scope: str
+        @param scope: required scope
+        @rtype: tuple: (RemoteAccessToken, int, str)
+        @return: tuple (token, HTTP status, error) as for
+        AuthorizationServer.get_registered_token
+        """
+        access_token, error = self.get_request_access_token(request)
+        if error is not None:
+            return None, httplib.BAD_REQUEST, error
+
+        return self.check_access_token(access_token, scope)
+
+    def check_access_token(self, access_token, scope=None):
+        """Checks a token with the authorization server.
+        @type access_token: basestring
+        @param access_token: access token
+        @type scope: str
+        @param scope: required scope
+        @rtype: tuple: (RemoteAccessToken, int, str)
+        @return: tuple (token, HTTP status, error).  If the authorization
+        server can't be reached or refuses the request because of its rate
+        limit, the error is temporarily_unavailable.
+        """
+        params = {'access_token': access_token}
+        if scope:
+            params['scope'] = scope
+
+        try:
+            status, content = self.pool.request('POST', self.path,
+                                                urllib.urlencode(params),
+                                                self.headers)
+            response = json.loads(content)
+            error = response.get('error')
+        except (httplib.HTTPException, socket.error, ConnectionPoolError,
+                ValueError, AttributeError), exc:
+            log.error("Error checking token with %r: %s",
+                      self.check_token_url, exc)
+            return None, httplib.SERVICE_UNAVAILABLE, self.UNAVAILABLE_ERROR
+
+        if status == TOO_MANY_REQUESTS or (error is None and
+                                           status != httplib.OK):
+            log.error("Error checking token with %r: HTTP status %d",
+                      self.check_token_url, status)
+            return None, httplib.SERVICE_UNAVAILABLE, self.UNAVAILABLE_ERROR
+
+        if error is not None:
+            return (None, self.STATUS_BY_ERROR.get(error, httplib.BAD_REQUEST),
+                    error)
+
+        expires_at = None
+        if response.get('expires_in') is not None:
+            expires_at = time.time() + response['expires_in']
+
+        user_identifier = response.get('user_name')
+        if isinstance(user_identifier, unicode):
+            user_identifier = user_identifier.encode('utf-8')
+
+        token = RemoteAccessToken(access_token, user_identifier, scope=scope,
+                                  expires_at=expires_at)
+        return token, httplib.OK, None
+
+    def close(self):
+        self.pool.close()
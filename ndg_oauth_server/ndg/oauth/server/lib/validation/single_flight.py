@@ -0,0 +1,90 @@
+"""OAuth 2.0 WSGI server middleware - coalescing of concurrent identical calls
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "(C) 2026 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+__revision__ = "$Id$"
+
+import sys
+import threading
+
+
+class _Flight(object):
+    """Call in progress for a key"""
+    __slots__ = ('event', 'result', 'exc_info')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.exc_info = None
+
+
+class SingleFlight(object):
+    """
+    Ensures that only one call is in progress at a time for a key.  Callers
+    which arrive while a call for the same key is in progress wait for it and
+    share its result, or its exception, rather than making their own call.
+    This limits the load on a token store or remote authorization server when
+    a client makes many requests at once with the same token.
+    """
+
+    def __init__(self, on_coalesce=None):
+        """
+        @type on_coalesce: callable
+        @param on_coalesce: function called with no arguments each time a
+        caller waits for a call in progress, e.g., to update a metric
+        """
+        self._on_coalesce = on_coalesce
+        self._flights = {}
+        self._lock = threading.Lock()
+
+        # Number of calls made and of callers which shared another's call
+        self.calls = 0
+        self.coalesced = 0
+
+    def do(self, key, func, *args, **kw):
+        """Calls a function unless a call for the key is already in progress,
+        in which case waits for that call.
+        @type key: hashable
+        @param key: key identifying equivalent calls
+        @type func: callable
+        @param func: function to call
+        @return: result of the call
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = _Flight()
+                self._flights[key] = flight
+                self.calls += 1
+                leader = True
+            else:
+                self.coalesced += 1
+                leader = False
+
+        if not leader:
+            if self._on_coalesce is not None:
+                self._on_coalesce()
+            flight.event.wait()
+            if flight.exc_info is not None:
+                raise flight.exc_info[0], flight.exc_info[1], \
+                    flight.exc_info[2]
+            return flight.result
+
+        try:
+            flight.result = func(*args, **kw)
+        except:
+            flight.exc_info = sys.exc_info()
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.event.set()
+
+        return flight.result
+
+    def __len__(self):
+        """Number of calls in progress"""
+        return len(self._flights)
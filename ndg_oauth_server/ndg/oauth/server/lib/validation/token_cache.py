@@ -0,0 +1,146 @@
+"""OAuth 2.0 WSGI server middleware - cache of access token validation results
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "(C) 2026 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+__revision__ = "$Id$"
+
+import logging
+import threading
+import time
+
+from ndg.oauth.server.lib.utils.lru_cache import LRUCache
+
+log = logging.getLogger(__name__)
+
+
+class ValidatedTokenCache(object):
+    """
+    Cache of the results of validating access tokens for required scopes, so
+    that a token used for many requests in a short time is only looked up
+    once.  Successful results are cached for the positive TTL or until the
+    token expires if that is sooner.  Failures due to an invalid token or
+    insufficient scope are cached for the shorter negative TTL.
+
+    Entries are held per token so that all the results for a token are
+    removed together by invalidate, which can be added as a revocation
+    listener to the access token register.  Revocation elsewhere, e.g., in
+    another process, takes effect after at most the positive TTL.
+    """
+    DEFAULT_SIZE = 10000
+    DEFAULT_POSITIVE_TTL = 30
+    DEFAULT_NEGATIVE_TTL = 5
+    NEGATIVE_ERRORS = ('invalid_token', 'insufficient_scope')
+
+    def __init__(self, size=DEFAULT_SIZE, positive_ttl=DEFAULT_POSITIVE_TTL,
+                 negative_ttl=DEFAULT_NEGATIVE_TTL):
+        """
+        @type size: int
+        @param size: maximum number of tokens for which results are cached.
+        Set to zero to disable the cache.
+
+        @type positive_ttl: int or float
+        @param positive_ttl: time in seconds for which successful validation
+        results are cached
+
+        @type negative_ttl: int or float
+        @param negative_ttl: time in seconds for which failures are cached
+        """
+        self.positive_ttl = float(positive_ttl)
+        self.negative_ttl = float(negative_ttl)
+        self._cache = LRUCache(size, ttl=max(self.positive_ttl,
+                                             self.negative_ttl))
+        self._lock = threading.Lock()
+
+        # Tokens revoked recently, so that a result for a validation which
+        # was in progress when the token was revoked isn't cached
+        self._revoked = LRUCache(size, ttl=self.positive_ttl)
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self):
+        return self._cache.max_size > 0
+
+    def get(self, token_id, scope):
+        """Gets a cached validation result.
+        @type token_id: basestring
+        @param token_id: access token
+        @type scope: basestring
+        @param scope: required scope
+        @rtype: tuple
+        @return: (token, status, error) as returned by
+        ndg.oauth.server.lib.authorization_server.AuthorizationServer.\
+get_registered_token or None if no result is cached
+        """
+        results = self._cache.get(token_id)
+        if results is not None:
+            entry = results.get(scope)
+            if entry is not None and entry[1] > time.time():
+                self.hits += 1
+                return entry[0]
+
+        self.misses += 1
+        return None
+
+    def set(self, token_id, scope, result):
+        """Caches a validation result.  Results for errors other than an
+        invalid token or insufficient scope, e.g., for a malformed request,
+        are not cached.
+        @type token_id: basestring
+        @param token_id: access token
+        @type scope: basestring
+        @param scope: required scope
+        @type result: tuple
+        @param result: (token, status, error)
+        """
+        token, _status, error = result
+        now = time.time()
+        if error is None:
+            expires = now + self.positive_ttl
+            expires_at = getattr(token, 'expires_at', None)
+            if expires_at is not None and expires_at < expires:
+                expires = expires_at
+        elif error in self.NEGATIVE_ERRORS:
+            expires = now + self.negative_ttl
+        else:
+            return
+
+        if expires <= now:
+            return
+
+        with self._lock:
+            if error is None and token_id in self._revoked:
+                return
+
+            results = self._cache.get(token_id)
+            if results is None:
+                results = {}
+            else:
+                # Results are replaced rather than modified so that readers
+                # don't need the lock.
+                results = dict([(k, v) for k, v in results.iteritems()
+                                if v[1] > now])
+            results[scope] = (result, expires)
+            self._cache.set(token_id, results, expires=max(
+                                    [v[1] for v in results.itervalues()]))
+
+    def invalidate(self, token_id):
+        """Removes the results for a token, e.g., when it is revoked.
+        @type token_id: basestring
+        @param token_id: access token
+        """
+        with self._lock:
+            self._cache.remove(token_id)
+            self._revoked.set(token_id, True)
+        log.debug("Removed cached validation results for token %s", token_id)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self._revoked.clear()
+
+    def __len__(self):
+        return len(self._cache)
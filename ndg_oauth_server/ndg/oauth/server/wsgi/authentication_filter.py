@@ -18,6 +18,8 @@ from webob import Request
 from ndg.oauth.server.lib.register.client import ClientRegister
 from ndg.oauth.server.lib.register.client_authorization import (
                             ClientAuthorization, ClientAuthorizationRegister)
+from ndg.oauth.server.lib.register.client_authorization_store import \
+                                                            get_shared_store
 from ndg.oauth.server.lib.render.configuration import RenderingConfiguration
 from ndg.oauth.server.lib.render.factory import callModuleObject
 from ndg.oauth.server.lib.render.renderer_interface import RendererInterface
@@ -34,8 +36,11 @@ class AuthenticationFormMiddleware(object):
     AUTHENTICATION_CANCELLED_OPTION = 'login_cancelled'
     AUTHENTICATION_FORM_OPTION = 'login_form'
     BASE_URL_PATH_OPTION = 'base_url_path'
+    CLIENT_AUTHORIZATION_STORE_OPTION = 'client_authorization_store'
+    CLIENT_AUTHORIZATION_STORE_FILE_OPTION = 'client_authorization_store_file'
     CLIENT_REGISTER_OPTION = 'client_register'
     COMBINED_AUTHORIZATION_OPTION = 'combined_authorization'
+    REGISTER_FILE_RELOAD_INTERVAL_OPTION = 'register_file_reload_interval'
     RENDERER_CLASS_OPTION = 'renderer_class'
     RETURN_URL_PARAM_OPTION = 'return_url_param'
     SESSION_KEY_OPTION = 'session_key_name'
@@ -47,6 +52,8 @@ class AuthenticationFormMiddleware(object):
     PROPERTY_DEFAULTS = {
         BASE_URL_PATH_OPTION: '/authentication',
         COMBINED_AUTHORIZATION_OPTION: 'True',
+        REGISTER_FILE_RELOAD_INTERVAL_OPTION: \
+                                        ClientRegister.DEFAULT_RELOAD_INTERVAL,
         RENDERER_CLASS_OPTION: 'ndg.oauth.server.lib.render.genshi_renderer.GenshiRenderer',
         RETURN_URL_PARAM_OPTION: 'returnurl',
         SESSION_KEY_OPTION: 'beaker.session.oauth2authorization'
@@ -93,7 +100,15 @@ class AuthenticationFormMiddleware(object):
                                                     prefix + self.LAYOUT_PREFIX,
                                                     local_conf)
         self._set_configuration(prefix, local_conf)
-        self.client_register = ClientRegister(self.client_register_file)
+        self.client_register = ClientRegister.get_shared(
+                    self.client_register_file,
+                    reload_interval=self.register_file_reload_interval)
+        if self.client_authorization_store_backend:
+            self.client_authorization_store = get_shared_store(
+                                    self.client_authorization_store_backend,
+                                    self.client_authorization_store_file)
+        else:
+            self.client_authorization_store = None
         self.renderer = callModuleObject(self.renderer_class,
                                          objectName=None, moduleFilePath=None, 
                                          objectType=RendererInterface,
@@ -260,16 +275,22 @@ class AuthenticationFormMiddleware(object):
         @type session: Beaker SessionObject
         @param session: session data
         """
-        client_authorizations = session.setdefault(
-                                self.CLIENT_AUTHORIZATIONS_SESSION_KEY,
-                                ClientAuthorizationRegister())
         client_id = req.params.get('client_id')
         scope = req.params.get('scope')
         log.debug(
             "Adding client authorization for client_id: %s  scope: %s  user: %s",
             client_id, scope, username)
-        client_authorizations.add_client_authorization(
-                        ClientAuthorization(username, client_id, scope, True))
+        client_authorization = ClientAuthorization(username, client_id, scope,
+                                                   True)
+        if self.client_authorization_store is not None:
+            self.client_authorization_store.add_client_authorization(
+                                                        client_authorization)
+            return
+
+        client_authorizations = session.setdefault(
+                                self.CLIENT_AUTHORIZATIONS_SESSION_KEY,
+                                ClientAuthorizationRegister())
+        client_authorizations.add_client_authorization(client_authorization)
         session[self.CLIENT_AUTHORIZATIONS_SESSION_KEY] = client_authorizations
         log.debug("### client_auth: %s", client_authorizations.__repr__())
         session.save()
@@ -292,9 +313,16 @@ class AuthenticationFormMiddleware(object):
                                                 cls.BASE_URL_PATH_OPTION)
         self.client_register_file = cls._get_config_option(prefix, local_conf,
                                                     cls.CLIENT_REGISTER_OPTION)
+        self.client_authorization_store_backend = cls._get_config_option(
+                    prefix, local_conf, cls.CLIENT_AUTHORIZATION_STORE_OPTION)
+        self.client_authorization_store_file = cls._get_config_option(
+                    prefix, local_conf,
+                    cls.CLIENT_AUTHORIZATION_STORE_FILE_OPTION)
         combined_authorization = cls._get_config_option(prefix, local_conf,
                                             cls.COMBINED_AUTHORIZATION_OPTION)
         self.combined_authorization = (combined_authorization.lower() == 'true')
+        self.register_file_reload_interval = cls._get_config_option(
+                    prefix, local_conf, cls.REGISTER_FILE_RELOAD_INTERVAL_OPTION)
         self.renderer_class = cls._get_config_option(prefix, local_conf,
                                                      cls.RENDERER_CLASS_OPTION)
         self.return_url_param = cls._get_config_option(prefix, local_conf,
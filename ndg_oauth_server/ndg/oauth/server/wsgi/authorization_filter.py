@@ -15,6 +15,8 @@ from webob import Request
 from ndg.oauth.server.lib.register.client import ClientRegister
 from ndg.oauth.server.lib.register.client_authorization import (
                             ClientAuthorization, ClientAuthorizationRegister)
+from ndg.oauth.server.lib.register.client_authorization_store import \
+                                                            get_shared_store
 from ndg.oauth.server.lib.render.configuration import RenderingConfiguration
 from ndg.oauth.server.lib.render.factory import callModuleObject
 from ndg.oauth.server.lib.render.renderer_interface import RendererInterface
@@ -36,8 +38,11 @@ class Oauth2AuthorizationMiddleware(object):
     # Configuration options
     BASE_URL_PATH_OPTION = 'base_url_path'
     CLIENT_AUTHORIZATION_FORM_OPTION = 'client_authorization_form'
+    CLIENT_AUTHORIZATION_STORE_OPTION = 'client_authorization_store'
+    CLIENT_AUTHORIZATION_STORE_FILE_OPTION = 'client_authorization_store_file'
     CLIENT_AUTHORIZATIONS_KEY_OPTION = 'client_authorizations_key'
     CLIENT_REGISTER_OPTION = 'client_register'
+    REGISTER_FILE_RELOAD_INTERVAL_OPTION = 'register_file_reload_interval'
     RENDERER_CLASS_OPTION = 'renderer_class'
     SESSION_KEY_OPTION = 'session_key_name'
     USER_IDENTIFIER_KEY_OPTION = 'user_identifier_key'
@@ -48,6 +53,8 @@ class Oauth2AuthorizationMiddleware(object):
     # Configuration option defaults
     PROPERTY_DEFAULTS = {
         BASE_URL_PATH_OPTION: 'client_authorization',
+        REGISTER_FILE_RELOAD_INTERVAL_OPTION: \
+                                        ClientRegister.DEFAULT_RELOAD_INTERVAL,
         RENDERER_CLASS_OPTION: \
             'ndg.oauth.server.lib.render.genshi_renderer.GenshiRenderer',
         SESSION_KEY_OPTION: 'beaker.session.oauth2authorization',
@@ -93,7 +100,15 @@ class Oauth2AuthorizationMiddleware(object):
                                                     prefix + self.LAYOUT_PREFIX,
                                                     local_conf)
         self._set_configuration(prefix, local_conf)
-        self.client_register = ClientRegister(self.client_register_file)
+        self.client_register = ClientRegister.get_shared(
+                    self.client_register_file,
+                    reload_interval=self.register_file_reload_interval)
+        if self.client_authorization_store_backend:
+            self.client_authorization_store = get_shared_store(
+                                    self.client_authorization_store_backend,
+                                    self.client_authorization_store_file)
+        else:
+            self.client_authorization_store = None
         self.renderer = callModuleObject(self.renderer_class,
                                          objectName=None, moduleFilePath=None, 
                                          objectType=RendererInterface,
@@ -146,6 +161,20 @@ class Oauth2AuthorizationMiddleware(object):
                             ])
             return [response]
 
+    def _get_client_authorizations(self, session):
+        """
+        Gets the authorizations granted by the user: the client authorization
+        store if one is configured, otherwise the register in the session.
+        @type session: Beaker SessionObject
+        @param session: session data
+
+        @rtype: ClientAuthorizationRegister or client authorization store
+        @return: authorizations or None if there are none in the session
+        """
+        if self.client_authorization_store is not None:
+            return self.client_authorization_store
+        return session.get(self.CLIENT_AUTHORIZATIONS_SESSION_KEY)
+
     def _set_client_authorizations_in_environ(self, session, environ):
         """
         Sets the current authorizations currently granted by the user in
@@ -156,7 +185,7 @@ class Oauth2AuthorizationMiddleware(object):
         @type environ: dict
         @param environ: WSGI environment
         """
-        client_authorizations = session.get(self.CLIENT_AUTHORIZATIONS_SESSION_KEY)
+        client_authorizations = self._get_client_authorizations(session)
         if client_authorizations:
             log.debug("_set_client_authorizations_in_environ %r",
                       client_authorizations)
@@ -188,8 +217,7 @@ class Oauth2AuthorizationMiddleware(object):
         log.debug("Client authorization request for client_id: %s  scope: %s  "
                   "user: %s", client_id, scope, user)
 
-        client_authorizations = session.get(
-                                        self.CLIENT_AUTHORIZATIONS_SESSION_KEY)
+        client_authorizations = self._get_client_authorizations(session)
         client_authorized = None
         if client_authorizations:
             client_authorized = \
@@ -293,9 +321,6 @@ class Oauth2AuthorizationMiddleware(object):
             granted = False
 
         # Add authorization to those for the user.
-        client_authorizations = session.setdefault(
-                                        self.CLIENT_AUTHORIZATIONS_SESSION_KEY, 
-                                        ClientAuthorizationRegister())
         client_id = call_context['client_id']
         scope = call_context['scope']
         user = call_context['user']
@@ -304,11 +329,19 @@ class Oauth2AuthorizationMiddleware(object):
         
         client_authorization = ClientAuthorization(user, client_id, scope, 
                                                    granted)
-        client_authorizations.add_client_authorization(client_authorization)
-        
-        session[self.CLIENT_AUTHORIZATIONS_SESSION_KEY] = client_authorizations
-        log.debug("### client_auth: %r", client_authorizations)
-        session.save()
+        if self.client_authorization_store is not None:
+            self.client_authorization_store.add_client_authorization(
+                                                        client_authorization)
+        else:
+            client_authorizations = session.setdefault(
+                                        self.CLIENT_AUTHORIZATIONS_SESSION_KEY, 
+                                        ClientAuthorizationRegister())
+            client_authorizations.add_client_authorization(
+                                                        client_authorization)
+            session[self.CLIENT_AUTHORIZATIONS_SESSION_KEY] = \
+                                                        client_authorizations
+            log.debug("### client_auth: %r", client_authorizations)
+            session.save()
 
         original_url = call_context['original_url']
         log.debug("Redirecting to %s", original_url)
@@ -334,6 +367,10 @@ class Oauth2AuthorizationMiddleware(object):
                                             prefix, 
                                             local_conf, 
                                             cls.CLIENT_REGISTER_OPTION)
+        self.register_file_reload_interval = cls._get_config_option(
+                                            prefix,
+                                            local_conf,
+                                            cls.REGISTER_FILE_RELOAD_INTERVAL_OPTION)
         self.renderer_class = cls._get_config_option(
                                             prefix, 
                                             local_conf, 
@@ -348,6 +385,14 @@ class Oauth2AuthorizationMiddleware(object):
         self.client_authorizations_env_key = cls._get_config_option(prefix, 
                                             local_conf, 
                                             cls.CLIENT_AUTHORIZATIONS_KEY_OPTION)
+        self.client_authorization_store_backend = cls._get_config_option(
+                                            prefix,
+                                            local_conf,
+                                            cls.CLIENT_AUTHORIZATION_STORE_OPTION)
+        self.client_authorization_store_file = cls._get_config_option(
+                                            prefix,
+                                            local_conf,
+                                            cls.CLIENT_AUTHORIZATION_STORE_FILE_OPTION)
         self.user_identifier_env_key = cls._get_config_option(
                                                 prefix, 
                                                 local_conf, 
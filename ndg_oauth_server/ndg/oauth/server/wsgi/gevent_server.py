@@ -0,0 +1,105 @@
+"""OAuth 2.0 WSGI server middleware - serves a Paste Deploy application with
+gevent
+"""
+__author__ = "P J Kershaw"
+__date__ = "18/10/26"
+__copyright__ = "(C) 2026 Science and Technology Facilities Council"
+__license__ = "BSD - see LICENSE file in top-level directory"
+__contact__ = "Philip.Kershaw@stfc.ac.uk"
+__revision__ = "$Id$"
+
+import optparse
+from os import path
+
+DEFAULT_HOST = '0.0.0.0'
+DEFAULT_PORT = 5000
+DEFAULT_MAX_CONNECTIONS = 10000
+DEFAULT_THREADPOOL_SIZE = 10
+
+
+def main():
+    """Serves the application in a Paste Deploy configuration file, such as
+    the authorization server examples, with gevent.  Each connection is
+    handled by a greenlet rather than a thread so that one process can hold
+    many thousands of connections, most of them waiting on the network.
+
+    The standard library is patched by gevent before the application is
+    loaded.  Calls which block without yielding, i.e., MyProxy logons,
+    register storage operations, unless the register threadpool option is set
+    to False, and SQLite database access, are made in gevent's thread pool.
+    gevent must be installed.
+    """
+    parser = optparse.OptionParser(usage='%prog [options] <config file>')
+    parser.add_option("-H",
+                      "--host",
+                      dest="host",
+                      default=DEFAULT_HOST,
+                      help="Address to listen on")
+    parser.add_option("-p",
+                      "--port",
+                      dest="port",
+                      default=DEFAULT_PORT,
+                      type='int',
+                      help="Port number to listen on")
+    parser.add_option("-c",
+                      "--cert-file",
+                      dest="cert_file",
+                      default=None,
+                      help="SSL certificate file - serve HTTP if not set")
+    parser.add_option("-k",
+                      "--private-key-file",
+                      dest="key_file",
+                      default=None,
+                      help="SSL private key file - defaults to the "
+                           "certificate file")
+    parser.add_option("-m",
+                      "--max-connections",
+                      dest="max_connections",
+                      default=DEFAULT_MAX_CONNECTIONS,
+                      type='int',
+                      help="Maximum number of concurrent connections")
+    parser.add_option("-t",
+                      "--threadpool-size",
+                      dest="threadpool_size",
+                      default=DEFAULT_THREADPOOL_SIZE,
+                      type='int',
+                      help="Number of threads for blocking calls")
+
+    opt, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error('A configuration file must be specified')
+
+    try:
+        from gevent import monkey
+    except ImportError:
+        parser.error('gevent is required: install it with "pip install '
+                     'gevent"')
+
+    # Patch before anything else creates sockets or threads.
+    monkey.patch_all()
+
+    import gevent
+    from gevent.pool import Pool
+    from gevent.pywsgi import WSGIServer
+    from paste.deploy import loadapp
+    from paste.script.util.logging_config import fileConfig
+
+    config_filepath = path.abspath(args[0])
+    fileConfig(config_filepath,
+               defaults={'here': path.dirname(config_filepath)})
+    app = loadapp('config:%s' % config_filepath)
+
+    gevent.get_hub().threadpool.maxsize = opt.threadpool_size
+
+    ssl_args = {}
+    if opt.cert_file:
+        ssl_args = {'certfile': opt.cert_file,
+                    'keyfile': opt.key_file or opt.cert_file}
+
+    server = WSGIServer((opt.host, opt.port), app,
+                        spawn=Pool(opt.max_connections), **ssl_args)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -10,8 +10,11 @@ __license__ = "BSD - see LICENSE file in top-level directory"
 __contact__ = "Philip.Kershaw@stfc.ac.uk"
 __revision__ = "$Id$"
 
+import atexit
 import httplib
+import json
 import logging
+import time
 import urllib
 import urlparse
 
@@ -19,6 +22,9 @@ from webob import Request
 
 from ndg.oauth.server.lib.access_token.bearer_token_generator import \
     BearerTokenGenerator
+from ndg.oauth.server.lib.access_token.signed_token_generator import \
+    SignedTokenGenerator
+from ndg.oauth.server.lib.access_token.signing_key_set import SigningKeySet
 from ndg.oauth.server.lib.authenticate.certificate_authenticator \
     import CertificateAuthenticator
 from ndg.oauth.server.lib.authenticate.noop_authenticator import \
@@ -29,10 +35,33 @@ from ndg.oauth.server.lib.authorization_server import AuthorizationServer
 from ndg.oauth.server.lib.authorize.authorizer_storing_identifier import \
     AuthorizerStoringIdentifier
 from ndg.oauth.server.lib.register.client import ClientRegister
+from ndg.oauth.server.lib.register.client_authorization_store import \
+                                                            get_shared_store
+from ndg.oauth.server.lib.register.file_register import (FileRegister,
+                                                         FileRegisterReloader)
+from ndg.oauth.server.lib.register.register_sweeper import RegisterSweeper
 from ndg.oauth.server.lib.register.resource import ResourceRegister
+import ndg.oauth.server.lib.register.scopeutil as scopeutil
+from ndg.oauth.server.lib.utils import metrics
+from ndg.oauth.server.lib.utils.phase_timer import PhaseTimer
+from ndg.oauth.server.lib.utils.rate_limiter import (RateLimiter,
+                                                     RateLimitExceeded,
+                                                     TokenBucketStore,
+                                                     TOO_MANY_REQUESTS,
+                                                     TOO_MANY_REQUESTS_STATUS,
+                                                     retry_after_header)
 
 log = logging.getLogger(__name__)
 
+REQUESTS = metrics.counter(
+        'ndg_oauth_requests_total',
+        'Requests to the OAuth server endpoints by HTTP status',
+        ('endpoint', 'status'))
+REQUEST_DURATION = metrics.histogram(
+        'ndg_oauth_request_duration_seconds',
+        'Time taken to handle requests to the OAuth server endpoints',
+        ('endpoint',))
+
 
 class Oauth2ServerMiddleware(object):
     """
@@ -52,43 +81,91 @@ class Oauth2ServerMiddleware(object):
     
     # Configuration options
     ACCESS_TOKEN_LIFETIME_OPTION = 'access_token_lifetime'
+    ACCESS_TOKEN_SIGNING_KEYS_OPTION = 'access_token_signing_keys'
+    ACCESS_TOKEN_SIGNING_KEYS_RELOAD_INTERVAL_OPTION = \
+                                    'access_token_signing_keys_reload_interval'
     ACCESS_TOKEN_TYPE_OPTION = 'access_token_type'
     AUTHORIZATION_GRANT_LIFETIME_OPTION = 'authorization_grant_lifetime'
     BASE_URL_PATH_OPTION = 'base_url_path'
     CERTIFICATE_REQUEST_PARAMETER_OPTION = 'certificate_request_parameter'
+    CHECK_TOKENS_MAX_BATCH_OPTION = 'check_tokens_max_batch'
     CLIENT_AUTHENTICATION_METHOD_OPTION = 'client_authentication_method'
+    CLIENT_AUTHORIZATION_STORE_OPTION = 'client_authorization_store'
+    CLIENT_AUTHORIZATION_STORE_FILE_OPTION = 'client_authorization_store_file'
     CLIENT_AUTHORIZATION_URL_OPTION = 'client_authorization_url'
     CLIENT_AUTHORIZATIONS_KEY_OPTION = 'client_authorizations_key'
     CLIENT_REGISTER_OPTION = 'client_register'
+    METRICS_PATH_OPTION = 'metrics_path'
     RESOURCE_AUTHENTICATION_METHOD_OPTION = 'resource_authentication_method'
     RESOURCE_REGISTER_OPTION = 'resource_register'
     MYPROXY_CLIENT_KEY_OPTION = 'myproxy_client_key'
     MYPROXY_GLOBAL_PASSWORD_OPTION = 'myproxy_global_password'
+    RATE_LIMIT_OPTION = 'rate_limit'
+    RATE_LIMIT_BACKEND_OPTION = 'rate_limit_backend'
+    RATE_LIMIT_BURST_OPTION = 'rate_limit_burst'
+    RATE_LIMIT_FILE_OPTION = 'rate_limit_file'
+    RATE_LIMIT_MAX_KEYS_OPTION = 'rate_limit_max_keys'
+    PASSWORD_AUTHENTICATION_CACHE_SIZE_OPTION = \
+                                        'password_authentication_cache_size'
+    PASSWORD_AUTHENTICATION_CACHE_EXPIRE_OPTION = \
+                                        'password_authentication_cache_expire'
+    REGISTER_FILE_RELOAD_INTERVAL_OPTION = 'register_file_reload_interval'
+    REGISTER_FILE_RELOAD_ON_SIGHUP_OPTION = 'register_file_reload_on_sighup'
+    REGISTER_SWEEP_INTERVAL_OPTION = 'register_sweep_interval'
+    REGISTER_SWEEP_BATCH_SIZE_OPTION = 'register_sweep_batch_size'
+    REGISTER_SWEEP_MAX_OPTION = 'register_sweep_max'
+    SCOPE_WILDCARDS_OPTION = 'scope_wildcards'
+    SERVER_TIMING_OPTION = 'server_timing'
     USER_IDENTIFIER_KEY_OPTION = 'user_identifier_key'
     USER_IDENTIFIER_GRANT_DATA_KEY = 'user_identifier'
 
+    REGISTER_SWEEPER_STOP_TIMEOUT = 5.
+
     AUTHORISATION_SERVER_ENVIRON_KEYNAME = \
                                         'ndg.oauth.server.authorisation.server'
     
     # Configuration option defaults
     PROPERTY_DEFAULTS = {
         ACCESS_TOKEN_LIFETIME_OPTION: 86400,
+        ACCESS_TOKEN_SIGNING_KEYS_RELOAD_INTERVAL_OPTION: \
+                                        SigningKeySet.DEFAULT_RELOAD_INTERVAL,
         ACCESS_TOKEN_TYPE_OPTION: 'bearer',
         AUTHORIZATION_GRANT_LIFETIME_OPTION: 600,
         BASE_URL_PATH_OPTION: '',
         CERTIFICATE_REQUEST_PARAMETER_OPTION: 'certificate_request',
+        CHECK_TOKENS_MAX_BATCH_OPTION: \
+                            AuthorizationServer.DEFAULT_CHECK_TOKENS_MAX_BATCH,
         CLIENT_AUTHENTICATION_METHOD_OPTION: 'certificate',
         CLIENT_AUTHORIZATION_URL_OPTION: '/client_authorization/authorize',
         CLIENT_AUTHORIZATIONS_KEY_OPTION: 'client_authorizations',
+        METRICS_PATH_OPTION: None,
         RESOURCE_AUTHENTICATION_METHOD_OPTION: 'none',
         MYPROXY_CLIENT_KEY_OPTION: \
         'myproxy.server.wsgi.middleware.MyProxyClientMiddleware.myProxyClient',
+        PASSWORD_AUTHENTICATION_CACHE_SIZE_OPTION: \
+                                    PasswordAuthenticator.DEFAULT_CACHE_SIZE,
+        RATE_LIMIT_OPTION: 0,
+        RATE_LIMIT_BACKEND_OPTION: 'memory',
+        RATE_LIMIT_BURST_OPTION: None,
+        RATE_LIMIT_FILE_OPTION: None,
+        RATE_LIMIT_MAX_KEYS_OPTION: TokenBucketStore.DEFAULT_MAX_KEYS,
+        PASSWORD_AUTHENTICATION_CACHE_EXPIRE_OPTION: \
+                                    PasswordAuthenticator.DEFAULT_CACHE_EXPIRE,
+        REGISTER_FILE_RELOAD_INTERVAL_OPTION: \
+                                        FileRegister.DEFAULT_RELOAD_INTERVAL,
+        REGISTER_FILE_RELOAD_ON_SIGHUP_OPTION: 'False',
+        REGISTER_SWEEP_INTERVAL_OPTION: RegisterSweeper.DEFAULT_INTERVAL,
+        REGISTER_SWEEP_BATCH_SIZE_OPTION: RegisterSweeper.DEFAULT_BATCH_SIZE,
+        REGISTER_SWEEP_MAX_OPTION: RegisterSweeper.DEFAULT_MAX_PER_SWEEP,
+        SCOPE_WILDCARDS_OPTION: 'False',
+        SERVER_TIMING_OPTION: 'False',
         USER_IDENTIFIER_KEY_OPTION: 'REMOTE_USER'
     }
     method = {
         '/access_token': 'access_token',
         '/authorize': 'authorize',
         '/check_token': 'check_token',
+        '/check_tokens': 'check_tokens',
         '/request_certificate': 'request_certificate'
     }
 
@@ -115,11 +192,33 @@ class Oauth2ServerMiddleware(object):
         self._app = app
         conf = self._set_configuration(prefix, local_conf)
 
+        # Wildcard scope matching applies to the whole process, including the
+        # client authorization middleware.
+        if self.scope_wildcards:
+            scopeutil.setWildcardScopes(True)
+
         if self.access_token_type == 'bearer':
             # Simple bearer token configuration.
             access_token_generator = BearerTokenGenerator(
                                         self.access_token_lifetime_seconds, 
                                         self.access_token_type)
+            access_token_verifier = None
+        elif self.access_token_type == 'signed':
+            # Self-contained bearer tokens which are validated by checking
+            # their signature rather than looking them up in the register.
+            if not self.access_token_signing_keys:
+                raise ValueError("%s must be set for %s = signed" %
+                                 (self.ACCESS_TOKEN_SIGNING_KEYS_OPTION,
+                                  self.ACCESS_TOKEN_TYPE_OPTION))
+            key_set = SigningKeySet(
+                        self.access_token_signing_keys,
+                        reload_interval=
+                            self.access_token_signing_keys_reload_interval)
+            access_token_generator = SignedTokenGenerator(
+                                        self.access_token_lifetime_seconds,
+                                        'bearer',
+                                        key_set=key_set)
+            access_token_verifier = access_token_generator
         else:
             raise ValueError("Invalid configuration value %s for %s" %
                              (self.access_token_type,
@@ -134,21 +233,75 @@ class Oauth2ServerMiddleware(object):
 
         # Determine client authentication type. A 'none' options is allowed so
         # that development/testing can be performed without running on Apache.
-        client_register = ClientRegister(self.client_register_file)
+        # The client and resource registers are shared with other middleware
+        # in the process using the same files and reloaded when the files
+        # change.
+        client_register = ClientRegister.get_shared(
+                    self.client_register_file,
+                    reload_interval=self.register_file_reload_interval)
         client_authenticator = self._get_authenticator(
             self.client_authentication_method, client_register,
             'client', self.CLIENT_AUTHENTICATION_METHOD_OPTION)
 
         # same for resource authentication type.
-        resource_register = ResourceRegister(self.resource_register_file)
+        resource_register = ResourceRegister.get_shared(
+                    self.resource_register_file,
+                    reload_interval=self.register_file_reload_interval)
+        if self.register_file_reload_on_sighup:
+            FileRegisterReloader.get_instance().install_signal_handler()
         resource_authenticator = self._get_authenticator(
             self.resource_authentication_method, resource_register,
             'resource', self.RESOURCE_AUTHENTICATION_METHOD_OPTION)
 
+        # Requests to the token endpoints are limited for each client and
+        # resource, with limits for individual clients and resources set in
+        # the registers.
+        if float(self.rate_limit) > 0:
+            rate_limiter = RateLimiter(
+                self.rate_limit,
+                burst=self.rate_limit_burst,
+                backend=self.rate_limit_backend,
+                config={'file': self.rate_limit_file,
+                        'max_keys': self.rate_limit_max_keys},
+                registers={'client': client_register,
+                           'resource': resource_register})
+        else:
+            rate_limiter = None
+
+        # Decisions made by users to authorize clients are looked up in a
+        # store shared with the authorization filter if one is configured,
+        # otherwise in the session register which that filter sets in environ
+        if self.client_authorization_store_backend:
+            self.client_authorization_store = get_shared_store(
+                                    self.client_authorization_store_backend,
+                                    self.client_authorization_store_file)
+        else:
+            self.client_authorization_store = None
+
         self._authorizationServer = AuthorizationServer(
             client_register, authorizer, client_authenticator,
             resource_register, resource_authenticator,
-            access_token_generator, conf)
+            access_token_generator, conf,
+            access_token_verifier=access_token_verifier,
+            rate_limiter=rate_limiter)
+
+        # Expired tokens and grants are removed in the background.  An
+        # interval of zero disables this, e.g., where the registers are swept
+        # by a separate process.
+        if float(self.register_sweep_interval) > 0:
+            self._register_sweeper = RegisterSweeper(
+                [self._authorizationServer.access_token_register,
+                 self._authorizationServer.authorization_grant_register],
+                interval=self.register_sweep_interval,
+                batch_size=self.register_sweep_batch_size,
+                max_per_sweep=self.register_sweep_max)
+            self._register_sweeper.start()
+
+            # Stop the thread before the interpreter starts to shut down.
+            atexit.register(self._register_sweeper.stop,
+                            self.REGISTER_SWEEPER_STOP_TIMEOUT)
+        else:
+            self._register_sweeper = None
 
     def _get_authenticator(self, name, register, typ, option_name):
         """Returns new authenticator by name"""
@@ -156,7 +309,10 @@ class Oauth2ServerMiddleware(object):
             return CertificateAuthenticator(typ, register)
             
         elif name == 'password':
-            return PasswordAuthenticator(typ, register)
+            return PasswordAuthenticator(
+                typ, register,
+                cache_size=int(self.password_authentication_cache_size),
+                cache_expire=float(self.password_authentication_cache_expire))
             
         elif name == 'none':
             return NoopAuthenticator(typ)
@@ -187,6 +343,9 @@ class Oauth2ServerMiddleware(object):
         environ[self.__class__.AUTHORISATION_SERVER_ENVIRON_KEYNAME
                 ] = self._authorizationServer
                 
+        if self.metrics_path and req.path_info == self.metrics_path:
+            return metrics.metrics_response(start_response)
+
         # Determine what operation the URL specifies.
         actionPath = None
         if req.path_info.startswith(self.base_path):
@@ -196,7 +355,7 @@ class Oauth2ServerMiddleware(object):
         if methodName:
             log.debug("Method: %s" % methodName)
             action = getattr(self, methodName)
-            return action(req, start_response)
+            return self._call_action(methodName, action, req, start_response)
 
         elif self._app is not None:
             log.debug("Delegating to lower filter/application.")
@@ -210,6 +369,26 @@ class Oauth2ServerMiddleware(object):
                             ])
             return [response]
 
+    def _call_action(self, name, action, req, start_response):
+        """Calls the method handling an endpoint, recording the response status
+        and the time taken.  Requests refused by the rate limiter get a 429
+        response.
+        """
+        status = []
+        def _start_response(status_str, headers, exc_info=None):
+            status.append(status_str.split(' ', 1)[0])
+            return start_response(status_str, headers, exc_info)
+
+        start = time.time()
+        try:
+            return action(req, _start_response)
+        except RateLimitExceeded, exc:
+            log.info("%s request refused: %s", name, exc)
+            return self._rate_limited_response(exc, _start_response)
+        finally:
+            REQUEST_DURATION.observe(time.time() - start, name)
+            REQUESTS.inc(name, status[-1] if status else '500')
+
     def authorize(self, req, start_response):
         """Handles OAuth 2 authorize request.
         @type req: webob.Request
@@ -284,7 +463,9 @@ class Oauth2ServerMiddleware(object):
         @type req: webob.Request
         @param req: HTTP request object
         """
-        client_authorizations = req.environ.get(
+        client_authorizations = self.client_authorization_store
+        if client_authorizations is None:
+            client_authorizations = req.environ.get(
                                             self.client_authorizations_env_key)
         client_id = req.params.get('client_id')
         scope = req.params.get('scope')
@@ -334,9 +515,11 @@ class Oauth2ServerMiddleware(object):
         @return: WSGI response
         """
         log.debug("access_token called")
+        timer = PhaseTimer('access_token')
         (response, 
          error_status, 
-         error_description) = self._authorizationServer.access_token(req)
+         error_description) = self._authorizationServer.access_token(
+                                                            req, timer=timer)
         if response is None:
             response = ''
         headers = [
@@ -345,6 +528,7 @@ class Oauth2ServerMiddleware(object):
             ('Content-length', str(len(response))),
             ('Pragma', 'no-store')
         ]
+        self._add_timing(timer, headers)
         status_str = self._get_http_status_string(
                                 error_status if error_status else httplib.OK)
         if error_status:
@@ -367,7 +551,9 @@ class Oauth2ServerMiddleware(object):
         @rtype: iterable
         @return: WSGI response
         """
-        response, error_status = self._authorizationServer.check_token(req)[0:2]
+        timer = PhaseTimer('check_token')
+        response, error_status = self._authorizationServer.check_token(
+                                                        req, timer=timer)[0:2]
         if response is None:
             response = ''
         headers = [
@@ -376,12 +562,70 @@ class Oauth2ServerMiddleware(object):
             ('Content-length', str(len(response))),
             ('Pragma', 'no-store')
         ]
+        self._add_timing(timer, headers)
         status_str = self._get_http_status_string(
                                 error_status if error_status else httplib.OK)
 
         start_response(status_str, headers)
         return [response]
 
+    def check_tokens(self, req, start_response):
+        """
+        Service to validate several bearer tokens in one request.
+        @type req: webob.Request
+        @param req: HTTP request object
+
+        @type start_response: 
+        @param start_response: WSGI start response function
+
+        @rtype: iterable
+        @return: WSGI response
+        """
+        response, error_status = self._authorizationServer.check_tokens(
+                            req, max_tokens=self.check_tokens_max_batch)[0:2]
+        headers = [
+            ('Content-Type', 'application/json; charset=UTF-8'),
+            ('Cache-Control', 'no-store'),
+            ('Content-length', str(len(response))),
+            ('Pragma', 'no-store')
+        ]
+        start_response(self._get_http_status_string(error_status), headers)
+        return [response]
+
+    @staticmethod
+    def _rate_limited_response(exc, start_response):
+        """Responds to a request refused by the rate limiter.
+        @type exc: ndg.oauth.server.lib.utils.rate_limiter.RateLimitExceeded
+        @param exc: exception raised by the rate limiter
+        @type start_response: 
+        @param start_response: WSGI start response function
+        @rtype: iterable
+        @return: WSGI response
+        """
+        response = json.dumps({'status': TOO_MANY_REQUESTS,
+                               'error': 'too_many_requests',
+                               'error_description': 'Rate limit exceeded'})
+        start_response(TOO_MANY_REQUESTS_STATUS, [
+            ('Content-Type', 'application/json; charset=UTF-8'),
+            ('Cache-Control', 'no-store'),
+            ('Content-length', str(len(response))),
+            ('Pragma', 'no-store'),
+            retry_after_header(exc)
+        ])
+        return [response]
+
+    def _add_timing(self, timer, headers):
+        """Records the phase timings of a request and adds a Server-Timing
+        header to the response if enabled.
+        @type timer: ndg.oauth.server.lib.utils.phase_timer.PhaseTimer
+        @param timer: timer for the request
+        @type headers: list
+        @param headers: response headers
+        """
+        total = timer.finish()
+        if self.server_timing:
+            headers.append(timer.server_timing_header(total))
+
     @staticmethod
     def _get_http_status_string(status):
         return ("%d %s" % (status, httplib.responses[status]))
@@ -427,16 +671,43 @@ class Oauth2ServerMiddleware(object):
                                 conf, cls.ACCESS_TOKEN_LIFETIME_OPTION)
         self.access_token_type = cls._get_config_option(
                                 conf, cls.ACCESS_TOKEN_TYPE_OPTION)
+        self.access_token_signing_keys = cls._get_config_option(
+                                conf, cls.ACCESS_TOKEN_SIGNING_KEYS_OPTION)
+        self.access_token_signing_keys_reload_interval = \
+            cls._get_config_option(
+                    conf, cls.ACCESS_TOKEN_SIGNING_KEYS_RELOAD_INTERVAL_OPTION)
         self.certificate_request_parameter = cls._get_config_option(
                                 conf, cls.CERTIFICATE_REQUEST_PARAMETER_OPTION)
+        self.check_tokens_max_batch = int(cls._get_config_option(
+                                conf, cls.CHECK_TOKENS_MAX_BATCH_OPTION))
         self.client_authorization_url  = cls._get_config_option(
                                 conf, cls.CLIENT_AUTHORIZATION_URL_OPTION)
         self.client_authentication_method  = cls._get_config_option(
                                 conf, cls.CLIENT_AUTHENTICATION_METHOD_OPTION)
         self.client_authorizations_env_key = cls._get_config_option(
                                 conf, cls.CLIENT_AUTHORIZATIONS_KEY_OPTION)
+        self.client_authorization_store_backend = cls._get_config_option(
+                                conf, cls.CLIENT_AUTHORIZATION_STORE_OPTION)
+        self.client_authorization_store_file = cls._get_config_option(
+                                conf, cls.CLIENT_AUTHORIZATION_STORE_FILE_OPTION)
         self.client_register_file = cls._get_config_option(
                                 conf, cls.CLIENT_REGISTER_OPTION)
+        self.metrics_path = cls._get_config_option(
+                                conf, cls.METRICS_PATH_OPTION)
+        self.rate_limit = cls._get_config_option(
+                                conf, cls.RATE_LIMIT_OPTION)
+        self.rate_limit_backend = cls._get_config_option(
+                                conf, cls.RATE_LIMIT_BACKEND_OPTION)
+        self.rate_limit_burst = cls._get_config_option(
+                                conf, cls.RATE_LIMIT_BURST_OPTION)
+        self.rate_limit_file = cls._get_config_option(
+                                conf, cls.RATE_LIMIT_FILE_OPTION)
+        self.rate_limit_max_keys = cls._get_config_option(
+                                conf, cls.RATE_LIMIT_MAX_KEYS_OPTION)
+        self.password_authentication_cache_size = cls._get_config_option(
+                        conf, cls.PASSWORD_AUTHENTICATION_CACHE_SIZE_OPTION)
+        self.password_authentication_cache_expire = cls._get_config_option(
+                        conf, cls.PASSWORD_AUTHENTICATION_CACHE_EXPIRE_OPTION)
         self.resource_authentication_method = cls._get_config_option(
                                 conf, cls.RESOURCE_AUTHENTICATION_METHOD_OPTION)
         self.resource_register_file = cls._get_config_option(
@@ -445,6 +716,24 @@ class Oauth2ServerMiddleware(object):
                                 conf, cls.MYPROXY_CLIENT_KEY_OPTION)
         self.myproxy_global_password = cls._get_config_option(
                                 conf, cls.MYPROXY_GLOBAL_PASSWORD_OPTION)
+        self.register_file_reload_interval = cls._get_config_option(
+                                conf, cls.REGISTER_FILE_RELOAD_INTERVAL_OPTION)
+        register_file_reload_on_sighup = cls._get_config_option(
+                                conf, cls.REGISTER_FILE_RELOAD_ON_SIGHUP_OPTION)
+        self.register_file_reload_on_sighup = (
+                        str(register_file_reload_on_sighup).lower() == 'true')
+        self.register_sweep_interval = cls._get_config_option(
+                                conf, cls.REGISTER_SWEEP_INTERVAL_OPTION)
+        self.register_sweep_batch_size = cls._get_config_option(
+                                conf, cls.REGISTER_SWEEP_BATCH_SIZE_OPTION)
+        self.register_sweep_max = cls._get_config_option(
+                                conf, cls.REGISTER_SWEEP_MAX_OPTION)
+        scope_wildcards = cls._get_config_option(
+                                conf, cls.SCOPE_WILDCARDS_OPTION)
+        self.scope_wildcards = str(scope_wildcards).lower() == 'true'
+        server_timing = cls._get_config_option(
+                                conf, cls.SERVER_TIMING_OPTION)
+        self.server_timing = str(server_timing).lower() == 'true'
         self.user_identifier_env_key = cls._get_config_option(
                                 conf, cls.USER_IDENTIFIER_KEY_OPTION)
         
@@ -6,6 +6,7 @@ __copyright__ = "(C) 2012 Science and Technology Facilities Council"
 __license__ = "BSD - see LICENSE file in top-level directory"
 __contact__ = "Philip.Kershaw@stfc.ac.uk"
 __revision__ = "$Id$"
+from functools import partial
 import logging
 import httplib
 import re
@@ -15,8 +16,25 @@ from webob import Request
 
 from ndg.oauth.server.wsgi.oauth2_server import Oauth2ServerMiddleware
 from ndg.oauth.server.lib.authorization_server import AuthorizationServer
+import ndg.oauth.server.lib.register.scopeutil as scopeutil
+from ndg.oauth.server.lib.utils import metrics
+from ndg.oauth.server.lib.resource_request.route_table import RouteTable
+from ndg.oauth.server.lib.validation.remote import (HTTPConnectionPool,
+                                                    RemoteTokenValidator)
+from ndg.oauth.server.lib.validation.single_flight import SingleFlight
+from ndg.oauth.server.lib.validation.token_cache import ValidatedTokenCache
 
 log = logging.getLogger(__name__)
+
+TOKEN_CHECKS = metrics.counter(
+        'ndg_oauth_resource_token_checks_total',
+        'Token checks by the resource server: cached (validated-token cache '
+        'hit), checked or coalesced with a check in progress',
+        ('result',))
+TOKEN_CHECK_DURATION = metrics.histogram(
+        'ndg_oauth_resource_token_check_duration_seconds',
+        'Time taken by token checks made by the resource server')
+
 is_iterable = lambda obj: getattr(obj, '__iter__', False) 
 
 
@@ -39,6 +57,13 @@ class Oauth2ResourceServerMiddleware(object):
     
     MATCH_SCOPE_TO_CLIENT_DN_OPTNAME = 'match_scope_to_client_dn'
     RESOURCE_URIPATHS_OPTNAME = 'resource_uripaths'
+    RESOURCE_ROUTES_OPTNAME = 'resource_routes'
+    TOKEN_CACHE_SIZE_OPTNAME = 'token_cache_size'
+    TOKEN_CACHE_POSITIVE_TTL_OPTNAME = 'token_cache_positive_ttl'
+    TOKEN_CACHE_NEGATIVE_TTL_OPTNAME = 'token_cache_negative_ttl'
+    CHECK_TOKEN_URL_OPTNAME = 'check_token_url'
+    COALESCE_TOKEN_CHECKS_OPTNAME = 'coalesce_token_checks'
+    METRICS_PATH_OPTNAME = 'metrics_path'
     
     CLAIMED_USER_ID_ENVIRON_KEY_OPTNAME = 'claimed_userid_environ_key'
     DEFAULT_CLAIMED_USER_ID_ENVIRON_KEYNAME = \
@@ -52,7 +77,27 @@ class Oauth2ResourceServerMiddleware(object):
         '__authorization_server',
         'claimed_userid_environ_key',
         '__resource_uripaths',
-        '__required_scope'
+        '__required_scope',
+        '__resource_routes',
+        '__route_table',
+        'token_cache_size',
+        'token_cache_positive_ttl',
+        'token_cache_negative_ttl',
+        '__token_cache',
+        '__token_cache_server',
+        'check_token_url',
+        'check_token_resource_id',
+        'check_token_resource_secret',
+        'check_token_certfile',
+        'check_token_keyfile',
+        'check_token_ca_certs',
+        'check_token_timeout',
+        'check_token_max_connections',
+        'check_token_pool_timeout',
+        '__remote_token_validator',
+        '__coalesce_token_checks',
+        '__token_check_flights',
+        'metrics_path'
     )
     def __init__(self, app):
         self._app = app
@@ -64,6 +109,44 @@ class Oauth2ResourceServerMiddleware(object):
         # Scope for this resource - multiple space delimited scope values may
         # be set
         self.__required_scope = None
+
+        # Table of path patterns and the scopes required for each.  If this
+        # isn't set, the table is made from resource_uripaths and
+        # required_scope.
+        self.__resource_routes = None
+        self.__route_table = None
+
+        # Cache of token validation results.  It's created on first use from
+        # these settings.
+        self.token_cache_size = ValidatedTokenCache.DEFAULT_SIZE
+        self.token_cache_positive_ttl = ValidatedTokenCache.DEFAULT_POSITIVE_TTL
+        self.token_cache_negative_ttl = ValidatedTokenCache.DEFAULT_NEGATIVE_TTL
+        self.__token_cache = None
+        self.__token_cache_server = None
+
+        # If a check_token URL is set, tokens are validated by a remote
+        # authorization server rather than one in the same WSGI pipeline.
+        self.check_token_url = None
+        self.check_token_resource_id = None
+        self.check_token_resource_secret = None
+        self.check_token_certfile = None
+        self.check_token_keyfile = None
+        self.check_token_ca_certs = None
+        self.check_token_timeout = HTTPConnectionPool.DEFAULT_TIMEOUT
+        self.check_token_max_connections = \
+                                    HTTPConnectionPool.DEFAULT_MAX_CONNECTIONS
+        self.check_token_pool_timeout = None
+        self.__remote_token_validator = None
+
+        # Concurrent checks of the same token and scope are coalesced into
+        # one lookup.
+        self.__coalesce_token_checks = True
+        self.__token_check_flights = SingleFlight(
+                                on_coalesce=partial(TOKEN_CHECKS.inc,
+                                                    'coalesced'))
+
+        # Path at which metrics are served, if set
+        self.metrics_path = None
         
     @classmethod
     def filter_app_factory(cls, app, global_conf, prefix=DEFAULT_PARAM_PREFIX,
@@ -108,7 +191,105 @@ class Oauth2ResourceServerMiddleware(object):
         else:
             raise TypeError('Expecting single string or space-separated URI '
                             'paths or an iterable; got %r instead' % type(val))
+        self.__route_table = None
+
+    @property
+    def resource_routes(self):
+        return self.__resource_routes
+
+    @resource_routes.setter
+    def resource_routes(self, val):
+        """Sets the routes as a string with a route on each line made up of
+        a path pattern followed by the scopes it requires, or as an iterable
+        of (path pattern, scope) tuples.
+        """
+        if isinstance(val, basestring):
+            routes = []
+            for line in val.splitlines():
+                fields = line.split()
+                if fields:
+                    routes.append((fields[0], ' '.join(fields[1:])))
+            self.__resource_routes = routes
+
+        elif is_iterable(val):
+            self.__resource_routes = list(val)
+        else:
+            raise TypeError('Expecting string of path pattern and scope lines '
+                            'or an iterable; got %r instead' % type(val))
+        self.__route_table = None
+
+    @property
+    def route_table(self):
+        """Table used to look up the scope required for a request path"""
+        if self.__route_table is None:
+            if self.__resource_routes is not None:
+                routes = self.__resource_routes
+            else:
+                routes = [(re_path.pattern, self.__required_scope)
+                          for re_path in self.__resource_uripaths]
+
+            # Intern the configured scopes so that they are checked as masks
+            for _, scope in routes:
+                scopeutil.scopeStringToList(scope)
+            self.__route_table = RouteTable(routes)
+
+        return self.__route_table
      
+    @property
+    def token_cache(self):
+        """Cache of token validation results"""
+        if self.__token_cache is None:
+            self.__token_cache = ValidatedTokenCache(
+                                    int(self.token_cache_size),
+                                    positive_ttl=self.token_cache_positive_ttl,
+                                    negative_ttl=self.token_cache_negative_ttl)
+        return self.__token_cache
+
+    @property
+    def coalesce_token_checks(self):
+        return self.__coalesce_token_checks
+
+    @coalesce_token_checks.setter
+    def coalesce_token_checks(self, val):
+        if isinstance(val, basestring):
+            val = val.lower() == 'true'
+        self.__coalesce_token_checks = bool(val)
+
+    @property
+    def token_check_flights(self):
+        """Token checks in progress, with counts of the checks made and of
+        those coalesced
+        """
+        return self.__token_check_flights
+
+    @property
+    def remote_token_validator(self):
+        """Validator for tokens checked by a remote authorization server, or
+        None if check_token_url isn't set
+        """
+        if self.__remote_token_validator is None and self.check_token_url:
+            self.__remote_token_validator = RemoteTokenValidator(
+                    self.check_token_url,
+                    resource_id=self.check_token_resource_id,
+                    resource_secret=self.check_token_resource_secret,
+                    timeout=self.check_token_timeout,
+                    max_connections=self.check_token_max_connections,
+                    pool_timeout=self.check_token_pool_timeout,
+                    cert_file=self.check_token_certfile,
+                    key_file=self.check_token_keyfile,
+                    ca_certs=self.check_token_ca_certs)
+        return self.__remote_token_validator
+
+    @property
+    def token_validator(self):
+        """Remote token validator if check_token_url is set, otherwise the
+        authorization server
+        """
+        remote_token_validator = self.remote_token_validator
+        if remote_token_validator is not None:
+            return remote_token_validator
+        return self.__authorization_server
+
     @property
     def authorization_server(self):
         return self.__authorization_server
@@ -131,6 +312,7 @@ class Oauth2ResourceServerMiddleware(object):
             raise TypeError('Expecting string type for "required_scope" '
                             'attribute; got %r instead' % type(val))
         self.__required_scope = val 
+        self.__route_table = None
                        
     def __call__(self, environ, start_response):
         '''Apply validation of access token for configured resource paths
@@ -141,16 +323,22 @@ class Oauth2ResourceServerMiddleware(object):
         @param start_response: standard WSGI start response function
         '''
         request = Request(environ)
+
+        if self.metrics_path and request.path_info == self.metrics_path:
+            return metrics.metrics_response(start_response)
         
-        self.authorization_server = environ.get(
+        if not self.check_token_url:
+            self.authorization_server = environ.get(
                             self.__class__.AUTHORISATION_SERVER_ENVIRON_KEYNAME)
         
-        if self._match_uripath(request.path_info):
-            return self.request_resource(request, start_response)
+        route = self.route_table.match(request.path_info)
+        if route is not None:
+            return self.request_resource(request, start_response,
+                                         required_scope=route.scope)
         else:
             return self._app(environ, start_response)
     
-    def request_resource(self, request, start_response):
+    def request_resource(self, request, start_response, required_scope=None):
         """
         Filter a resource request checking for a valid access token.  Set an
         error response if the token is invalid, otherwise pass on the request to
@@ -162,19 +350,25 @@ class Oauth2ResourceServerMiddleware(object):
         @type start_response: 
         @param start_response: WSGI start response function
 
+        @type required_scope: basestring
+        @param required_scope: scope required for the resource.  If this is
+        not set, required_scope set for the middleware applies.
+
         @rtype: iterable
         @return: WSGI response
         """
         log.debug("Oauth2ResourceServerMiddleware.request_resource called for "
                   "path %r", request.path_info)
 
+        if required_scope is None:
+            required_scope = self.required_scope
+
         # Check the token
-        token, status, error = self.authorization_server.get_registered_token(
-                                                    request, 
-                                                    scope=self.required_scope)
+        token, status, error = self._get_registered_token(request,
+                                                          required_scope)
         if not error:
             request.environ[self.claimed_userid_environ_key
-                    ] = token.grant.additional_data.get('user_identifier')
+                    ] = token.user_identifier
                             
             return self._app(request.environ, start_response)
         else:
@@ -193,6 +387,57 @@ class Oauth2ResourceServerMiddleware(object):
             start_response(status_str, headers)
             return [response]
     
+    def _get_registered_token(self, request, required_scope):
+        """Checks the token in a request, using the cache of validation
+        results if it's enabled.  A request which arrives while the same token
+        and scope are being checked for another waits for that check's result
+        unless coalesce_token_checks is False.  This has the same return
+        values as ndg.oauth.server.lib.authorization_server.\
+AuthorizationServer.get_registered_token
+        """
+        token_validator = self.token_validator
+        access_token, error = token_validator.get_request_access_token(request)
+        if error is not None:
+            return None, httplib.BAD_REQUEST, error
+
+        token_cache = self.token_cache
+        if token_cache.enabled:
+            result = token_cache.get(access_token, required_scope)
+            if result is not None:
+                TOKEN_CHECKS.inc('cached')
+                return result
+
+            # Tokens revoked by an authorization server in this process are
+            # removed from the cache immediately.
+            if self.__token_cache_server is not token_validator:
+                access_token_register = getattr(token_validator,
+                                                'access_token_register', None)
+                if access_token_register is not None:
+                    access_token_register.add_revocation_listener(
+                                                        token_cache.invalidate)
+                self.__token_cache_server = token_validator
+
+        if self.__coalesce_token_checks:
+            return self.__token_check_flights.do(
+                                    (access_token, required_scope),
+                                    self._check_access_token, token_validator,
+                                    token_cache, access_token, required_scope)
+
+        return self._check_access_token(token_validator, token_cache,
+                                        access_token, required_scope)
+
+    @staticmethod
+    def _check_access_token(token_validator, token_cache, access_token,
+                            required_scope):
+        """Checks a token and caches the result."""
+        TOKEN_CHECKS.inc('checked')
+        with TOKEN_CHECK_DURATION.time():
+            result = token_validator.check_access_token(access_token,
+                                                        required_scope)
+        if token_cache.enabled:
+            token_cache.set(access_token, required_scope, result)
+        return result
+
     def _match_uripath(self, path):
         '''Match the input request against a configured list of URI patterns
         for which this OAuth middleware should be applied
@@ -203,8 +448,4 @@ class Oauth2ResourceServerMiddleware(object):
         @return: true or false for match found
         @rtype: bool
         '''
-        for re_path in self.__resource_uripaths:
-            if re_path.match(path):
-                return True
-        
-        return False
\ No newline at end of file
+        return self.route_table.match(path) is not None
\ No newline at end of file
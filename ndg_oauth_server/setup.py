@@ -60,8 +60,21 @@ setup(
             'README', 'pki/*.pem', 'pki/ca/*.0'
         ]
     },
+    entry_points = {
+        'console_scripts': [
+            'ndg_oauth_sweep_registers = '
+                'ndg.oauth.server.lib.register.register_sweeper:main',
+            'ndg_oauth_hash_secret = '
+                'ndg.oauth.server.lib.utils.secret_hash:main',
+            'ndg_oauth_import_register = '
+                'ndg.oauth.server.lib.register.sqlite_register:main',
+            'ndg_oauth_gevent_server = '
+                'ndg.oauth.server.wsgi.gevent_server:main'
+        ]
+    },
     extras_require = {
-        'test-services': ['Genshi==0.6']
+        'test-services': ['Genshi==0.6'],
+        'gevent': ['gevent']
     },
     zip_safe = False,
     classifiers = [